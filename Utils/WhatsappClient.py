@@ -1,341 +1,309 @@
-import uuid
-from Utils import constants
+import asyncio
+import json
+from Utils import constants, metrics, delivery_metrics
 import aiohttp
 
-def process_incoming_messages(data):
-    transformed_messages = []
-    for entry in data.get("entry", []):
-        for change in entry.get("changes", []):
-            if change["value"]["metadata"]["phone_number_id"] != constants.WHATSAPP_NUMBER_ID:
-                return transformed_messages
-            message_data = change.get("value", {}).get("messages", [])
-            for message in message_data:
-                # Generate a unique message ID
-                message_sid = message.get("id", str(uuid.uuid4()))
-                if message.get("errors"):
-                    # If there's an error in the message, skip processing
-                    continue
-                # Extract sender's phone number
-                from_number = message.get("from", "Unknown")
-
-                # Extract text message (if exists)
-                body = message.get("text", {}).get("body", "")
-                # Count media attachments
-                media_types = ["image", "text", "interactive"]
-                invalid_media = False
-                if message.get("type") not in media_types:
-                    invalid_media = True
-               
-                interactive_reply = message.get("interactive",None)
-                button_pressed = None
-                list_item_pressed = None
-                if interactive_reply and interactive_reply["type"] == "button_reply":
-                    button_pressed = interactive_reply["button_reply"]
-                if interactive_reply and interactive_reply["type"] == "list_reply":
-                    list_item_pressed = interactive_reply["list_reply"]
-                # Extract media URLs if present
-                media_urls = []
-                media_types = ["image"]
-                num_media = sum(1 for media in media_types if media in message)
-
-                for index, media in enumerate(media_types):
-                    if media in message:
-                        media_id = message.get(media)
-                        if media_id:
-                            media_id = media_id.get("id")
-                            if media_id:
-                                media_urls.append(
-                                    (f"MediaID{index}", media_id)
-                                )
-
-                # Twilio-like transformed request format
-                transformed_message = {
-                    "SmsMessageSid": message_sid,
-                    "NumMedia": str(num_media),
-                    "From": from_number,
-                    "Body": body,
-                    "InvalidMedia": invalid_media,
-                }
-                # Add media URLs if available
-                transformed_message.update(dict(media_urls))
-                transformed_messages.append(transformed_message)
-                if button_pressed:
-                    transformed_message["reply"] = button_pressed
-                if list_item_pressed:
-                    transformed_message["list_reply"] = list_item_pressed
-    return transformed_messages
+try:
+    import orjson
+except ImportError:  # optional, the standard library encoder is the fallback
+    orjson = None
 
 
-class WhatsappClient:
-    def __init__(self):
-        self.headers = {
-            "Authorization": f"Bearer {constants.WHATSAPP_API_KEY}"
-        }
+def dumps(payload) -> bytes:
+    """Serialize a Graph API payload to compact UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
-    async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
-        return self
 
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
-    async def send_typing_indicator(self, client_number: str,message_id:str):
-        data = {
-            "messaging_product": "whatsapp",
-            "status":"read",
-            "message_id": message_id,
-            "typing_indicator": {
-                "type": "text",
-            }
-        }
-        response = await self.session.post(f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages", headers=self.headers, json=data)
-        result = await response.json()
-        return result
-    async def send_image_to_client(self, client_number: str, image_url: str, message_body: str = None):
-        data = {
-            "messaging_product": "whatsapp",
-            "to": client_number,
-            "type": "image",
-            "image": {
-                "link": image_url,
-                "caption": message_body
-            }
-        }
-        response = await self.session.post(f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages", headers=self.headers, json=data)
-        result = await response.json()
-        return result
-    async def send_image_to_client_using_id(self, client_number: str, image_id: int, message_body: str = None):
-        data = {
-            "messaging_product": "whatsapp",
-            "to": client_number,
-            "type": "image",
-            "image": {
-                "id": image_id,
-                "caption": message_body
-            }
-        }
-        response = await self.session.post(f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages", headers=self.headers, json=data)
-        result = await response.json()
-        return result
-    async def reply_to_message(self, client_number: str, message_body: str, message_id: str):
-        data = {
-            "messaging_product": "whatsapp",
-            "to": client_number,
+# Graph API payload builders. Kept free of I/O so that the message catalogue can
+# pre-build and pre-serialize the static messages once.
+
+def build_typing_indicator(message_id: str) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "status": "read",
+        "message_id": message_id,
+        "typing_indicator": {
             "type": "text",
-            "text": {
-                "body": message_body
-            },
-            "context": {
-                "message_id": message_id
-            }
         }
-        response = await self.session.post(f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages", headers=self.headers, json=data)
-        result = await response.json()
-        return result
+    }
 
-    async def send_interactive_reply_image(self, client_number: str, image_url: str, message_body: str,button_id:int,button_text:str,additional_button_id:str=None,additional_button_text:str=None):
-        data = {
-          "messaging_product": "whatsapp",
-          "recipient_type": "individual",
-          "to": client_number,
-          "type": "interactive",
-          "interactive": {
+
+def build_image(client_number: str, image_url: str = None, message_body: str = None, image_id: int = None) -> dict:
+    image = {"id": image_id} if image_id is not None else {"link": image_url}
+    image["caption"] = message_body
+    return {
+        "messaging_product": "whatsapp",
+        "to": client_number,
+        "type": "image",
+        "image": image
+    }
+
+
+def build_reply(client_number: str, message_body: str, message_id: str) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "to": client_number,
+        "type": "text",
+        "text": {
+            "body": message_body
+        },
+        "context": {
+            "message_id": message_id
+        }
+    }
+
+
+def _reply_buttons(button_id, button_text, additional_button_id=None, additional_button_text=None) -> list:
+    buttons = [{"type": "reply", "reply": {"id": button_id, "title": button_text}}]
+    if additional_button_id and additional_button_text:
+        buttons.append({"type": "reply", "reply": {"id": additional_button_id, "title": additional_button_text}})
+    return buttons
+
+
+def build_interactive_reply_image(client_number: str, image_url: str, message_body: str, button_id, button_text: str,
+                                  additional_button_id=None, additional_button_text: str = None) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": client_number,
+        "type": "interactive",
+        "interactive": {
             "type": "button",
             "header": {
-                "type":"image",
+                "type": "image",
                 "image": {
                     "link": image_url,
                 }
             },
             "body": {
-              "text": message_body
+                "text": message_body
             },
             "footer": {
-              "text": ""
+                "text": ""
             },
             "action": {
-              "buttons": [
-                {
-                  "type": "reply",
-                  "reply": {
-                    "id": button_id,
-                    "title": button_text
-                  }
-                },
-                ({
-                    "type": "reply",
-                    "reply": {
-                        "id": additional_button_id,
-                        "title": additional_button_text
-                    }
-                }) if additional_button_id and additional_button_text else None
-              ]
+                "buttons": _reply_buttons(button_id, button_text, additional_button_id, additional_button_text)
             }
-          }
         }
-        response = await self.session.post(f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages", headers=self.headers, json=data)
-        result = await response.json()
-        return result
-    async def send_interactive_reply_message(self, client_number: str, message_body: str,button_id:int,button_text:str, title:str,additional_button_id:int=None,additional_button_text:str=None):
-        data = {
-          "messaging_product": "whatsapp",
-          "recipient_type": "individual",
-          "to": client_number,
-          "type": "interactive",
-          "interactive": {
+    }
+
+
+def build_interactive_reply_message(client_number: str, message_body: str, button_id, button_text: str, title: str,
+                                    additional_button_id=None, additional_button_text: str = None) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": client_number,
+        "type": "interactive",
+        "interactive": {
             "type": "button",
             "header": {
                 "type": "text",
                 "text": title
             },
             "body": {
-              "text": message_body
+                "text": message_body
             },
             "footer": {
-              "text": ""
+                "text": ""
             },
             "action": {
-              "buttons": [
-                {
-                  "type": "reply",
-                  "reply": {
-                    "id": button_id,
-                    "title": button_text
-                  }
-                },
-                
-                ({
-                    "type": "reply",
-                    "reply": {
-                        "id": additional_button_id,
-                        "title": additional_button_text
-                    }
-                }) if additional_button_id and additional_button_text else None
-              ]
+                "buttons": _reply_buttons(button_id, button_text, additional_button_id, additional_button_text)
             }
-          }
         }
-        response = await self.session.post(f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages", headers=self.headers, json=data)
-        result = await response.json()
-        return result
-    async def send_interactive_url(self,client_number:str,header_text:str,message_body:str,footer_text:str,url_button_text:str,url_link:str):
-        data = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": client_number,
-            "type": "interactive",
-            "interactive": {
-                "type": "cta_url",
-                "header": {
-                    "type": "text",
-                    "text": header_text
-                },
-                "body": {
-                    "text": message_body
-                },
-                "footer": {
-                    "text": footer_text
-                },
-                "action": {
-                    "name": "cta_url",
-                    "parameters": {
-                        "display_text": url_button_text,
-                        "url": url_link
-                    }
+    }
+
+
+def build_interactive_url(client_number: str, header_text: str, message_body: str, footer_text: str,
+                          url_button_text: str, url_link: str) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": client_number,
+        "type": "interactive",
+        "interactive": {
+            "type": "cta_url",
+            "header": {
+                "type": "text",
+                "text": header_text
+            },
+            "body": {
+                "text": message_body
+            },
+            "footer": {
+                "text": footer_text
+            },
+            "action": {
+                "name": "cta_url",
+                "parameters": {
+                    "display_text": url_button_text,
+                    "url": url_link
                 }
             }
-       }
-        response = await self.session.post(f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages", headers=self.headers, json=data)
-        result = await response.json()
-        return result
-   
-    async def send_interactive_list_message(self, client_number: str, header_text: str, message_body: str,footer_text:str, button_text: str, options: dict):
-        # Dynamically create rows based on the options list
-        rows = [{"id": key, "title": value} for key, value in options.items()]
-
-        data = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": client_number,
-            "type": "interactive",
-            "interactive": {
-                "type": "list",
-                "header": {
-                    "type": "text",
-                    "text": header_text
-                },
-                "body": {
-                    "text": message_body
-                },
-                "footer": {
-                    "text": footer_text
-                },
-                "action": {
-                    "button": button_text,
-                    "sections": [
-                        {
-                            "title": "Select your option",
-                            "rows": rows
-                        }
-                    ]
-                }
+        }
+    }
+
+
+def build_interactive_list(client_number: str, header_text: str, message_body: str, footer_text: str,
+                           button_text: str, options: dict) -> dict:
+    # Dynamically create rows based on the options list
+    rows = [{"id": key, "title": value} for key, value in options.items()]
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": client_number,
+        "type": "interactive",
+        "interactive": {
+            "type": "list",
+            "header": {
+                "type": "text",
+                "text": header_text
+            },
+            "body": {
+                "text": message_body
+            },
+            "footer": {
+                "text": footer_text
+            },
+            "action": {
+                "button": button_text,
+                "sections": [
+                    {
+                        "title": "Select your option",
+                        "rows": rows
+                    }
+                ]
+            }
+        }
+    }
+
+
+def build_text(client_number: str, message_body: str) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "to": client_number,
+        "recipient_type": "individual",
+        "text":
+            {
+                "body": message_body
             }
+    }
+
+
+def build_reaction(client_number: str, message_id: str, emoji: str) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": f"{client_number}",
+        "type": "reaction",
+        "reaction": {
+            "message_id": f"{message_id}",
+            "emoji": f"{emoji}"
+        }
+    }
+
+
+def build_video(client_number: str, video_url: str, message_body: str = None) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": client_number,
+        "type": "video",
+        "video": {
+            "link": video_url,
+            "caption": message_body
         }
-        response = await self.session.post(f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages", headers=self.headers, json=data)
-        result = await response.json()
-        return result
+    }
+
+
+class WhatsappClient:
+    def __init__(self):
+        self.headers = {
+            "Authorization": f"Bearer {constants.WHATSAPP_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        self._send_after = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession()
+        return self
+
+    def send_after(self, task: asyncio.Task) -> None:
+        """Hold the next message back until `task` (e.g. a background typing indicator) is done, keeping their order"""
+        self._send_after = task
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.session:
+            await self.session.close()
+
+    async def send_raw(self, payload: bytes, kind: str):
+        """
+        Send an already serialized message payload
+        :param kind: Message kind the delivery latency of this message is reported under,
+            the catalogue name for messages of Utils/message_catalogue.py.
+        """
+        gate = self._send_after
+        if gate is not None and gate is not asyncio.current_task():
+            self._send_after = None
+            # Waits without raising, a failed typing indicator must not fail the reply
+            await asyncio.wait((gate,))
+        url = f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages"
+        async with metrics.track_upstream(url) as call:
+            response = await self.session.post(url, headers=self.headers, data=payload)
+            if not response.ok:
+                call.outcome = "http_error"
+            body = await response.json()
+        # Responses without message ids, e.g. to typing indicators, record nothing
+        delivery_metrics.record_sent(body, kind)
+        return body
+
+    async def _post_message(self, data: dict, kind: str):
+        return await self.send_raw(dumps(data), kind=kind)
+
+    async def send_typing_indicator(self, client_number: str,message_id:str):
+        return await self._post_message(build_typing_indicator(message_id), "typing_indicator")
+    async def send_image_to_client(self, client_number: str, image_url: str, message_body: str = None):
+        return await self._post_message(build_image(client_number, image_url, message_body), "image")
+    async def send_image_to_client_using_id(self, client_number: str, image_id: int, message_body: str = None):
+        return await self._post_message(build_image(client_number, message_body=message_body, image_id=image_id), "image")
+    async def reply_to_message(self, client_number: str, message_body: str, message_id: str):
+        return await self._post_message(build_reply(client_number, message_body, message_id), "reply")
+
+    async def send_interactive_reply_image(self, client_number: str, image_url: str, message_body: str,button_id:int,button_text:str,additional_button_id:str=None,additional_button_text:str=None):
+        return await self._post_message(build_interactive_reply_image(
+            client_number, image_url, message_body, button_id, button_text, additional_button_id, additional_button_text), "interactive_reply_image")
+    async def send_interactive_reply_message(self, client_number: str, message_body: str,button_id:int,button_text:str, title:str,additional_button_id:int=None,additional_button_text:str=None):
+        return await self._post_message(build_interactive_reply_message(
+            client_number, message_body, button_id, button_text, title, additional_button_id, additional_button_text), "interactive_reply_message")
+    async def send_interactive_url(self,client_number:str,header_text:str,message_body:str,footer_text:str,url_button_text:str,url_link:str):
+        return await self._post_message(build_interactive_url(
+            client_number, header_text, message_body, footer_text, url_button_text, url_link), "interactive_url")
+   
+    async def send_interactive_list_message(self, client_number: str, header_text: str, message_body: str,footer_text:str, button_text: str, options: dict):
+        return await self._post_message(build_interactive_list(
+            client_number, header_text, message_body, footer_text, button_text, options), "interactive_list")
 
     async def send_message_to_client(self, client_number: str, message_body: str):
         # Send a response message back to the sender
-        data = {
-            "messaging_product": "whatsapp",
-            "to": client_number,
-            "recipient_type": "individual",
-            "text":
-                {
-                    "body": message_body
-                }
-        }
-        response = await self.session.post(f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages", headers=self.headers, json=data)
-        result = await response.json()
-        return result
+        return await self._post_message(build_text(client_number, message_body), "text")
     
     async def send_reaction_message(self, client_number: str, message_id: str, emoji:str):
-        data = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": f"{client_number}",
-            "type": "reaction",
-            "reaction": {
-                "message_id": f"{message_id}",
-                "emoji": f"{emoji}"
-            }
-        }
-        response = await self.session.post(f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages", headers=self.headers, json=data)
-        result = await response.json()
-        return result
+        return await self._post_message(build_reaction(client_number, message_id, emoji), "reaction")
     async def send_whatsapp_video(self, client_number: str, video_url: str, message_body: str = None):
-        data = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": client_number,
-            "type": "video",
-            "video": {
-                "link": video_url,
-                "caption": message_body
-            }
-        }
-        response = await self.session.post(f"{constants.WHATSAPP_API_URL}/{constants.WHATSAPP_NUMBER_ID}/messages", headers=self.headers, json=data)
-        result = await response.json()
-        return result
+        return await self._post_message(build_video(client_number, video_url, message_body), "video")
     
-    async def get_whatsapp_image(self, media_id: int):
+    async def get_whatsapp_image(self, media_id: str):
         # Send a response message back to the sender
-        response = await self.session.get(f"{constants.WHATSAPP_API_URL}/{media_id}", headers=self.headers)
-        response = await response.json()
+        media_url = f"{constants.WHATSAPP_API_URL}/{media_id}"
+        async with metrics.track_upstream(media_url):
+            response = await self.session.get(media_url, headers=self.headers)
+            response = await response.json()
         image_url = response.get("url")
-        image_response = await self.session.get(image_url, headers=self.headers)
-        image_data = await image_response.read()
+        async with metrics.track_upstream(image_url):
+            image_response = await self.session.get(image_url, headers=self.headers)
+            image_data = await image_response.read()
         return image_data
 
 
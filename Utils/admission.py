@@ -0,0 +1,147 @@
+"""
+Adaptive admission control for the webhook endpoints.
+
+host.json caps the host at maxConcurrentRequests, but past a point more
+concurrency only makes every request slower: when Astria or WhatsApp slow down,
+requests pile up in aiohttp_retry sleeps until the function timeout. This worker
+keeps its own limit on webhooks in flight and adjusts it AIMD-style: it grows by
+one per limit's worth of requests that finish within
+ADMISSION_LATENCY_TARGET_SECONDS, and shrinks by ADMISSION_BACKOFF when one is
+slower, fails, or an upstream call it makes is slower than
+ADMISSION_UPSTREAM_TARGET_SECONDS or fails. Shrinking happens at most once per
+latency target, so a burst of slow completions counts as one signal.
+
+Only latencies the limit can do something about are signals: upstream calls made
+outside an admitted webhook (background jobs, the tune poller, the outbox relay)
+are ignored, and routes that are slow by design, like the bulk image deliveries
+of pack-tune-received, are admitted with `observed=False` and feed nothing back.
+
+A webhook over the limit is answered with 503 and a Retry-After header at once.
+Meta and Astria redeliver webhooks that weren't accepted, so the work is
+deferred to their retry queues rather than lost, and nothing was claimed yet that
+would make the redelivery look like a duplicate.
+"""
+import contextvars
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
+from Utils import constants, metrics
+
+BUSY_STATUS = 503
+
+ADMISSION_TOTAL = metrics.REGISTRY.register(metrics.Counter(
+    "astria_admission_total", "Webhooks by route and admission outcome (admitted, rejected)", ["route", "outcome"]))
+CONCURRENCY_LIMIT = metrics.REGISTRY.register(metrics.Gauge(
+    "astria_admission_limit", "Current adaptive limit on webhooks in flight in this worker"))
+IN_FLIGHT = metrics.REGISTRY.register(metrics.Gauge(
+    "astria_admission_in_flight", "Webhooks being handled by this worker"))
+
+# Whether the upstream calls of the current task are signals for the limit, set by `admitted`
+_OBSERVED = contextvars.ContextVar("admission_observed", default=False)
+
+
+class AdaptiveLimit:
+    """A concurrency limit that grows additively while requests are fast and shrinks multiplicatively when not"""
+
+    def __init__(self, initial: float, min_limit: float, max_limit: float, latency_target: float,
+                 upstream_target: float, backoff: float):
+        self.limit = float(initial)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.latency_target = latency_target
+        self.upstream_target = upstream_target
+        self.backoff = backoff
+        self.in_flight = 0
+        self._last_decrease = float("-inf")
+        # Upstream observations arrive from whatever thread made the call
+        self._lock = threading.Lock()
+        self._publish()
+
+    def _publish(self) -> None:
+        CONCURRENCY_LIMIT.set(int(self.limit))
+        IN_FLIGHT.set(self.in_flight)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            self._publish()
+            return True
+
+    def release(self, seconds: float, ok: bool, observed: bool = True) -> None:
+        with self._lock:
+            busy = self.in_flight >= self.limit / 2
+            self.in_flight -= 1
+            if not observed:
+                self._publish()
+                return
+            if ok and seconds <= self.latency_target:
+                # One more slot per limit's worth of fast requests, only while the limit is
+                # being used, or a quiet period would leave it far above what was ever tested
+                if busy:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            else:
+                self._decrease()
+            self._publish()
+
+    def observe_upstream(self, upstream: str, seconds: float, outcome: str) -> None:
+        if not _OBSERVED.get() or (outcome == "ok" and seconds <= self.upstream_target):
+            return
+        with self._lock:
+            self._decrease()
+            self._publish()
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        limit = max(self.min_limit, self.limit * self.backoff)
+        if int(limit) < int(self.limit):
+            logging.warning(f"Overloaded, admitting at most {int(limit)} webhooks at once")
+        self.limit = limit
+
+
+LIMIT = AdaptiveLimit(
+    initial=float(constants.ADMISSION_INITIAL_LIMIT),
+    min_limit=float(constants.ADMISSION_MIN_LIMIT),
+    max_limit=float(constants.ADMISSION_MAX_LIMIT),
+    latency_target=float(constants.ADMISSION_LATENCY_TARGET_SECONDS),
+    upstream_target=float(constants.ADMISSION_UPSTREAM_TARGET_SECONDS),
+    backoff=float(constants.ADMISSION_BACKOFF),
+)
+metrics.UPSTREAM_OBSERVERS.append(LIMIT.observe_upstream)
+
+
+def retry_after() -> str:
+    """Value of the Retry-After header of a busy response"""
+    return constants.ADMISSION_RETRY_AFTER_SECONDS
+
+
+@asynccontextmanager
+async def admitted(route: str, observed: bool = True):
+    """
+    Hold a slot for a webhook while it is handled.
+    Yields False if the worker is saturated; the caller should then answer BUSY_STATUS.
+    :param observed: Whether the webhook's latency and upstream calls adjust the limit,
+    False for routes that are slow by design.
+    """
+    if not constants.ADMISSION_ENABLED:
+        yield True
+        return
+    if not LIMIT.try_acquire():
+        ADMISSION_TOTAL.inc(route=route, outcome="rejected")
+        yield False
+        return
+    ADMISSION_TOTAL.inc(route=route, outcome="admitted")
+    started = time.perf_counter()
+    token = _OBSERVED.set(observed)
+    ok = False
+    try:
+        yield True
+        ok = True
+    finally:
+        _OBSERVED.reset(token)
+        LIMIT.release(time.perf_counter() - started, ok, observed)
@@ -1,14 +1,16 @@
 import asyncio
 import aiohttp
+from Utils import metrics
 
 async def get_with_retry(url, session, headers, retries=3, delay=2):
     for attempt in range(retries):
         try:
-            async with session.get(url, headers=headers) as response:
-                if response.ok:
-                    return await response.json()
-                else:
-                    pass
+            async with metrics.track_upstream(url) as call:
+                async with session.get(url, headers=headers) as response:
+                    if response.ok:
+                        return await response.json()
+                    else:
+                        call.outcome = "http_error"
         except aiohttp.ClientError as e:
             pass
         if attempt < retries - 1:
@@ -18,11 +20,12 @@ async def get_with_retry(url, session, headers, retries=3, delay=2):
 async def post_with_retry(url, session, headers, data, retries=3, delay=2):
     for attempt in range(retries):
         try:
-            async with session.post(url, headers=headers, data=data) as response:
-                if response.ok:
-                    return await response.json()
-                else:
-                    pass
+            async with metrics.track_upstream(url) as call:
+                async with session.post(url, headers=headers, data=data) as response:
+                    if response.ok:
+                        return await response.json()
+                    else:
+                        call.outcome = "http_error"
         except aiohttp.ClientError as e:
             pass
         if attempt < retries - 1:
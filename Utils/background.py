@@ -0,0 +1,88 @@
+"""
+Supervised fire-and-forget side effects.
+
+Typing indicators, read receipts, reactions and similar calls the user never
+waits on are started with `spawn` and run concurrently with the handler instead
+of in front of it. The supervisor keeps a strong reference to every task (the
+event loop only keeps weak ones, so an unreferenced task can be garbage
+collected mid-flight), refuses new ones beyond BACKGROUND_MAX_IN_FLIGHT rather
+than piling up work behind a slow Graph API, logs failures, and `drain` waits
+for the tasks still running on shutdown.
+
+Only the ASGI entry point (shared/asgi.py) calls `drain`. The Functions host has
+no shutdown hook, so there a task still running when the host recycles is lost.
+Nothing is retried either way: side effects the user must get, like the closing
+message after their images, are jobs (shared/jobs.py) instead.
+"""
+import asyncio
+import logging
+from Utils import constants, metrics
+
+BACKGROUND_TASKS_TOTAL = metrics.REGISTRY.register(metrics.Counter(
+    "astria_background_tasks_total", "Background side effects by name and outcome (ok, error, dropped, cancelled)",
+    ["name", "outcome"]))
+
+
+class Supervisor:
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def spawn(self, coro, name: str):
+        """
+        Run `coro` in the background.
+        :param name: Label for logs and metrics, e.g. "typing_indicator".
+        :return: The task, or None if too many are in flight and `coro` was dropped.
+        """
+        if len(self._tasks) >= self.max_in_flight:
+            coro.close()
+            BACKGROUND_TASKS_TOTAL.inc(name=name, outcome="dropped")
+            logging.warning(f"Dropped background {name}, {len(self._tasks)} tasks in flight")
+            return None
+        task = asyncio.get_running_loop().create_task(coro, name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if task.cancelled():
+            outcome = "cancelled"
+        elif task.exception() is not None:
+            outcome = "error"
+            logging.error(f"Background {task.get_name()} failed: {task.exception()!r}")
+        else:
+            outcome = "ok"
+        BACKGROUND_TASKS_TOTAL.inc(name=task.get_name(), outcome=outcome)
+
+    async def drain(self, timeout: float = None) -> int:
+        """
+        Wait for the tasks in flight, cancelling those still running after `timeout` seconds.
+        :return: The number of tasks cancelled.
+        """
+        if timeout is None:
+            timeout = float(constants.BACKGROUND_DRAIN_SECONDS)
+        pending = set(self._tasks)
+        if not pending:
+            return 0
+        _, still_running = await asyncio.wait(pending, timeout=timeout)
+        for task in still_running:
+            task.cancel()
+        if still_running:
+            await asyncio.wait(still_running)
+            logging.warning(f"Cancelled {len(still_running)} background tasks still running after {timeout}s")
+        return len(still_running)
+
+
+SUPERVISOR = Supervisor(int(constants.BACKGROUND_MAX_IN_FLIGHT))
+
+
+def spawn(coro, name: str):
+    return SUPERVISOR.spawn(coro, name)
+
+
+async def drain(timeout: float = None) -> int:
+    return await SUPERVISOR.drain(timeout)
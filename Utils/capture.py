@@ -0,0 +1,212 @@
+"""
+Opt-in capture of webhook traffic, replayed offline with tests/load/replay.py.
+
+With CAPTURE_ENABLED=true every webhook body is anonymized and appended, with its
+arrival time, to JSONL files in CAPTURE_DIR. Files rotate hourly and at
+CAPTURE_MAX_BYTES. Phone numbers are replaced by an HMAC keyed with
+CAPTURE_HMAC_KEY, so a user keeps the same pseudonym across files and replicas
+without the number being recoverable. Wherever else a known number appears in
+the body, e.g. in Astria's callback URLs and tune titles, it is replaced by the
+same pseudonym. Names and text are blanked, and media ids, hashes and URLs are
+stripped.
+
+Webhooks are anonymized on the request, but written by a thread of their own so
+that file I/O never blocks the event loop. Up to CAPTURE_QUEUE_SIZE records wait
+for it; past that, records are dropped rather than slowing webhooks down.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import socket
+import threading
+import time
+from Utils import constants
+
+ROUTE_WHATSAPP = "SmsReceived"
+ROUTE_PAYMENT = "payment-received"
+ROUTE_PACK_IMAGES = "pack-tune-received"
+
+CAPTURE_QUEUE_SIZE = 10_000
+# Astria callbacks carry the user's number as a query parameter
+_PHONE_PARAM = re.compile(r"(phone_number=)([^&#\s]+)")
+# ... and the function key they are called with
+_KEY_PARAM = re.compile(r"([?&]code=)[^&#\s]+")
+
+_queue = queue.Queue(maxsize=CAPTURE_QUEUE_SIZE)
+_writer = None
+_writer_lock = threading.Lock()
+_file = None
+_file_hour = None
+_key = None
+
+
+def _hmac_key() -> bytes:
+    global _key
+    if _key is None:
+        if constants.CAPTURE_HMAC_KEY:
+            _key = constants.CAPTURE_HMAC_KEY.encode()
+        else:
+            # Pseudonyms then only match within this process
+            logging.warning("CAPTURE_HMAC_KEY is not set, using a random key for this worker")
+            _key = secrets.token_bytes(32)
+    return _key
+
+
+def pseudonym(phone) -> str:
+    if not phone:
+        return phone
+    digest = hmac.new(_hmac_key(), str(phone).encode(), hashlib.sha256).hexdigest()
+    return f"u{digest[:20]}"
+
+
+def _blank(text: str) -> str:
+    # Keeps the length, which is all that matters for load
+    return "x" * len(text) if isinstance(text, str) else text
+
+
+def _scrub(value, replacements: dict):
+    """
+    Apply `replacements` ({text: replacement}) to every string in `value`, pseudonymize
+    every phone_number= parameter and strip every function key.
+    """
+    if isinstance(value, str):
+        # Parameters first, a number already replaced by its pseudonym would be hashed twice
+        value = _PHONE_PARAM.sub(lambda match: match.group(1) + pseudonym(match.group(2)), value)
+        value = _KEY_PARAM.sub(r"\1stripped", value)
+        for text, replacement in replacements.items():
+            value = value.replace(text, replacement)
+        return value
+    if isinstance(value, dict):
+        return {key: _scrub(item, replacements) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_scrub(item, replacements) for item in value]
+    return value
+
+
+def _pseudonyms(phones) -> dict:
+    return {str(phone): pseudonym(str(phone)) for phone in phones if phone}
+
+
+def _anonymize_whatsapp(body: dict) -> tuple:
+    user = None
+    phones = set()
+    for entry in body.get("entry", ()):
+        for change in entry.get("changes", ()):
+            value = change.get("value") or {}
+            for contact in value.get("contacts", ()):
+                phones.add(contact.get("wa_id"))
+                contact["wa_id"] = pseudonym(contact.get("wa_id"))
+                contact.pop("profile", None)
+            for message in value.get("messages", ()):
+                phones.add(message.get("from"))
+                message["from"] = user = pseudonym(message.get("from"))
+                if "text" in message:
+                    message["text"]["body"] = _blank(message["text"].get("body", ""))
+                for media_type in ("image", "video", "audio", "document", "sticker"):
+                    media = message.get(media_type)
+                    if isinstance(media, dict):
+                        message[media_type] = {"id": f"media-{secrets.token_hex(6)}",
+                                               "mime_type": media.get("mime_type")}
+            for status in value.get("statuses", ()):
+                phones.add(status.get("recipient_id"))
+                status["recipient_id"] = user = pseudonym(status.get("recipient_id"))
+    return _scrub(body, _pseudonyms(phones)), user
+
+
+def _anonymize_payment(body: dict) -> tuple:
+    properties = body.get("Properties") or {}
+    phones = properties.get("Property_M-5") or []
+    names = properties.get("Property_M-10") or []
+    properties["Property_M-5"] = [pseudonym(phone) for phone in phones]
+    if "Property_M-10" in properties:
+        properties["Property_M-10"] = [_blank(name) for name in names]
+    # Either may be repeated elsewhere in the notification, e.g. in the payer's details
+    replacements = _pseudonyms(phones)
+    replacements.update({name: _blank(name) for name in names if isinstance(name, str) and name})
+    return _scrub(body, replacements), properties["Property_M-5"][0] if properties["Property_M-5"] else None
+
+
+def _anonymize_pack_images(body, params: dict) -> tuple:
+    prompts = body if isinstance(body, list) else [body.get("prompt") or {}]
+    for prompt in prompts:
+        if isinstance(prompt, dict) and "images" in prompt:
+            prompt["images"] = [f"stripped://image/{i}" for i in range(len(prompt["images"]))]
+    phone = params.get("phone_number")
+    # Tune titles are the number, and callback URLs carry it as phone_number=
+    return _scrub(body, _pseudonyms([phone])), pseudonym(phone)
+
+
+def _open_capture_file(hour: str):
+    global _file, _file_hour
+    if _file is not None:
+        _file.close()
+    os.makedirs(constants.CAPTURE_DIR, exist_ok=True)
+    name = f"capture-{socket.gethostname()}-{os.getpid()}-{hour}-{int(time.time() * 1000)}.jsonl"
+    _file = open(os.path.join(constants.CAPTURE_DIR, name), "a", encoding="utf-8")
+    _file_hour = hour
+
+
+def _write(line: str) -> None:
+    hour = time.strftime("%Y%m%d%H", time.gmtime())
+    if _file is None or _file_hour != hour or _file.tell() >= int(constants.CAPTURE_MAX_BYTES):
+        _open_capture_file(hour)
+    _file.write(line)
+    _file.write("\n")
+
+
+def _write_forever() -> None:
+    while True:
+        line = _queue.get()
+        try:
+            _write(line)
+            # Flushed once the backlog is written rather than per line
+            if _queue.empty():
+                _file.flush()
+        except Exception as e:
+            logging.warning(f"Failed to write webhook capture: {e}")
+
+
+def _append(line: str) -> None:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write_forever, name="webhook-capture", daemon=True)
+                _writer.start()
+    try:
+        _queue.put_nowait(line)
+    except queue.Full:
+        logging.warning("Webhook capture is falling behind, dropping a record")
+
+
+def record(route: str, body: bytes, params: dict = None) -> None:
+    """
+    Append an anonymized webhook to the capture, if capturing is enabled.
+    Never raises: a capture problem must not fail the webhook.
+    """
+    if not constants.CAPTURE_ENABLED:
+        return
+    arrived_at = time.time()
+    params = dict(params or {})
+    try:
+        data = json.loads(body) if body else {}
+        if route == ROUTE_WHATSAPP:
+            data, user = _anonymize_whatsapp(data)
+        elif route == ROUTE_PAYMENT:
+            data, user = _anonymize_payment(data)
+        elif route == ROUTE_PACK_IMAGES:
+            data, user = _anonymize_pack_images(data, params)
+            params["phone_number"] = user
+        else:
+            return
+        # Function keys and other query parameters are never written
+        params = {"phone_number": params["phone_number"]} if "phone_number" in params else {}
+        _append(json.dumps({"t": arrived_at, "route": route, "user": user, "params": params, "body": data},
+                           ensure_ascii=False, separators=(",", ":")))
+    except Exception as e:
+        logging.warning(f"Failed to capture {route} webhook: {e}")
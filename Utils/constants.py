@@ -19,6 +19,13 @@ SUMIT_COMPANY_ID = os.environ.get("SUMIT_COMPANY_ID")
 DB_HOST = os.environ.get("DB_HOST")
 DB_USER = os.environ.get("DB_USER")
 DB_PASSWORD = os.environ.get("DB_PASSWORD")
+# libpq sslmode, e.g. disable for a local database
+DB_SSL = os.environ.get("DB_SSL", "require")
+DB_POOL_MIN_SIZE = os.environ.get("DB_POOL_MIN_SIZE", "1")
+DB_POOL_MAX_SIZE = os.environ.get("DB_POOL_MAX_SIZE", "10")
+# Per-worker cache of users rows, a TTL of 0 disables it
+USER_CACHE_TTL_SECONDS = os.environ.get("USER_CACHE_TTL_SECONDS", "300")
+USER_CACHE_MAX_SIZE = os.environ.get("USER_CACHE_MAX_SIZE", "10000")
 IMAGE_GUIDE_URL = os.environ.get("IMAGE_GUIDE_URL")
 RECOMMENDED_PHOTOS = os.environ.get("RECOMMENDED_PHOTOS")   
 FIXED_PRICE = os.environ.get("FIXED_PRICE")
@@ -29,4 +36,66 @@ PREMIUM_TIER_PRICE = os.environ.get("PREMIUM_TIER_PRICE")
 LITE_TIER_PAYMENT_LINK = os.environ.get("LITE_TIER_PAYMENT_LINK")
 STANDARD_TIER_PAYMENT_LINK = os.environ.get("STANDARD_TIER_PAYMENT_LINK")
 PREMIUM_TIER_PAYMENT_LINK = os.environ.get("PREMIUM_TIER_PAYMENT_LINK")
-STORAGE_BLOB_URL = os.environ.get("STORAGE_BLOB_URL")
\ No newline at end of file
+STORAGE_BLOB_URL = os.environ.get("STORAGE_BLOB_URL")
+# Record send -> delivered -> read latency of outbound WhatsApp messages
+DELIVERY_METRICS_ENABLED = os.environ.get("DELIVERY_METRICS_ENABLED", "true").lower() == "true"
+# Retention of the tables that grow with traffic, see db/db_maintenance.py
+RETENTION_MSGS_DAYS = os.environ.get("RETENTION_MSGS_DAYS", "14")
+RETENTION_PAYMENTS_DAYS = os.environ.get("RETENTION_PAYMENTS_DAYS", "90")
+RETENTION_RATINGS_DAYS = os.environ.get("RETENTION_RATINGS_DAYS", "365")
+RETENTION_OUTBOX_DAYS = os.environ.get("RETENTION_OUTBOX_DAYS", "7")
+# Failed publishes after which an outbox event is parked, see shared/outbox.py
+OUTBOX_MAX_ATTEMPTS = os.environ.get("OUTBOX_MAX_ATTEMPTS", "10")
+RETENTION_TUNES_DAYS = os.environ.get("RETENTION_TUNES_DAYS", "30")
+RETENTION_JOBS_DAYS = os.environ.get("RETENTION_JOBS_DAYS", "30")
+RETENTION_BATCH_SIZE = os.environ.get("RETENTION_BATCH_SIZE", "5000")
+RETENTION_BATCH_PAUSE_SECONDS = os.environ.get("RETENTION_BATCH_PAUSE_SECONDS", "0.1")
+RETENTION_TIME_BUDGET_SECONDS = os.environ.get("RETENTION_TIME_BUDGET_SECONDS", "300")
+RETENTION_VACUUM = os.environ.get("RETENTION_VACUUM", "true").lower() == "true"
+# Anonymized webhook capture for offline replay, see Utils/capture.py
+CAPTURE_ENABLED = os.environ.get("CAPTURE_ENABLED", "false").lower() == "true"
+CAPTURE_DIR = os.environ.get("CAPTURE_DIR", "captures")
+CAPTURE_MAX_BYTES = os.environ.get("CAPTURE_MAX_BYTES", "104857600")
+CAPTURE_HMAC_KEY = os.environ.get("CAPTURE_HMAC_KEY")
+# Hours past its ETA after which the tune poller stops waiting for a tune's images
+TUNE_POLL_GIVE_UP_HOURS = os.environ.get("TUNE_POLL_GIVE_UP_HOURS", "24")
+# Tune payloads prepared at pack selection are dropped if not paid for within this many hours
+STAGED_TUNE_TTL_HOURS = os.environ.get("STAGED_TUNE_TTL_HOURS", "24")
+# Fire-and-forget side effects (typing indicators, reactions), see Utils/background.py
+BACKGROUND_MAX_IN_FLIGHT = os.environ.get("BACKGROUND_MAX_IN_FLIGHT", "200")
+BACKGROUND_DRAIN_SECONDS = os.environ.get("BACKGROUND_DRAIN_SECONDS", "10")
+# "inline" handles messages in the webhook; "sessions" routes them through Service Bus
+# sessions keyed by phone number, so each user's messages have one consumer at a time
+MESSAGE_ROUTING = os.environ.get("MESSAGE_ROUTING", "inline")
+MESSAGE_SUBSCRIPTION = os.environ.get("MESSAGE_SUBSCRIPTION", "message-service")
+# Per-sender token buckets checked before a message is processed, see Utils/rate_limit.py.
+# The backend is "memory" (per worker) or "postgres" (shared by all replicas)
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_IMAGE_BURST = os.environ.get("RATE_LIMIT_IMAGE_BURST", "40")
+RATE_LIMIT_IMAGE_PER_MINUTE = os.environ.get("RATE_LIMIT_IMAGE_PER_MINUTE", "20")
+RATE_LIMIT_TEXT_BURST = os.environ.get("RATE_LIMIT_TEXT_BURST", "10")
+RATE_LIMIT_TEXT_PER_MINUTE = os.environ.get("RATE_LIMIT_TEXT_PER_MINUTE", "10")
+RATE_LIMIT_INTERACTIVE_BURST = os.environ.get("RATE_LIMIT_INTERACTIVE_BURST", "20")
+RATE_LIMIT_INTERACTIVE_PER_MINUTE = os.environ.get("RATE_LIMIT_INTERACTIVE_PER_MINUTE", "30")
+# Identical texts from a sender within this many seconds get a single reply
+RATE_LIMIT_COALESCE_SECONDS = os.environ.get("RATE_LIMIT_COALESCE_SECONDS", "30")
+# Adaptive limit on webhooks in flight per worker, see Utils/admission.py. The maximum
+# matches maxConcurrentRequests in host.json
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_INITIAL_LIMIT = os.environ.get("ADMISSION_INITIAL_LIMIT", "20")
+ADMISSION_MIN_LIMIT = os.environ.get("ADMISSION_MIN_LIMIT", "4")
+ADMISSION_MAX_LIMIT = os.environ.get("ADMISSION_MAX_LIMIT", "100")
+ADMISSION_LATENCY_TARGET_SECONDS = os.environ.get("ADMISSION_LATENCY_TARGET_SECONDS", "10")
+ADMISSION_UPSTREAM_TARGET_SECONDS = os.environ.get("ADMISSION_UPSTREAM_TARGET_SECONDS", "5")
+ADMISSION_BACKOFF = os.environ.get("ADMISSION_BACKOFF", "0.7")
+ADMISSION_RETRY_AFTER_SECONDS = os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", "30")
+# ASGI entry point of the services (shared/asgi.py): the key required where Azure would
+# require a function key (an app with such routes refuses to start without it), and
+# Service Bus sessions received at once
+ASGI_FUNCTION_KEY = os.environ.get("ASGI_FUNCTION_KEY")
+ASGI_SESSION_CONCURRENCY = os.environ.get("ASGI_SESSION_CONCURRENCY", "8")
+# In pre-fork mode each worker writes its metrics for the others this often, see Utils/metrics.py
+METRICS_FLUSH_SECONDS = os.environ.get("METRICS_FLUSH_SECONDS", "5")
+# Astria pack lists are cached this long per worker, see Utils/pack_catalogue.py
+PACK_CATALOGUE_TTL_SECONDS = os.environ.get("PACK_CATALOGUE_TTL_SECONDS", "300")
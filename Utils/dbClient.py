@@ -1,4 +1,60 @@
+import asyncio
 import asyncpg
+from Utils import constants, metrics
+
+_pool = None
+_pool_lock = None
+
+
+async def get_pool(db_config) -> asyncpg.Pool:
+    """
+    Return the process-wide connection pool, creating it on first use.
+    :param db_config: A dictionary containing database connection parameters.
+    """
+    global _pool, _pool_lock
+    if _pool is None:
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    **_connect_args(db_config),
+                    min_size=int(constants.DB_POOL_MIN_SIZE or 1),
+                    max_size=int(constants.DB_POOL_MAX_SIZE or 10)
+                )
+    return _pool
+
+
+def _connect_args(db_config) -> dict:
+    return dict(
+        user=db_config.get("user"),
+        password=db_config.get("password"),
+        database=db_config.get("database"),
+        host=db_config.get("host"),
+        port=db_config.get("port"),
+        ssl=constants.DB_SSL,
+    )
+
+
+async def connect(db_config) -> asyncpg.Connection:
+    """
+    Open a connection of its own, outside the pool, for a caller that holds one for long,
+    e.g. to keep session-level advisory locks.
+    """
+    return await asyncpg.connect(**_connect_args(db_config))
+
+
+def get_existing_pool():
+    """Return the pool if it has been created, without creating it"""
+    return _pool
+
+
+async def close_pool() -> None:
+    """Close the process-wide connection pool"""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
 
 
 class AsyncDatabaseManager:
@@ -9,21 +65,17 @@ class AsyncDatabaseManager:
                           (e.g., host, database, user, password, port).
         """
         self.db_config = db_config
+        self.pool = None
         self.conn = None
 
     async def __aenter__(self):
-        self.conn = await asyncpg.connect(
-            user=self.db_config.get("user"),
-            password=self.db_config.get("password"),
-            database=self.db_config.get("database"),
-            host=self.db_config.get("host"),
-            port=self.db_config.get("port"),
-            ssl="require"
-        )
+        self.pool = await get_pool(self.db_config)
+        self.conn = await self.pool.acquire()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.conn.close()
+        await self.pool.release(self.conn)
+        self.conn = None
 
     async def execute_query(self, query: str, params: tuple = None):
         """
@@ -32,7 +84,8 @@ class AsyncDatabaseManager:
         :param params: A tuple of parameters to pass to the query.
         :return: A list of dictionaries representing the query results.
         """
-        rows = await self.conn.fetch(query, *(params or ()))
+        with metrics.DB_QUERY_SECONDS.time(operation="fetch"):
+            rows = await self.conn.fetch(query, *(params or ()))
         return [dict(row) for row in rows]
 
     async def execute_query_one(self, query: str, params: tuple = None):
@@ -42,7 +95,8 @@ class AsyncDatabaseManager:
         :param params: A tuple of parameters to pass to the query.
         :return: A dictionary representing the single query result.
         """
-        row = await self.conn.fetchrow(query, *(params or ()))
+        with metrics.DB_QUERY_SECONDS.time(operation="fetchrow"):
+            row = await self.conn.fetchrow(query, *(params or ()))
         return dict(row) if row else None
 
     async def insert_data(self, query, params=None):
@@ -52,6 +106,29 @@ class AsyncDatabaseManager:
         :param params: A tuple of parameters to pass to the query.
         :return: The number of rows affected.
         """
-        result = await self.conn.execute(query, *(params or ()))
+        with metrics.DB_QUERY_SECONDS.time(operation="execute"):
+            result = await self.conn.execute(query, *(params or ()))
         # asyncpg returns a string like 'INSERT 0 1', so we parse the last part
-        return int(result.split()[-1])
\ No newline at end of file
+        return int(result.split()[-1])
+
+    async def execute_command(self, query: str) -> str:
+        """
+        Run a statement that returns neither rows nor a row count, e.g. VACUUM.
+        :param query: The SQL statement to execute.
+        :return: The command status reported by Postgres.
+        """
+        with metrics.DB_QUERY_SECONDS.time(operation="execute"):
+            return await self.conn.execute(query)
+
+    def transaction(self):
+        """
+        Start a transaction on the underlying connection.
+        Every query issued inside the `async with` block is committed together,
+        or rolled back together if the block raises.
+        :return: An asyncpg transaction usable as an async context manager.
+        """
+        return self.conn.transaction()
+
+    def in_transaction(self) -> bool:
+        """:return: True while a transaction is open on the underlying connection."""
+        return self.conn.is_in_transaction()
@@ -0,0 +1,96 @@
+"""
+Two-tier deduplication of inbound WhatsApp messages.
+
+Meta redelivers a webhook until it is acknowledged, so a slow worker gets the
+same message ids again, in bursts. Ids seen recently by this worker are rejected
+in memory; everything else is claimed in the msgs table with an insert that
+never raises, which also covers redeliveries landing on another replica.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from Utils import dbClient, metrics
+
+# Meta gives up redelivering a webhook after about a day; the in-memory tier only
+# needs to cover the bursts, the msgs table covers the rest
+RECENT_TTL_SECONDS = 15 * 60
+MAX_RECENT_IDS = 50_000
+
+DUPLICATES_TOTAL = metrics.REGISTRY.register(metrics.Counter(
+    "astria_duplicate_messages_total", "Redelivered inbound messages by the tier that rejected them", ["tier"]))
+
+
+class RecentIds:
+    """Bounded set of ids that expire `ttl` seconds after they were added"""
+
+    def __init__(self, ttl: float = RECENT_TTL_SECONDS, max_size: int = MAX_RECENT_IDS):
+        self.ttl = ttl
+        self.max_size = max_size
+        # id -> expiry, in insertion order so the oldest are evicted first
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, message_id: str) -> bool:
+        with self._lock:
+            expires_at = self._ids.get(message_id)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._ids[message_id]
+                return False
+            return True
+
+    def add(self, message_id: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._ids[message_id] = now + self.ttl
+            self._ids.move_to_end(message_id)
+            while self._ids:
+                oldest, expires_at = next(iter(self._ids.items()))
+                if expires_at >= now and len(self._ids) <= self.max_size:
+                    break
+                del self._ids[oldest]
+
+    def discard(self, message_id: str) -> None:
+        with self._lock:
+            self._ids.pop(message_id, None)
+
+
+RECENT_MESSAGES = RecentIds()
+
+
+def seen_recently(message_id: str) -> bool:
+    """True if this worker already claimed the message, no database needed"""
+    if message_id in RECENT_MESSAGES:
+        DUPLICATES_TOTAL.inc(tier="memory")
+        return True
+    return False
+
+
+async def claim_message(db: dbClient.AsyncDatabaseManager, message_id: str, sent_at: int = None) -> bool:
+    """
+    Claim a message for processing.
+    :param sent_at: Unix time the user sent the message at, as reported by WhatsApp.
+    :return: True if the message is new, False if it was already processed.
+    """
+    if seen_recently(message_id):
+        return False
+    inserted = await db.insert_data(f"INSERT INTO msgs (id, date) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                                    (message_id, _sent_on(sent_at)))
+    RECENT_MESSAGES.add(message_id)
+    if not inserted:
+        DUPLICATES_TOTAL.inc(tier="database")
+    return bool(inserted)
+
+
+async def release_message(db: dbClient.AsyncDatabaseManager, message_id: str, sent_at: int = None) -> None:
+    """Undo `claim_message` for a message that failed, so that its redelivery is processed again"""
+    await db.insert_data("DELETE FROM msgs WHERE id = $1 AND date = $2", (message_id, _sent_on(sent_at)))
+    RECENT_MESSAGES.discard(message_id)
+
+
+def _sent_on(sent_at: int = None):
+    # msgs is partitioned by date and unique on (id, date). The date comes from the message
+    # itself so that a redelivery, however late, conflicts with the first delivery
+    return datetime.fromtimestamp(sent_at, timezone.utc).date() if sent_at else datetime.now(timezone.utc).date()
@@ -0,0 +1,72 @@
+"""
+WhatsApp delivery latency telemetry.
+
+Outbound message ids returned by the Graph API are remembered with their kind and
+send time; the sent/delivered/read status callbacks Meta posts back for them are
+turned into latency observations per message kind.
+"""
+import threading
+import time
+from collections import OrderedDict
+from Utils import constants, metrics, webhook_decoder
+
+# Seconds from our send call to a status; reads can follow hours later
+DELIVERY_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 21600.0, 86400.0)
+# Outbound messages remembered per worker, the oldest are forgotten first
+MAX_TRACKED_MESSAGES = 10_000
+TERMINAL_STATUSES = frozenset(("read", "failed"))
+
+DELIVERY_SECONDS = metrics.REGISTRY.register(metrics.Histogram(
+    "astria_whatsapp_delivery_seconds", "Time from sending a WhatsApp message to each status callback",
+    ["status", "kind"], buckets=DELIVERY_BUCKETS))
+STATUS_CALLBACKS_TOTAL = metrics.REGISTRY.register(metrics.Counter(
+    "astria_whatsapp_status_callbacks_total", "WhatsApp status callbacks by status", ["status"]))
+
+
+class OutboundTracker:
+    """Bounded map of outbound message id -> (kind, unix send time)"""
+
+    def __init__(self, max_size: int = MAX_TRACKED_MESSAGES):
+        self.max_size = max_size
+        self._sent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record_sent(self, message_id: str, kind: str) -> None:
+        with self._lock:
+            self._sent[message_id] = (kind, time.time())
+            if len(self._sent) > self.max_size:
+                self._sent.popitem(last=False)
+
+    def observe(self, message_id: str, status: str, timestamp: int) -> None:
+        STATUS_CALLBACKS_TOTAL.inc(status=status)
+        with self._lock:
+            if status in TERMINAL_STATUSES:
+                sent = self._sent.pop(message_id, None)
+            else:
+                sent = self._sent.get(message_id)
+        # Callbacks for messages sent by another replica are only counted
+        if sent is None or timestamp is None:
+            return
+        kind, sent_at = sent
+        # Status timestamps have a one second resolution
+        DELIVERY_SECONDS.observe(max(timestamp - sent_at, 0.0), status=status, kind=kind)
+
+
+TRACKER = OutboundTracker()
+
+
+def record_sent(response: dict, kind: str) -> None:
+    """Remember the ids of a Graph API /messages response"""
+    if not constants.DELIVERY_METRICS_ENABLED or not isinstance(response, dict):
+        return
+    for message in response.get("messages", ()):
+        if message.get("id"):
+            TRACKER.record_sent(message["id"], kind or "unknown")
+
+
+def observe_statuses(raw: bytes) -> None:
+    """Feed the status callbacks of a webhook body into the delivery histograms"""
+    if not constants.DELIVERY_METRICS_ENABLED:
+        return
+    for status in webhook_decoder.decode_statuses(raw):
+        TRACKER.observe(status.message_id, status.status, status.timestamp)
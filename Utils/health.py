@@ -0,0 +1,132 @@
+import asyncio
+import json
+import logging
+import time
+import aiohttp
+from Utils import constants, dbClient, metrics
+from db import dbConfig
+
+# An upstream that answered a real request this recently counts as reachable without probing it
+REACHABLE_WINDOW_SECONDS = 300
+PROBE_TIMEOUT_SECONDS = 3
+
+
+class CachedCheck:
+    """
+    A dependency check whose result is reused for `ttl` seconds.
+    Concurrent callers share a single in-flight probe, so however often
+    Kubernetes polls, the dependency is probed at most once per `ttl`.
+    """
+
+    def __init__(self, name: str, probe, ttl: float):
+        self.name = name
+        self.probe = probe
+        self.ttl = ttl
+        self._result = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def run(self) -> tuple:
+        if self._result is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self._result
+        async with self._lock:
+            if self._result is not None and time.monotonic() - self._checked_at < self.ttl:
+                return self._result
+            try:
+                self._result = await asyncio.wait_for(self.probe(), PROBE_TIMEOUT_SECONDS)
+            except Exception as e:
+                logging.warning(f"Readiness check {self.name} failed: {e}")
+                self._result = (False, str(e) or type(e).__name__)
+            self._checked_at = time.monotonic()
+            return self._result
+
+
+class ReadinessProbe:
+    """
+    Readiness of a service: the DB pool is warm, Astria and WhatsApp were
+    reachable recently, the event broker is connected and, with `warm_caches`,
+    the worker's caches are filled. Other checks can be added with `add_check`.
+    """
+
+    def __init__(self, event_broker=None, upstreams=("astria", "whatsapp"), ttl: float = 10,
+                 warm_caches: bool = False):
+        self.event_broker = event_broker
+        self.ttl = ttl
+        # A single keep-alive session so upstream probes reuse their connections
+        self._session = None
+        self._checks = [CachedCheck("database", self._check_database, ttl)]
+        upstream_urls = {"astria": constants.ASTRIA_API_URL, "whatsapp": constants.WHATSAPP_API_URL}
+        for upstream in upstreams:
+            self._checks.append(CachedCheck(upstream, self._upstream_probe(upstream, upstream_urls[upstream]), ttl))
+        if event_broker is not None:
+            self._checks.append(CachedCheck("broker", self._check_broker, ttl))
+        if warm_caches:
+            self._checks.append(CachedCheck("caches", self._check_caches, ttl))
+
+    def add_check(self, name: str, probe, ttl: float = None) -> None:
+        """Register an extra readiness check; `probe` is an async callable returning (ok, detail)"""
+        self._checks.append(CachedCheck(name, probe, ttl or self.ttl))
+
+    async def _check_database(self) -> tuple:
+        # The first probe creates and fills the pool, so the pod only turns
+        # ready once its connections are open
+        pool = await dbClient.get_pool(dbConfig.db_config)
+        async with pool.acquire() as conn:
+            await conn.fetchval("SELECT 1")
+        return True, f"pool size {pool.get_size()}, idle {pool.get_idle_size()}"
+
+    def _upstream_probe(self, upstream: str, url: str):
+        async def probe() -> tuple:
+            last_success = metrics.UPSTREAM_LAST_SUCCESS.get(upstream)
+            if last_success is not None and time.monotonic() - last_success < REACHABLE_WINDOW_SECONDS:
+                return True, "recent traffic"
+            if not url:
+                return False, "not configured"
+            # Any HTTP answer proves the upstream is reachable
+            async with self._get_session().head(url, allow_redirects=False) as response:
+                return True, f"probe status {response.status}"
+        return probe
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def _check_caches(self) -> tuple:
+        # Fills the caches on the first probe, so the pod only turns ready once they are warm.
+        # Imported here, the maintenance service has none of them
+        from Utils import message_catalogue, pack_catalogue, user_store
+        message_catalogue.precompile()
+        if not await pack_catalogue.get_packs(self._get_session()):
+            return False, "pack catalogue not loaded"
+        if user_store.CACHE.ttl > 0 and not await user_store.ensure_listener():
+            return False, "user cache not listening"
+        return True, "warm"
+
+    async def _check_broker(self) -> tuple:
+        connected = await self.event_broker.check_connection()
+        return connected, "connected" if connected else "disconnected"
+
+    async def check(self) -> tuple:
+        """
+        Run every check (served from cache when fresh).
+        :return: (ready, {check name: {"ok": bool, "detail": str}})
+        """
+        results = await asyncio.gather(*(check.run() for check in self._checks))
+        report = {check.name: {"ok": ok, "detail": detail} for check, (ok, detail) in zip(self._checks, results)}
+        return all(ok for ok, _ in results), report
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def liveness_body() -> str:
+    return json.dumps({"status": "alive"})
+
+
+async def readiness_body(probe: ReadinessProbe) -> tuple:
+    """:return: (status code, JSON body) for a readiness endpoint"""
+    ready, report = await probe.check()
+    return (200 if ready else 503), json.dumps({"status": "ready" if ready else "not ready", "checks": report})
@@ -0,0 +1,488 @@
+"""
+Localized message catalogue.
+
+Every user-facing text lives here, keyed by message kind and language, so adding
+a language means adding entries to `TEXTS` rather than another branch in every
+WhatsappWrapper method. Languages missing from a kind fall back to English.
+
+Messages that don't depend on per-send data ("static" kinds, registered with
+`@static_message`) are built and serialized once per language. Sending one only
+splices the JSON-encoded recipient into the cached bytes.
+"""
+from Utils import constants, message_ids
+from Utils.states import Languages
+from Utils import WhatsappClient as wc
+
+ENGLISH = Languages.ENGLISH.value
+HEBREW = Languages.HEBREW.value
+DEFAULT_LANGUAGE = ENGLISH
+
+TEXTS = {
+    "invalid_media": {
+        ENGLISH: {"body": "Hi!😊 Currently, I can only work with images.\n Other files (like videos, documents, links, etc.) are not supported."},
+        HEBREW: {"body": "היי!😊 כרגע אני מסוגל לעבוד עם תמונות בלבד.\n קבצים אחרים(כמו סרטונים, מסמכים, קישורים וכו') לא נתמכים."},
+    },
+    "tunes": {
+        ENGLISH: {
+            "intro": "Choose your model:",
+            "title": "Type: {name}",
+            "tune": "*Created at*: {created_at} \n*Expires at*: {expires_at}",
+            "button": "use this model",
+            "no_models": "No models available at the moment, please try again later",
+        },
+        HEBREW: {
+            "intro": "בחר את המודל שלך:",
+            "title": "סוג: {name}",
+            "tune": "*נוצר בתאריך*: {created_at} \n*פג תוקף בתאריך*: {expires_at}",
+            "button": "השתמש במודל הזה",
+            "no_models": "אין מודלים זמינים כרגע, אנא נסה שוב מאוחר יותר",
+        },
+    },
+    "returning_customer": {
+        ENGLISH: {
+            "body": "I noticed that you have saved models.\n"
+                    "Would you like to use one of the saved models or create a new model?",
+            "title": "Welcome back! 👋",
+            "saved_models": "Show saved models",
+            "new_model": "New model",
+        },
+        HEBREW: {
+            "body": "שמתי לב שיש לך מודלים שמורים.\n"
+                    "האם תרצה להשתמש באחד המודלים השמורים או ליצור מודל חדש?",
+            "title": "ברוך שובך! 👋",
+            "saved_models": "הצג מודלים שמורים",
+            "new_model": "מודל חדש",
+        },
+    },
+    "init": {
+        ENGLISH: {
+            "body": "Hi" + "! 👋 " + "I’m here to help you create stunning headshots using AI.\n"
+                    "Let’s start with a quick step of uploading images – I’m here for you every step of the way",
+            "options": "Options",
+            "begin": "Let's begin!",
+            "how_it_works": "How it works",
+            "change_language": "Change to hebrew",
+            "support": "Contact support",
+        },
+        HEBREW: {
+            "body": "היי" + "! 👋 " + "אני כאן כדי לעזור לך ליצור תמונות תדמית מהממות בעזרת בינה מלאכותית.\n"
+                    "נתחיל עם שלב קצר של העלאת תמונות - אני איתך בכל צעד",
+            "options": "אופציות",
+            "begin": "יאללה, נתחיל!",
+            "how_it_works": "איך זה עובד?",
+            "change_language": "החלף לאנגלית",
+            "support": "צור קשר עם תמיכה",
+        },
+    },
+    "upload_images": {
+        ENGLISH: {
+            "first_time": "Awesome! Please upload your images now minimum {threshold} images required\n",
+            "more": "Awesome! Please upload your images now \nWhen you're done, send me another text message",
+        },
+        HEBREW: {
+            "first_time": "מעולה! אנא העלה את התמונות שלך עכשיו מזכירים לך- לפחות {threshold} תמונות\n",
+            "more": "מעולה! אנא העלה את התמונות שלך עכשיו \nכשתסיים תשלח לי הודעת טקסט נוספת",
+        },
+    },
+    "additional_images_request": {
+        ENGLISH: {
+            "title": "Great! I have enough images to get started!",
+            "body": "Would you like to add more? It can improve the accuracy even more",
+            "more": "Yes!",
+            "done": "No, I'm done",
+            "reset": "Reset images",
+            "support": "Contact support",
+            "options": "Options",
+        },
+        HEBREW: {
+            "title": "מעולה! יש לי מספיק תמונות כדי להתחיל!",
+            "body": "רוצה להוסיף עוד? זה יכול לשפר את הדיוק אפילו יותר",
+            "more": "כן!",
+            "done": "לא, אני סיימתי",
+            "reset": "אני רוצה תמונות אחרות",
+            "support": "צור קשר עם תמיכה",
+            "options": "אופציות",
+        },
+    },
+    "how_it_works": {
+        ENGLISH: {
+            "body": "*How it works:*\n\n"
+                    "- Just upload your photos\n"
+                    "- I’ll train a personal model just for you\n"
+                    "- I’ll create your images in the style you choose\n"
+                    "- You’ll get your new, unique images\n"
+                    "- Your model is saved with us for 30 days, so you can use it whenever you want\n"
+                    "- And a little bonus: it also helps save resources and protect the environment 🌱",
+            "question": "Would you like to begin?",
+            "button": "Let's begin!",
+            "title": "Let's do this!",
+        },
+        HEBREW: {
+            "body": "*איך זה עובד:*\n\n"
+                    "- פשוט תעלה את התמונות שלך\n"
+                    "- אני אאמן מודל אישי במיוחד בשבילך\n"
+                    "- אצור את התמונות שלך לפי הסגנון שבחרת\n"
+                    "- תוכל לקבל את התמונות החדשות והמיוחדות שלך\n"
+                    "- המודל שלך נשמר אצלנו למשך 30 יום, כך שתוכל להשתמש בו מתי שתרצה\n"
+                    "- ובונוס קטן: זה גם תורם לחיסכון במשאבים ובשמירה על הסביבה 🌱",
+            "question": "האם תרצה להתחיל?",
+            "button": "בואו נתחיל!",
+            "title": "בואו נעשה את זה!",
+        },
+    },
+    "image_guidelines": {
+        ENGLISH: {
+            "body": "To create the best results for you\n\n"
+                    "✅ Please upload:\n"
+                    "- At least {threshold} clear, high-quality face photos\n"
+                    "- In natural or well-lit lighting\n"
+                    "\n"
+                    "❌ Do not upload photos that are:\n"
+                    "- Blurry\n"
+                    "- Dark\n"
+                    "- With hats/sunglasses\n"
+                    "- Heavily filtered\n"
+                    "- Group photos",
+            "ready": "I'm ready!",
+            "examples": "Show me examples",
+            "title": "Ready to upload photos?",
+        },
+        HEBREW: {
+            "body": "כדי שאצור עבורך תוצאה הכי מדויקת\n\n"
+                    "✅ יש להעלות:\n"
+                    "- לפחות {threshold} תמונות פנים ברורות באיכות טובה \n"
+                    "- בתאורה טבעית או מוארת \n"
+                    "\n"
+                    "❌אין להעלות תמונות:\n"
+                    "- מטושטשות\n"
+                    "- כהות\n"
+                    "- עם כובע/משקפי שמש \n"
+                    "- פילטרים מוגזמים \n"
+                    "- תמונות קבוצתיות",
+            "ready": "אני מוכן\\ה!",
+            "examples": "שלח לי תמונות לדוגמה",
+            "title": "מוכן\\ה להעלות תמונות?",
+        },
+    },
+    "pre_image_sent": {
+        ENGLISH: {"body": "🎉 Done! Your new headshots are ready.\n Enjoy the new you:"},
+        HEBREW: {"body": "🎉 סיימנו! התמונות שלך מוכנות.\n תהנה מאתה החדש:"},
+    },
+    "post_image_sent": {
+        ENGLISH: {
+            "rate_title": "Rate us",
+            "rate_body": "Wow🤩 Beautiful images! What do you think? 😊",
+            "rating": "Rating",
+            "body": "Amazing! Would you like to create another pack at a special price?",
+            "button": "I want it now!",
+            "title": "Create another pack",
+        },
+        HEBREW: {
+            "rate_title": "דרגו אותנו",
+            "rate_body": "וואו🤩 תמונות מדהימות! מה דעתך? 😊",
+            "rating": "דירוג",
+            "body": "יצא מדהים! תרצה ליצור חבילה נוספת במחיר מיוחד?",
+            "button": "אני רוצה!",
+            "title": "צור חבילה נוספת",
+        },
+    },
+    "feedback": {
+        ENGLISH: {
+            "recorded": "Your feedback has been recorded.\nThank you for your input!",
+            "poor": "We are sorry to hear that you didn't have a great experience 😞\nPlease let us know how we can improve",
+        },
+        HEBREW: {
+            "recorded": "תגובתך נרשמה במערכת.\nתודה על המשוב!",
+            "poor": "אנחנו מצטערים לשמוע שלא הייתה לך חוויה טובה 😞\nאנא ספר לנו איך נוכל להשתפר",
+        },
+    },
+    "support_email": {
+        ENGLISH: {"body": "If you need support or you want to request a new feature,\nplease contact our support team at biglovelettersai@outlook.com"},
+        HEBREW: {"body": "אם אתה זקוק לעזרה או שיש לך רעיונות נוספים לשיפור המוצר,\nאנא פנה לצוות התמיכה שלנו בכתובת biglovelettersai@outlook.com"},
+    },
+    "processing_images": {
+        ENGLISH: {
+            "days": "days",
+            "hours": "hours",
+            "minutes": "minutes",
+            "one_day": "one day",
+            "one_hour": "one hour",
+            "body": "*Amazing! we’re kicking things off⚡*\n\n"
+                    "You’ll get your new images within {time} 📸\n"
+                    "Can’t wait for you to see yourself at your very best!🤩\n\n"
+                    "Feel free to go about your day – I’ll send you a message as soon as everything’s ready!",
+        },
+        HEBREW: {
+            "days": "ימים",
+            "hours": "שעות",
+            "minutes": "דקות",
+            "one_day": "יום אחד",
+            "one_hour": "שעה אחת",
+            "body": "*מעולה! אני יוצא לדרך⚡*\n\n"
+                    "תוך {time} אשלח לך את התמונות החדשות שלך 📸\n"
+                    "מחכה שתראה\\י את עצמך מהצד הכי טוב שלך!🤩\n\n"
+                    "בינתיים אפשר ללכת לעשות דברים אחרים בכיף – ברגע שזה יהיה מוכן תקבל\\י הודעה עם התמונות החדשות.",
+        },
+    },
+    "user_agreement": {
+        ENGLISH: {
+            "body": "Just before we continue! 😊\n"
+                    "These images are created by AI 🤖 and might not look 100% like you.\n"
+                    "They’re auto-generated — without human editing.\n"
+                    "Therfore, some minor deviations or artifacts may appear.\n\n"
+                    "Please confirm you understand and agree to this before we continue onto the payment.",
+            "button": "I agree",
+            "title": "Terms of Use",
+        },
+        HEBREW: {
+            "body": "לפני שנמשיך! 😊\n"
+                    "התמונות האלה נוצרות על ידי בינה מלאכותית 🤖 ולא תמיד ייראו 100% כמוך.\n"
+                    "הן נוצרות אוטומטית - ללא עריכה אנושית.\n"
+                    "לכן יכולות להופיע סטיות קלות או תקלות.\n\n"
+                    r"אנא אשר\י שאת\ה מבין\ה ומסכים\ה לכך לפני שנמשיך לתשלום.",
+            "button": r"אני מסכים\ה",
+            "title": "תנאי שימוש",
+        },
+    },
+    "payment_received": {
+        ENGLISH: {"body": "Thank you for your payment💸,\n {full_name}"},
+        HEBREW: {"body": "תודה רבה על התשלום💸,\n {full_name}"},
+    },
+    "missing_credits": {
+        ENGLISH: {"body": "You're missing {credits} credits!\n Please add credits via the following link"},
+        HEBREW: {"body": "חסרים לך {credits} קרדיטים!\nאנא הוסף קרדיטים דרך הקישור הבא"},
+    },
+    "video_example": {
+        ENGLISH: {"body": "Here are the video examples from your pack"},
+        HEBREW: {"body": "הנה דוגמאות הווידאו מהחבילה שלך"},
+    },
+    "pack_tiers": {
+        ENGLISH: {
+            "title": "Choose Your AI Image Plan 🎨",
+            "body": "- *Lite* – 12 images for {lite_price}$ (great for trying out)\n"
+                    "- *Standard* – 24 images for {standard_price}$ (more variety, better value)\n"
+                    "- *Premium* – 40 images for {premium_price}$ (maximum images + best deal)\n\n"
+                    "🚀 Choose the plan that matches your vision and let’s create something amazing:",
+            "lite": "Lite Pack",
+            "standard": "Standard Pack",
+            "premium": "Premium Pack",
+            "options": "Options",
+        },
+        HEBREW: {
+            "title": "בחר את חבילת התמונות שלך 🎨",
+            "body": "- *חבילת בסיס* – 12 תמונות ב- {lite_price}$ (מעולה לניסיון)\n"
+                    "- *חבילה סטנדרטית* – 24 תמונות ב- {standard_price}$ (יותר מגוון, יותר משתלם)\n"
+                    "- *חבילת פרימיום* – 40 תמונות ב- {premium_price}$ (מקסימום תמונות + העסקה הטובה ביותר)\n\n"
+                    "🚀 בחר את החבילה שמתאימה לחזון שלך ובוא ניצור משהו מדהים יחד:",
+            "lite": "חבילת בסיס",
+            "standard": "חבילה סטנדרטית",
+            "premium": "חבילת פרימיום",
+            "options": "אופציות",
+        },
+    },
+    "pre_packs": {
+        ENGLISH: {
+            "body": "Choose the type of pack you want to create – and I'll take care of the rest 😊",
+            "choose": "I want this!",
+            "examples": "Show me examples",
+            "costs": "\ncosts {price}$ for {num_images} images\n",
+        },
+        HEBREW: {
+            "body": "בחרו את סוג החבילה שתרצו ליצור – ואני כבר אדאג לכל השאר 😊",
+            "choose": "אני רוצה את זה!",
+            "examples": "תראה לי דוגמאות",
+            "costs": "\nעלות {price}$ עבור {num_images} תמונות\n",
+        },
+    },
+    "payment_link": {
+        ENGLISH: {
+            "title": "You're almost there! 😊",
+            "body": "To get started, all you need to do is complete the payment here\n\n"
+                    "It's easy and simple, we promise! \n"
+                    "Let's start creating something amazing together 🚀",
+            "button": "Pay Now",
+            "note": "Please note that payment processing takes a few minutes, don't worry, we'll notify you as soon as it's done!",
+        },
+        HEBREW: {
+            "title": "כמעט סיימנו! 😊",
+            "body": " כדי שנוכל להתחיל, כל מה שנשאר זה להשלים את התשלום כאן\n\n"
+                    "הכל קל ופשוט, מבטיחים! \n"
+                    "בואו נתחיל ליצור משהו מדהים יחד 🚀",
+            "button": "שלם עכשיו",
+            "note": "אנא שימו לב כי עיבוד התשלום לוקח כמה דקות, אל תדאגו, נודיע לכם ברגע שזה יסתיים!",
+        },
+    },
+    "image_rejected": {
+        ENGLISH: {"body": "Hmm, this image might not work so well...\n"
+                          "Reason: {reason}.\n\n"
+                          "Try a different one – I’m here to help! 😊"},
+        HEBREW: {"body": "התמונה הזו לא תעבוד כל כך...\n"
+                         "הסיבה: {reason}.\n\n"
+                         "נסה תמונה אחרת. אני כאן! 😊\n"},
+    },
+    "need_help": {
+        ENGLISH: {"body": "Please contact us at\ninfo.bigloveletters@gmail.com"},
+        HEBREW: {"body": "בבקשה פנו אלינו במייל-\ninfo.bigloveletters@gmail.com"},
+    },
+    "error": {
+        ENGLISH: {"body": "Oops! Something went wrong on our end. 😞\nPlease try again"},
+        HEBREW: {"body": "אופס! משהו השתבש אצלנו. 😞\nאנא נסה שוב"},
+    },
+}
+
+
+def texts(kind: str, language) -> dict:
+    """Return the texts of a message kind in `language`, falling back to English"""
+    localized = TEXTS[kind]
+    return localized.get(language) or localized[DEFAULT_LANGUAGE]
+
+
+# Static messages: kind -> (texts kind, builder(texts, recipient) returning the payloads to send in order)
+_STATIC_BUILDERS = {}
+# (kind, language) -> list of pre-serialized payloads, each split around the recipient
+_compiled = {}
+# Stands in for the recipient while a static message is serialized
+_RECIPIENT = "\x00recipient\x00"
+
+
+def static_message(kind: str, texts_kind: str = None):
+    """Register the builder of a static message; `texts_kind` shares the texts of another kind"""
+    def register(builder):
+        _STATIC_BUILDERS[kind] = (texts_kind or kind, builder)
+        return builder
+    return register
+
+
+def _compile(kind: str, language) -> list:
+    marker = wc.dumps(_RECIPIENT)
+    texts_kind, builder = _STATIC_BUILDERS[kind]
+    payloads = builder(texts(texts_kind, language), _RECIPIENT)
+    return [wc.dumps(payload).split(marker) for payload in payloads]
+
+
+def render(kind: str, language, recipient: str) -> list:
+    """
+    Return the serialized payloads of a static message addressed to `recipient`.
+    Payloads are compiled on first use per (kind, language) and reused afterwards.
+    """
+    key = (kind, language)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = _compiled[key] = _compile(kind, language)
+    to = wc.dumps(recipient)
+    return [to.join(parts) for parts in compiled]
+
+
+def precompile(languages=(ENGLISH, HEBREW)) -> None:
+    """Compile every static message up front, e.g. before forking workers"""
+    for kind in _STATIC_BUILDERS:
+        for language in languages:
+            _compiled[(kind, language)] = _compile(kind, language)
+
+
+@static_message("invalid_media")
+def _invalid_media(t, to):
+    return [wc.build_text(to, t["body"])]
+
+
+@static_message("returning_customer")
+def _returning_customer(t, to):
+    return [wc.build_interactive_reply_message(to, t["body"], message_ids.SEND_TUNES, t["saved_models"], t["title"],
+                                               additional_button_id=message_ids.OVERRIDE_TUNE,
+                                               additional_button_text=t["new_model"])]
+
+
+@static_message("init")
+def _init(t, to):
+    options = {message_ids.BEGIN_REPLY: t["begin"], message_ids.HOW_IT_WORKS: t["how_it_works"],
+               message_ids.CHANGE_LANGUAGE: t["change_language"], message_ids.CONTACT_SUPPORT: t["support"]}
+    return [wc.build_interactive_list(to, "", t["body"], "PicMeAI", t["options"], options)]
+
+
+@static_message("upload_images")
+def _upload_images_first_time(t, to):
+    return [wc.build_text(to, t["first_time"].format(threshold=constants.MAX_IMAGES_THRESHOLD))]
+
+
+@static_message("upload_more_images", texts_kind="upload_images")
+def _upload_more_images(t, to):
+    return [wc.build_text(to, t["more"])]
+
+
+@static_message("additional_images_request")
+def _additional_images_request(t, to):
+    options = {message_ids.UPLOAD_MORE_IMAGES: t["more"], message_ids.SEND_PACKS: t["done"],
+               message_ids.OVERRIDE_TUNE: t["reset"], message_ids.CONTACT_SUPPORT: t["support"]}
+    return [wc.build_interactive_list(to, t["title"], t["body"], "", t["options"], options)]
+
+
+@static_message("how_it_works")
+def _how_it_works(t, to):
+    return [wc.build_text(to, t["body"]),
+            wc.build_interactive_reply_message(to, t["question"], message_ids.BEGIN_REPLY, t["button"], t["title"])]
+
+
+@static_message("image_guidelines")
+def _image_guidelines(t, to):
+    return [wc.build_text(to, t["body"].format(threshold=constants.MAX_IMAGES_THRESHOLD)),
+            wc.build_interactive_reply_message(to, t["title"], message_ids.READY_FOR_IMAGE_UPLOAD, t["ready"], "",
+                                               additional_button_id=message_ids.SHOW_EXAMPLES,
+                                               additional_button_text=t["examples"])]
+
+
+@static_message("additional_guidelines_images", texts_kind="image_guidelines")
+def _additional_guidelines_images(t, to):
+    return [wc.build_image(to, constants.RECOMMENDED_PHOTOS),
+            wc.build_image(to, constants.IMAGE_GUIDE_URL),
+            wc.build_interactive_reply_message(to, t["title"], message_ids.READY_FOR_IMAGE_UPLOAD, t["ready"], "")]
+
+
+@static_message("pre_image_sent")
+def _pre_image_sent(t, to):
+    return [wc.build_text(to, t["body"])]
+
+
+@static_message("post_image_sent")
+def _post_image_sent(t, to):
+    ratings = {f"{message_ids.STAR_RATING}_{i}": f"{i}⭐" for i in range(1, 6)}
+    return [wc.build_interactive_list(to, t["rate_title"], t["rate_body"], "PicMeAI", t["rating"], ratings),
+            wc.build_interactive_reply_message(to, t["body"], message_ids.SEND_PACKS, t["button"], t["title"])]
+
+
+@static_message("feedback_recorded", texts_kind="feedback")
+def _feedback_recorded(t, to):
+    return [wc.build_text(to, t["recorded"])]
+
+
+@static_message("feedback_poor", texts_kind="feedback")
+def _feedback_poor(t, to):
+    return [wc.build_text(to, t["poor"])]
+
+
+@static_message("support_email")
+def _support_email(t, to):
+    return [wc.build_text(to, t["body"])]
+
+
+@static_message("user_agreement")
+def _user_agreement(t, to):
+    return [wc.build_interactive_reply_message(to, t["body"], message_ids.GET_PAYMENT_LINK, t["button"], t["title"])]
+
+
+@static_message("pack_tiers")
+def _pack_tiers(t, to):
+    body = t["body"].format(lite_price=constants.LITE_TIER_PRICE, standard_price=constants.STANDARD_TIER_PRICE,
+                            premium_price=constants.PREMIUM_TIER_PRICE)
+    options = {message_ids.LITE_PACK: t["lite"], message_ids.STANDARD_PACK: t["standard"],
+               message_ids.PREMIUM_PACK: t["premium"]}
+    return [wc.build_interactive_list(to, t["title"], body, "PicMeAI", t["options"], options)]
+
+
+@static_message("need_help")
+def _need_help(t, to):
+    return [wc.build_text(to, t["body"])]
+
+
+@static_message("error")
+def _error(t, to):
+    return [wc.build_text(to, t["body"])]
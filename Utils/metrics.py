@@ -0,0 +1,337 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlsplit
+from Utils import constants
+
+# Latency buckets in seconds, from a fast DB query up to a slow Astria upload
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_ID_SEGMENT = re.compile(r"^\d+$|^[0-9a-f-]{16,}$")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _sum_samples(sample_lists) -> dict:
+    """Add up [label values, value] samples of several workers; histogram values are added bucket by bucket"""
+    totals = {}
+    for samples in sample_lists:
+        for key, value in samples:
+            key = tuple(key)
+            if isinstance(value, list):
+                previous = totals.get(key, [0] * len(value))
+                totals[key] = [a + b for a, b in zip(previous, value)]
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merged(self, snapshots: dict) -> "Counter":
+        """A copy holding the sum of the workers' samples, given by pid"""
+        total = Counter(self.name, self.documentation, self.labelnames)
+        total._values = _sum_samples(snapshots.values())
+        return total
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merged(self, snapshots: dict) -> "Gauge":
+        """A copy with each live worker's samples, given by pid, told apart by a worker label"""
+        every = Gauge(self.name, self.documentation, self.labelnames + ("worker",))
+        for pid, samples in snapshots.items():
+            for key, value in samples:
+                every._values[tuple(key) + (str(pid),)] = value
+        return every
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), list(series)] for key, series in self._values.items()]
+
+    def merged(self, snapshots: dict) -> "Histogram":
+        """A copy holding the sum of the workers' samples, given by pid"""
+        total = Histogram(self.name, self.documentation, self.labelnames, self.buckets)
+        total._values = _sum_samples(snapshots.values())
+        return total
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in self._values.items():
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> dict:
+        """:return: {metric name: its kind and samples}, as written to the multiprocess directory"""
+        return {metric.name: {"kind": metric.kind, "samples": metric.snapshot()} for metric in self._metrics}
+
+    def render(self) -> str:
+        """Render every registered metric in the Prometheus text exposition format"""
+        lines = []
+        if _multiprocess_dir:
+            flush()
+            workers = _read_snapshots(_multiprocess_dir)
+            for metric in self._metrics:
+                samples = {pid: snapshot[metric.name]["samples"] for pid, snapshot in workers.items()
+                           if metric.name in snapshot}
+                lines.extend(metric.merged(samples).collect())
+        else:
+            for metric in self._metrics:
+                lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Pre-fork mode (shared/gunicorn_conf.py): every worker writes its samples to
+# <pid>.json in this directory, and a scrape answered by any worker reports the
+# sum over all of them. The samples of exited workers are folded into
+# archive.json, so counters don't go back when a worker is recycled; their
+# gauges are dropped.
+_multiprocess_dir = None
+_ARCHIVE = "archive"
+
+
+def _write_json(path: str, data) -> None:
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, "w") as f:
+        json.dump(data, f)
+    os.replace(partial, path)
+
+
+def _read_snapshots(directory: str) -> dict:
+    """:return: {pid, or _ARCHIVE: {metric name: {"kind": ..., "samples": ...}}}"""
+    snapshots = {}
+    for name in os.listdir(directory):
+        stem, extension = os.path.splitext(name)
+        if extension != ".json":
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshots[stem] = json.load(f)
+        except (OSError, ValueError):
+            # Being folded into the archive as we read
+            continue
+    return snapshots
+
+
+def flush() -> None:
+    """Write this worker's samples to the multiprocess directory"""
+    if _multiprocess_dir:
+        _write_json(os.path.join(_multiprocess_dir, f"{os.getpid()}.json"), REGISTRY.snapshot())
+
+
+def _flush_forever(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except OSError as e:
+            logging.warning(f"Could not write metrics to {_multiprocess_dir}: {e}")
+
+
+def enable_multiprocess(directory: str) -> None:
+    """Called in each worker after the fork: share this worker's samples through `directory`"""
+    global _multiprocess_dir
+    _multiprocess_dir = directory
+    flush()
+    threading.Thread(target=_flush_forever, args=(float(constants.METRICS_FLUSH_SECONDS),),
+                     name="metrics-flush", daemon=True).start()
+
+
+def mark_process_dead(directory: str, pid: int) -> None:
+    """Called in the master when a worker exits: fold its counters and histograms into the archive"""
+    path = os.path.join(directory, f"{pid}.json")
+    snapshots = _read_snapshots(directory)
+    dead = snapshots.get(str(pid))
+    if dead is not None:
+        archive = snapshots.get(_ARCHIVE, {})
+        for name, metric in dead.items():
+            if metric["kind"] == Gauge.kind:
+                continue
+            archived = archive.get(name, {"samples": []})["samples"]
+            totals = _sum_samples((archived, metric["samples"]))
+            archive[name] = {"kind": metric["kind"], "samples": [[list(key), value] for key, value in totals.items()]}
+        _write_json(os.path.join(directory, f"{_ARCHIVE}.json"), archive)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+DB_QUERY_SECONDS = REGISTRY.register(Histogram(
+    "astria_db_query_seconds", "Time spent in Postgres queries", ["operation"]))
+UPSTREAM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "astria_upstream_request_seconds", "Latency of calls to Astria, WhatsApp and other upstreams",
+    ["upstream", "endpoint"]))
+UPSTREAM_REQUESTS_TOTAL = REGISTRY.register(Counter(
+    "astria_upstream_requests_total", "Calls to upstream APIs by outcome", ["upstream", "endpoint", "outcome"]))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "astria_stage_seconds", "Time spent in each stage of the request pipeline", ["stage", "state"]))
+MESSAGES_TOTAL = REGISTRY.register(Counter(
+    "astria_messages_total", "Inbound WhatsApp messages by user state and message kind", ["state", "kind"]))
+
+# upstream -> time.monotonic() of the last successful call, read by the readiness probe
+UPSTREAM_LAST_SUCCESS = {}
+# Called with (upstream, seconds, outcome) after every upstream call, see Utils/admission.py
+UPSTREAM_OBSERVERS = []
+
+
+def upstream_labels(url: str) -> tuple:
+    """
+    Map a request URL to (upstream, endpoint) labels.
+    Ids in the path are collapsed so that e.g. /p/123/tunes and /p/456/tunes share a series.
+    """
+    if constants.ASTRIA_API_URL and url.startswith(constants.ASTRIA_API_URL):
+        upstream = "astria"
+        path = url[len(constants.ASTRIA_API_URL):]
+    elif constants.WHATSAPP_API_URL and url.startswith(constants.WHATSAPP_API_URL):
+        upstream = "whatsapp"
+        path = url[len(constants.WHATSAPP_API_URL):]
+    else:
+        parts = urlsplit(url)
+        upstream = parts.hostname or "unknown"
+        path = parts.path
+    segments = [("{id}" if _ID_SEGMENT.match(segment) else segment)
+                for segment in urlsplit(path).path.split("/") if segment]
+    return upstream, "/" + "/".join(segments)
+
+
+class UpstreamCall:
+    """Handle yielded by `track_upstream`; set `outcome` to record a failed response"""
+    __slots__ = ("upstream", "endpoint", "outcome")
+
+    def __init__(self, upstream: str, endpoint: str):
+        self.upstream = upstream
+        self.endpoint = endpoint
+        self.outcome = "ok"
+
+
+@asynccontextmanager
+async def track_upstream(url: str):
+    """Time an upstream call and count it by outcome (ok, http_error or error when it raised)"""
+    call = UpstreamCall(*upstream_labels(url))
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        UPSTREAM_REQUEST_SECONDS.observe(elapsed, upstream=call.upstream, endpoint=call.endpoint)
+        UPSTREAM_REQUESTS_TOTAL.inc(upstream=call.upstream, endpoint=call.endpoint, outcome=call.outcome)
+        if call.outcome == "ok":
+            UPSTREAM_LAST_SUCCESS[call.upstream] = time.monotonic()
+        for observer in UPSTREAM_OBSERVERS:
+            observer(call.upstream, elapsed, call.outcome)
@@ -0,0 +1,62 @@
+"""
+Astria pack catalogue, cached per worker.
+
+Packs change when they are published, a few times a month, yet every pack menu
+and pack selection used to fetch the list from Astria. Lists are kept for
+PACK_CATALOGUE_TTL_SECONDS, and a stale list is served while Astria can't be
+reached. Under the pre-fork server (shared/gunicorn_conf.py) the master loads
+the catalogue before forking, so workers start warm and share it.
+"""
+import asyncio
+import logging
+import time
+import aiohttp
+from Utils import aiohttp_retry, constants
+
+# listed -> (packs, time.monotonic() they expire at)
+_catalogue = {}
+
+
+def _url(listed: bool) -> str:
+    return f"{constants.ASTRIA_API_URL}/packs" + ("?listed=true" if listed else "")
+
+
+async def get_packs(session: aiohttp.ClientSession, listed: bool = False):
+    """
+    :param listed: Only the packs listed publicly, as shown in the pack menus.
+    :return: The packs, or None if Astria failed and nothing is cached.
+    """
+    entry = _catalogue.get(listed)
+    if entry is not None and entry[1] > time.monotonic():
+        return entry[0]
+    packs = await aiohttp_retry.get_with_retry(_url(listed), session=session,
+                                               headers=constants.ASTRIA_API_Authentication)
+    if packs:
+        _catalogue[listed] = (packs, time.monotonic() + float(constants.PACK_CATALOGUE_TTL_SECONDS))
+        return packs
+    if entry is not None:
+        logging.warning("Could not refresh the pack catalogue, serving the cached one")
+        return entry[0]
+    return packs
+
+
+async def find_pack(session: aiohttp.ClientSession, pack_id: int):
+    """:return: The pack with that id, or None"""
+    for pack in await get_packs(session) or ():
+        if pack["id"] == pack_id:
+            return pack
+    return None
+
+
+def preload() -> None:
+    """Fetch the catalogue before workers are forked. Blocks, call it outside any event loop"""
+    async def load() -> None:
+        async with aiohttp.ClientSession() as session:
+            await get_packs(session)
+            await get_packs(session, listed=True)
+
+    try:
+        asyncio.run(load())
+    except Exception as e:
+        # Workers then fetch it on first use
+        logging.warning(f"Could not preload the pack catalogue: {e}")
@@ -0,0 +1,165 @@
+"""
+Per-sender admission of inbound WhatsApp messages, checked before any database work.
+
+Every message costs a dedup insert, a user load and WhatsApp calls, so one user
+pasting thirty photos or a bot spamming text would otherwise crowd out everyone
+else. Each sender gets a token bucket per message kind (image, text,
+interactive), sized by the RATE_LIMIT_<KIND>_BURST and _PER_MINUTE constants.
+Buckets live in this worker's memory, or with RATE_LIMIT_BACKEND=postgres in the
+rate_buckets table, shared by all replicas at the cost of one statement per
+message. A burst of identical texts from a sender is coalesced into the first
+of them, which alone gets a reply.
+
+Messages over the limit are shed: the webhook still acknowledges them, so Meta
+doesn't redeliver, and they are counted in astria_shed_messages_total.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from Utils import constants, dbClient, metrics
+from Utils.dedup import RecentIds
+from Utils.webhook_decoder import InboundMessage
+from db import dbConfig
+
+IMAGE = "image"
+TEXT = "text"
+INTERACTIVE = "interactive"
+
+# Buckets of senders not heard from in a while are evicted first; a full bucket is all they'd hold anyway
+MAX_BUCKETS = 50_000
+
+SHED_TOTAL = metrics.REGISTRY.register(metrics.Counter(
+    "astria_shed_messages_total", "Inbound messages dropped before processing by kind and reason "
+                                  "(rate_limited, coalesced)", ["kind", "reason"]))
+
+
+@dataclass(frozen=True)
+class Policy:
+    burst: float
+    per_second: float
+
+    @classmethod
+    def from_constants(cls, burst: str, per_minute: str) -> "Policy":
+        return cls(float(burst), float(per_minute) / 60)
+
+
+POLICIES = {
+    IMAGE: Policy.from_constants(constants.RATE_LIMIT_IMAGE_BURST, constants.RATE_LIMIT_IMAGE_PER_MINUTE),
+    TEXT: Policy.from_constants(constants.RATE_LIMIT_TEXT_BURST, constants.RATE_LIMIT_TEXT_PER_MINUTE),
+    INTERACTIVE: Policy.from_constants(constants.RATE_LIMIT_INTERACTIVE_BURST,
+                                       constants.RATE_LIMIT_INTERACTIVE_PER_MINUTE),
+}
+
+
+def message_kind(message: InboundMessage) -> str:
+    if message.media_ids:
+        return IMAGE
+    if message.reply is not None or message.list_reply is not None:
+        return INTERACTIVE
+    return TEXT
+
+
+class MemoryBuckets:
+    """Token buckets of this worker, keyed by kind and sender"""
+
+    def __init__(self, max_size: int = MAX_BUCKETS):
+        self.max_size = max_size
+        # key -> [tokens, time.monotonic() they were counted at]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, policy: Policy) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [policy.burst, now]
+            else:
+                bucket[0] = min(policy.burst, bucket[0] + (now - bucket[1]) * policy.per_second)
+                bucket[1] = now
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+    async def take_all(self, requests: list) -> list:
+        """:param requests: (key, policy) pairs. :return: Whether each got a token"""
+        return [self.take(key, policy) for key, policy in requests]
+
+
+class PostgresBuckets:
+    """Token buckets in the rate_buckets table, shared by every replica"""
+
+    # The bucket is refilled for the time since it was last updated and a token taken in one
+    # statement. Without a token the WHERE fails, no row is returned and nothing changes
+    TAKE = (
+        "INSERT INTO rate_buckets (key, tokens, updated_at) VALUES ($1, $2 - 1, now()) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        "tokens = LEAST($2, rate_buckets.tokens + EXTRACT(EPOCH FROM now() - rate_buckets.updated_at) * $3) - 1, "
+        "updated_at = now() "
+        "WHERE LEAST($2, rate_buckets.tokens + EXTRACT(EPOCH FROM now() - rate_buckets.updated_at) * $3) >= 1 "
+        "RETURNING tokens"
+    )
+
+    async def take_all(self, requests: list) -> list:
+        try:
+            async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+                return [await db.execute_query_one(self.TAKE, (key, policy.burst, policy.per_second)) is not None
+                        for key, policy in requests]
+        except Exception as e:
+            # Shedding everything because the limiter is down would be worse than not limiting
+            logging.warning(f"Rate limiter unavailable, admitting {len(requests)} messages: {e}")
+            return [True] * len(requests)
+
+
+BUCKETS = PostgresBuckets() if constants.RATE_LIMIT_BACKEND == "postgres" else MemoryBuckets()
+RECENT_TEXTS = RecentIds(ttl=float(constants.RATE_LIMIT_COALESCE_SECONDS))
+
+
+def _is_repeat(message: InboundMessage) -> bool:
+    text = message.body.strip().lower()
+    if not text:
+        return False
+    key = f"{message.from_number}:{hashlib.sha1(text.encode()).hexdigest()}"
+    if key in RECENT_TEXTS:
+        return True
+    RECENT_TEXTS.add(key)
+    return False
+
+
+def _shed(message: InboundMessage, kind: str, reason: str) -> None:
+    SHED_TOTAL.inc(kind=kind, reason=reason)
+    logging.info(f"Shed {kind} message {message.message_id} from {message.from_number}: {reason}")
+
+
+async def admit(messages: list) -> list:
+    """
+    Drop the messages of senders over their rate, and repeats of a text just sent.
+    :return: The messages to process, in their original order.
+    """
+    if not constants.RATE_LIMIT_ENABLED:
+        return messages
+    candidates = []
+    for message in messages:
+        kind = message_kind(message)
+        if kind == TEXT and not message.invalid_media and _is_repeat(message):
+            _shed(message, kind, "coalesced")
+        else:
+            candidates.append((message, kind))
+    if not candidates:
+        return []
+    allowed = await BUCKETS.take_all([(f"{kind}:{message.from_number}", POLICIES[kind])
+                                      for message, kind in candidates])
+    admitted = []
+    for (message, kind), ok in zip(candidates, allowed):
+        if ok:
+            admitted.append(message)
+        else:
+            _shed(message, kind, "rate_limited")
+    return admitted
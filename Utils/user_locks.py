@@ -0,0 +1,42 @@
+"""
+Per-user serialization of message handling within a worker.
+
+State handlers read a user's row, decide, and write it back, so two messages of
+the same user handled at once could lose an update. Across workers and replicas
+that can't happen: every transition is a compare-and-swap on the row's version
+(see Utils/user_store.py), and with MESSAGE_ROUTING=sessions every message of a
+user goes to one consumer at a time, in order. Within one worker, concurrent
+invocations still overlap; `USER_LOCKS.hold(phone)` makes them take turns
+without holding up other users. No database lock is taken, so none is held
+across the handler's upstream calls.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class KeyedLocks:
+    """An asyncio.Lock per key, dropped as soon as nobody holds or waits for it"""
+
+    def __init__(self):
+        # key -> [lock, holders and waiters]
+        self._locks = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+USER_LOCKS = KeyedLocks()
@@ -0,0 +1,266 @@
+"""
+Cached access to the users table.
+
+Every inbound message needs the sender's row. Rows are kept in a per-worker LRU
+with a TTL and written through on every update made via `update_user`. Updates
+are broadcast with NOTIFY on USER_CHANGES_CHANNEL so that the other replicas
+drop their copy. The cache is only served while this worker is LISTENing; if the
+listener connection is lost, reads go to Postgres until it is re-established.
+
+Every update bumps the row's `version`. State handlers change the user with
+`transition`, which only applies if the row is still at the version the handler
+read, so two messages handled at once on different replicas can't overwrite
+each other's transition; the loser gets `StaleUserError` and is handled again
+against the fresh row. No lock is held while the handler calls upstream APIs.
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from Utils import constants, dbClient, metrics, states
+from db import dbConfig
+
+USER_CHANGES_CHANNEL = "user_changes"
+# Columns `update_user` may set or filter on
+USER_COLUMNS = frozenset(("state", "credits", "tuneid", "chosen_pack", "entity_type", "language"))
+# Identifies this worker's notifications so it does not invalidate its own writes
+REPLICA_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+TRANSITION_CONFLICTS_TOTAL = metrics.REGISTRY.register(metrics.Counter(
+    "astria_user_transition_conflicts_total", "State transitions refused because the user row had changed",
+    ["state"]))
+
+
+class StaleUserError(Exception):
+    """Raised by `transition` when the row changed since the caller read it"""
+
+
+class UserCache:
+    """
+    LRU of user rows keyed by phone number, entries expire `ttl` seconds after they are stored.
+
+    A row read from Postgres is only stored if the user wasn't invalidated while it
+    was being read: callers take a `generation()` before the SELECT and hand it to
+    `put`. Every invalidation advances the generation and is remembered per phone,
+    for as many phones as the cache holds; an older one is only known to be no
+    later than `_forgotten`, and a put across it is skipped to be safe.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._rows = OrderedDict()
+        self._generation = 0
+        # phone -> generation of its last invalidation
+        self._invalidated = OrderedDict()
+        # Generations of invalidations dropped from _invalidated are at most this
+        self._forgotten = 0
+        self._lock = threading.Lock()
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def _note_change(self, phone: str) -> None:
+        self._generation += 1
+        self._invalidated[phone] = self._generation
+        self._invalidated.move_to_end(phone)
+        while len(self._invalidated) > self.max_size:
+            _, generation = self._invalidated.popitem(last=False)
+            self._forgotten = max(self._forgotten, generation)
+
+    def get(self, phone: str):
+        with self._lock:
+            entry = self._rows.get(phone)
+            if entry is None:
+                return None
+            row, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._rows[phone]
+                return None
+            self._rows.move_to_end(phone)
+            # Callers mutate the row they get, never hand out the cached dict
+            return dict(row)
+
+    def put(self, phone: str, row: dict, generation: int = None) -> None:
+        """:param generation: `generation()` from before `row` was read; it isn't stored if the user changed since"""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and self._invalidated.get(phone, self._forgotten) > generation:
+                return
+            self._rows[phone] = (dict(row), time.monotonic() + self.ttl)
+            self._rows.move_to_end(phone)
+            while len(self._rows) > self.max_size:
+                self._rows.popitem(last=False)
+
+    def merge(self, phone: str, changes: dict) -> None:
+        """Apply an update to a cached row, keeping its expiry"""
+        with self._lock:
+            # A read of the row that started before this update must not be stored after it
+            self._note_change(phone)
+            entry = self._rows.get(phone)
+            if entry is not None:
+                entry[0].update(changes)
+
+    def invalidate(self, phone: str) -> None:
+        with self._lock:
+            self._note_change(phone)
+            self._rows.pop(phone, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._rows.clear()
+            self._invalidated.clear()
+            self._forgotten = self._generation
+
+
+CACHE = UserCache(float(constants.USER_CACHE_TTL_SECONDS or 0), int(constants.USER_CACHE_MAX_SIZE or 10000))
+
+_listener_conn = None
+_listener_lock = None
+
+
+def _on_notification(connection, pid, channel, payload: str) -> None:
+    replica_id, _, phone = payload.partition(":")
+    if replica_id != REPLICA_ID:
+        CACHE.invalidate(phone)
+
+
+def _on_listener_terminated(connection) -> None:
+    global _listener_conn
+    # Invalidations may be missed from now on, stop trusting the cache
+    _listener_conn = None
+    CACHE.clear()
+    logging.warning("User cache listener connection lost, serving users from the database")
+
+
+async def ensure_listener() -> bool:
+    """Start LISTENing on USER_CHANGES_CHANNEL once per worker. :return: True if the cache can be served"""
+    global _listener_conn, _listener_lock
+    if CACHE.ttl <= 0:
+        return False
+    if _listener_conn is not None:
+        return True
+    if _listener_lock is None:
+        _listener_lock = asyncio.Lock()
+    async with _listener_lock:
+        if _listener_conn is None:
+            conn = None
+            try:
+                # Held for the lifetime of the worker, outside the pool it would otherwise shrink
+                conn = await dbClient.connect(dbConfig.db_config)
+                await conn.add_listener(USER_CHANGES_CHANNEL, _on_notification)
+                conn.add_termination_listener(_on_listener_terminated)
+            except Exception as e:
+                logging.warning(f"Could not listen for user changes, user cache disabled for now: {e}")
+                if conn is not None:
+                    conn.terminate()
+                return False
+            CACHE.clear()
+            _listener_conn = conn
+    return True
+
+
+async def get_user(db: dbClient.AsyncDatabaseManager, phone: str):
+    """
+    Fetch a user row, from the cache when possible.
+    :return: A dictionary of the users row, or None if the user does not exist.
+    """
+    use_cache = await ensure_listener()
+    if use_cache:
+        row = CACHE.get(phone)
+        if row is not None:
+            return row
+    # A NOTIFY handled while the SELECT is in flight makes the row it returns stale
+    generation = CACHE.generation()
+    row = await db.execute_query_one(f"SELECT * FROM users WHERE phone = $1", (phone,))
+    if row is not None and use_cache:
+        CACHE.put(phone, row, generation)
+    return row
+
+
+async def create_user(db: dbClient.AsyncDatabaseManager, phone: str,
+                      language: int = states.Languages.ENGLISH.value) -> dict:
+    """Insert a new user in the NEW state and return its row"""
+    user = {
+        "phone": phone,
+        "state": states.States.NEW.value,
+        "credits": "0",
+        "tuneid": None,
+        "chosen_pack": None,
+        "entity_type": None,
+        "language": language,
+        "version": 0,
+    }
+    await db.insert_data(f"INSERT INTO users (phone, state, credits, tuneID, chosen_pack,entity_type, language) VALUES ($1, $2, '0', NULL, NULL,NULL, $3)",
+                         [phone, user["state"], user["language"]])
+    if await ensure_listener():
+        CACHE.put(phone, user)
+    return dict(user)
+
+
+async def _update(db: dbClient.AsyncDatabaseManager, phone: str, changes: dict, where: dict, version: int = None):
+    """:return: The row's new version, or None if no row matched"""
+    changes = {column.lower(): value for column, value in changes.items()}
+    where = {column.lower(): value for column, value in (where or {}).items()}
+    unknown = (changes.keys() | where.keys()) - USER_COLUMNS
+    if unknown:
+        raise ValueError(f"Unknown users columns: {sorted(unknown)}")
+    params = list(changes.values())
+    assignments = [f"{column} = ${i}" for i, column in enumerate(changes, start=1)]
+    assignments.append("version = version + 1")
+    params.append(phone)
+    conditions = [f"phone = ${len(params)}"]
+    if version is not None:
+        params.append(version)
+        conditions.append(f"version = ${len(params)}")
+    for column, value in where.items():
+        if value is None:
+            conditions.append(f"{column} IS NULL")
+        else:
+            params.append(value)
+            conditions.append(f"{column} = ${len(params)}")
+    row = await db.execute_query_one(
+        f"UPDATE users SET {', '.join(assignments)} WHERE {' AND '.join(conditions)} RETURNING version", params)
+    if row is None:
+        return None
+    sender = REPLICA_ID
+    if db.in_transaction():
+        # The transaction may still roll back. The notification is only delivered on
+        # commit, so it is sent without a sender to invalidate this worker as well
+        CACHE.invalidate(phone)
+        sender = ""
+    else:
+        CACHE.merge(phone, {**changes, "version": row["version"]})
+    await db.execute_query_one(f"SELECT pg_notify($1, $2)", (USER_CHANGES_CHANNEL, f"{sender}:{phone}"))
+    return row["version"]
+
+
+async def update_user(db: dbClient.AsyncDatabaseManager, phone: str, changes: dict, where: dict = None) -> int:
+    """
+    Update a user row, write it through to the cache and tell the other replicas.
+    Whatever the row looked like before, the update applies; state handlers use `transition`.
+    :param changes: {column: new value}
+    :param where: Extra {column: value} conditions, None matches NULL.
+    :return: The number of rows updated.
+    """
+    return 0 if await _update(db, phone, changes, where) is None else 1
+
+
+async def transition(db: dbClient.AsyncDatabaseManager, user: dict, changes: dict) -> None:
+    """
+    Apply `changes` to a user row only if it is still at the version in `user`, then to `user` itself.
+    :param user: The row as read by `get_user` or `create_user`.
+    :raises StaleUserError: If the row was updated since `user` was read.
+    """
+    version = await _update(db, user["phone"], changes, None, version=user.get("version", 0))
+    if version is None:
+        TRANSITION_CONFLICTS_TOTAL.inc(state=user["state"])
+        raise StaleUserError(f"User {user['phone']} changed since version {user.get('version', 0)}")
+    user.update({column.lower(): value for column, value in changes.items()})
+    user["version"] = version
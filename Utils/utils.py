@@ -1,5 +1,3 @@
-import cv2
-import numpy as np
 from Utils.states import Languages
 
 
@@ -39,6 +37,9 @@ def find_error_in_image_inspect(response: dict, language:Languages):
 
 
 def check_if_person(image_path: str):
+    # cv2 and numpy are imported on use to keep them out of the message path's cold start
+    import cv2
+    import numpy as np
     image = np.asarray(bytearray(image_path), dtype="uint8")
     # 0 is used for grayscale image
     img = cv2.imdecode(image, 0)
@@ -54,6 +55,7 @@ def check_if_person(image_path: str):
     return len(face) != 0
 
 def is_image_black(np_array, threshold=10):
+    import numpy as np
     # Calculate average brightness
     avg_brightness = np.mean(np_array)
     
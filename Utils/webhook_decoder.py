@@ -0,0 +1,172 @@
+"""
+Decoder for WhatsApp Cloud API webhooks.
+
+Turns the raw request body straight into immutable `InboundMessage` records that
+the message pipeline consumes as-is. Status callbacks (sent, delivered, read) are
+recognised on the raw bytes so they can be acknowledged without being parsed.
+"""
+import json
+import re
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Optional
+from Utils import constants
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library decoder is the fallback
+    orjson = None
+
+# Quotes inside JSON strings are escaped, so these only match object keys
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+_STATUSES_KEY = re.compile(rb'"statuses"\s*:')
+
+# Message types the bot can act on; anything else is answered with the invalid media message
+SUPPORTED_TYPES = frozenset(("image", "text", "interactive"))
+MEDIA_TYPES = ("image",)
+
+
+@dataclass(frozen=True, slots=True)
+class InteractiveReply:
+    """A pressed reply button or a picked list row"""
+    id: str
+    title: str
+
+
+@dataclass(frozen=True, slots=True)
+class InboundMessage:
+    message_id: str
+    from_number: str
+    body: str = ""
+    media_ids: tuple = ()
+    invalid_media: bool = False
+    reply: Optional[InteractiveReply] = None
+    list_reply: Optional[InteractiveReply] = None
+    # Unix time at which the user sent the message, as reported by WhatsApp
+    timestamp: Optional[int] = None
+
+    @property
+    def num_media(self) -> int:
+        return len(self.media_ids)
+
+
+@dataclass(frozen=True, slots=True)
+class StatusUpdate:
+    """Delivery status of a message we sent"""
+    message_id: str
+    status: str
+    timestamp: Optional[int] = None
+
+
+def loads(raw: bytes):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def is_status_only(raw: bytes) -> bool:
+    """
+    True when a webhook body carries status callbacks and no inbound messages.
+    A scan of the raw bytes, the body is not parsed. Every change has "field": "messages",
+    so it is the "messages" key that is looked for, not the word.
+    """
+    return _STATUSES_KEY.search(raw) is not None and _MESSAGES_KEY.search(raw) is None
+
+
+def _interactive_reply(reply: Optional[dict]) -> Optional[InteractiveReply]:
+    if not reply:
+        return None
+    return InteractiveReply(id=str(reply.get("id", "")), title=reply.get("title", ""))
+
+
+def _decode_message(message: dict) -> Optional[InboundMessage]:
+    if message.get("errors"):
+        # If there's an error in the message, skip processing
+        return None
+    message_type = message.get("type")
+    text = message.get("text")
+    interactive = message.get("interactive")
+    reply = list_reply = None
+    if interactive:
+        if interactive.get("type") == "button_reply":
+            reply = _interactive_reply(interactive.get("button_reply"))
+        elif interactive.get("type") == "list_reply":
+            list_reply = _interactive_reply(interactive.get("list_reply"))
+    media_ids = tuple(media["id"] for media in (message.get(media_type) for media_type in MEDIA_TYPES)
+                      if media and media.get("id"))
+    timestamp = message.get("timestamp")
+    return InboundMessage(
+        message_id=message.get("id") or str(uuid.uuid4()),
+        from_number=message.get("from", "Unknown"),
+        body=text.get("body", "") if text else "",
+        media_ids=media_ids,
+        invalid_media=message_type not in SUPPORTED_TYPES,
+        reply=reply,
+        list_reply=list_reply,
+        timestamp=int(timestamp) if timestamp else None,
+    )
+
+
+def decode_webhook(raw: bytes, phone_number_id: str = None) -> list:
+    """
+    Decode a webhook body into the inbound messages addressed to our number.
+    Changes for other phone number ids are skipped without dropping the rest of the batch.
+    :param raw: The raw request body.
+    :param phone_number_id: Our WhatsApp number id, defaults to constants.WHATSAPP_NUMBER_ID.
+    :return: A list of InboundMessage.
+    """
+    phone_number_id = phone_number_id or constants.WHATSAPP_NUMBER_ID
+    messages = []
+    for entry in loads(raw).get("entry", ()):
+        for change in entry.get("changes", ()):
+            value = change.get("value") or {}
+            if (value.get("metadata") or {}).get("phone_number_id") != phone_number_id:
+                continue
+            for message in value.get("messages", ()):
+                decoded = _decode_message(message)
+                if decoded is not None:
+                    messages.append(decoded)
+    return messages
+
+
+def decode_statuses(raw: bytes, phone_number_id: str = None) -> list:
+    """
+    Decode the status callbacks of a webhook body.
+    :return: A list of StatusUpdate.
+    """
+    phone_number_id = phone_number_id or constants.WHATSAPP_NUMBER_ID
+    statuses = []
+    for entry in loads(raw).get("entry", ()):
+        for change in entry.get("changes", ()):
+            value = change.get("value") or {}
+            if (value.get("metadata") or {}).get("phone_number_id") != phone_number_id:
+                continue
+            for status in value.get("statuses", ()):
+                timestamp = status.get("timestamp")
+                statuses.append(StatusUpdate(
+                    message_id=status.get("id", ""),
+                    status=status.get("status", "unknown"),
+                    timestamp=int(timestamp) if timestamp else None,
+                ))
+    return statuses
+
+
+def message_to_dict(message: InboundMessage) -> dict:
+    """JSON-safe form of a message, for handing it to another worker through the event broker"""
+    data = asdict(message)
+    data["media_ids"] = list(message.media_ids)
+    return data
+
+
+def message_from_dict(data: dict) -> InboundMessage:
+    """Inverse of message_to_dict"""
+    return InboundMessage(
+        message_id=data["message_id"],
+        from_number=data["from_number"],
+        body=data.get("body", ""),
+        media_ids=tuple(data.get("media_ids") or ()),
+        invalid_media=data.get("invalid_media", False),
+        reply=InteractiveReply(**data["reply"]) if data.get("reply") else None,
+        list_reply=InteractiveReply(**data["list_reply"]) if data.get("list_reply") else None,
+        timestamp=data.get("timestamp"),
+    )
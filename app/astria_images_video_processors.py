@@ -1,16 +1,16 @@
 import aiohttp
 import logging
-from Utils import constants,utils
-from azure.storage.blob import BlobServiceClient,ContentSettings
-from moviepy import ImageSequenceClip
-from PIL import Image
+from Utils import constants,utils,metrics
 from io import BytesIO
 from collections import defaultdict
-import numpy as np
 import os
-import azure.functions as func
+
+# moviepy, PIL, numpy and the blob SDK are imported inside the functions that
+# use them, so importing this module stays cheap for the function host
 
 async def update_pack_images():
+    import numpy as np
+    from PIL import Image
     os.makedirs("tmp", exist_ok=True)
     async with aiohttp.ClientSession() as session:
         async with session.get(f"{constants.ASTRIA_API_URL}/packs",
@@ -47,13 +47,16 @@ async def update_pack_images():
 
                         for entity_type,frame in frames.items():
                             output_path = f"tmp/{pack['id']}_{entity_type}.mp4"
-                            create_video_from_images(frame, output_path)
-                            upload_to_blob(output_path, f"videos/{pack['id']}_{entity_type}.mp4")
+                            with metrics.STAGE_SECONDS.time(stage="video_encode", state=""):
+                                create_video_from_images(frame, output_path)
+                            with metrics.STAGE_SECONDS.time(stage="blob_upload", state=""):
+                                upload_to_blob(output_path, f"videos/{pack['id']}_{entity_type}.mp4")
 
 def resize_image_with_padding(img, target_resolution):
     """
     Resize the image to the target size, maintaining aspect ratio and adding black padding.
     """
+    from PIL import Image
     # Create properly sized frame with black background
     frame = Image.new('RGB', target_resolution, (0, 0, 0))
     
@@ -89,6 +92,7 @@ def create_video_from_images(image_paths, output_path,fps=1):
     frame_duration: seconds each image is shown
     fps: frames per second for the output video (default 24)
     """
+    from moviepy import ImageSequenceClip
     clip = ImageSequenceClip(image_paths,fps=fps)
     clip.write_videofile(
         output_path,
@@ -106,6 +110,7 @@ def create_video_from_images(image_paths, output_path,fps=1):
 
 
 def upload_to_blob(local_path, blob_path):
+    from azure.storage.blob import BlobServiceClient,ContentSettings
     blob_service = BlobServiceClient.from_connection_string(constants.AZURE_STORAGE_CONNECTION_STRING)
     blob_client = blob_service.get_blob_client(container='videos', blob=blob_path)
     with open(local_path, "rb") as f:
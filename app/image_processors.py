@@ -1,15 +1,24 @@
 import asyncio
 from collections import Counter
+import hashlib
+import io
 import json
+import uuid
 import aiohttp
 import logging
 import azure.functions as func
-import requests
-from starlette.requests import FormData
-from Utils import constants,WhatsappWrapper, dbClient, utils,states,aiohttp_retry
+from Utils import constants,WhatsappWrapper, dbClient, utils,states,aiohttp_retry, user_store
+from Utils.webhook_decoder import InboundMessage
+from app import tune_poller
+from shared import jobs
 from db import dbConfig
 from datetime import datetime, timezone,timedelta
 
+# Longest side of staged images
+STAGED_IMAGE_MAX_SIDE = 2048
+# A prompt claimed for delivery by a worker that died is taken over after this long
+DELIVERY_LEASE = timedelta(minutes=15)
+
 
 async def get_tunes_for_user(from_number: str, session: aiohttp.ClientSession) -> list:
     user_tunes = []
@@ -47,11 +56,15 @@ async def get_characteristics(image_data, session) -> [tuple]:
             characteristics[key] = value
     return characteristics
 
-async def aggregate_characteristics(images,session):
+def vote_characteristics(characteristics_per_image: list) -> dict:
+    """
+    Pick the value of each characteristic the images agree on.
+    :param characteristics_per_image: One {characteristic: value} dict per image.
+    :return: {characteristic: most common value}, for characteristics present in at least half of the images.
+    """
     aggregated = {}
     # Iterate over characteristics and collect string values
-    for image in images:
-        characteristics = await get_characteristics(image, session)
+    for characteristics in characteristics_per_image:
         for key, value in characteristics.items():
             if isinstance(value, str):
                 aggregated.setdefault(key, []).append(value)
@@ -60,13 +73,99 @@ async def aggregate_characteristics(images,session):
 
     for key, values in aggregated.items():
         # Only set value if high enough percentage exists
-        if len(values) < len(images) / 2:
+        if len(values) < len(characteristics_per_image) / 2:
             continue
         # Find the most common value
         most_common_value = Counter(values).most_common(1)[0][0]
         common_values[key] = most_common_value
 
     return common_values
+
+async def aggregate_characteristics(images,session):
+    characteristics_per_image = [await get_characteristics(image, session) for image in images]
+    return vote_characteristics(characteristics_per_image)
+async def prepare_tune_images(wa: WhatsappWrapper.WhatsappWrapper, user_images: list, session: aiohttp.ClientSession,
+                              normalize: bool = False) -> tuple:
+    """
+    Download the user's uploads and agree on their characteristics.
+    :param normalize: Re-encode the images with normalize_image.
+    :return: (image bytes, {characteristic: value})
+    """
+    images = []
+    for row in user_images or []:
+        try:
+            image_data = await wa.get_whatsapp_image(row["path"])
+            if normalize:
+                image_data = await asyncio.to_thread(normalize_image, image_data)
+            images.append(image_data)
+        except Exception as e:
+            #Ignoring expired or deleted images
+            logging.error(f"Error fetching image {row['path']}: {e}")
+            continue
+    return images, await aggregate_characteristics(images, session)
+
+def normalize_image(image_data: bytes) -> bytes:
+    """Upright RGB JPEG no larger than STAGED_IMAGE_MAX_SIDE, the size Astria trains on anyway"""
+    # Deferred: PIL is only needed off the message path
+    from PIL import Image, ImageOps
+    with Image.open(io.BytesIO(image_data)) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((STAGED_IMAGE_MAX_SIDE, STAGED_IMAGE_MAX_SIDE))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+def tune_fingerprint(user_images: list) -> str:
+    """Identifies a set of uploads, so that a staged payload is only used for the uploads it was made from"""
+    return hashlib.sha256("\n".join(sorted(row["path"] for row in user_images)).encode()).hexdigest()
+
+def _staged_cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(hours=float(constants.STAGED_TUNE_TTL_HOURS))
+
+async def queue_tune_staging(db: dbClient.AsyncDatabaseManager, from_number: str) -> None:
+    """Prepare the tune payload in the background once a pack is chosen, see TUNE_STAGING_JOB"""
+    await jobs.enqueue_job(db, TUNE_STAGING_JOB, f"stage:{from_number}:{uuid.uuid4()}", {"phone_number": from_number})
+
+async def load_staged_tune(db: dbClient.AsyncDatabaseManager, from_number: str, user_images: list):
+    """:return: (image bytes, characteristics) staged for exactly these uploads, or None"""
+    if not user_images:
+        return None
+    row = await db.execute_query_one(
+        "SELECT images, characteristics FROM staged_tunes WHERE phone_number = $1 AND fingerprint = $2 AND created_at > $3",
+        (from_number, tune_fingerprint(user_images), _staged_cutoff())
+    )
+    if row is None:
+        return None
+    logging.info(f"Using the tune payload staged for {from_number}")
+    return list(row["images"]), json.loads(row["characteristics"])
+
+async def _stage_tune(job: jobs.JobContext) -> dict:
+    from_number = job.payload["phone_number"]
+    # Payloads of users who never paid are evicted here, before adding another one
+    await job.db.insert_data("DELETE FROM staged_tunes WHERE created_at <= $1", (_staged_cutoff(),))
+    user_images = await job.db.execute_query(f"SELECT path FROM pictures WHERE phone_number = $1", (from_number,))
+    if not user_images:
+        return {"staged": False}
+    fingerprint = tune_fingerprint(user_images)
+    current = await job.db.execute_query_one(
+        "SELECT 1 FROM staged_tunes WHERE phone_number = $1 AND fingerprint = $2", (from_number, fingerprint))
+    if current:
+        return {"staged": True}
+    async with WhatsappWrapper.WhatsappWrapper(from_number) as wa, aiohttp.ClientSession() as session:
+        images, characteristics = await prepare_tune_images(wa, user_images, session, normalize=True)
+    if not images:
+        return {"staged": False}
+    await job.db.insert_data(
+        "INSERT INTO staged_tunes (phone_number, fingerprint, images, characteristics) VALUES ($1, $2, $3, $4::jsonb) "
+        "ON CONFLICT (phone_number) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, images = EXCLUDED.images, "
+        "characteristics = EXCLUDED.characteristics, created_at = now()",
+        (from_number, fingerprint, images, json.dumps(characteristics))
+    )
+    return {"staged": True, "images": len(images)}
+
+TUNE_STAGING_JOB = "tune_staging"
+jobs.register(TUNE_STAGING_JOB, [("stage", _stage_tune)], max_attempts=3)
+
 async def tune_model_using_pack(wa: WhatsappWrapper.WhatsappWrapper, from_number: str, user_images: list[str],
                                 db: dbClient.AsyncDatabaseManager,
                                 session: aiohttp.ClientSession, pack_id: int, tune_id: str,entity_type:str):
@@ -84,74 +183,107 @@ async def tune_model_using_pack(wa: WhatsappWrapper.WhatsappWrapper, from_number
             ("tune[name]", entity_type),
             ("tune[prompts_callback]", callback),
         ]
-        images = []
-        if user_images:
-            for i, row in enumerate(user_images):
-                try:
-                    image_data = await wa.get_whatsapp_image(row["path"])
-                    data.append(("tune[images][]", image_data))
-                    images.append(image_data)
-                except Exception as e:
-                    #Ignoring expired or deleted images
-                    logging.error(f"Error fetching image {row['path']}: {e}")
-                    continue
-
-        aggregated_characteristics = await aggregate_characteristics(images, session)
+        # Staged at pack selection, while the user was still paying
+        staged = await load_staged_tune(db, from_number, user_images)
+        if staged:
+            images, aggregated_characteristics = staged
+        else:
+            images, aggregated_characteristics = await prepare_tune_images(wa, user_images, session)
+        for image_data in images:
+            data.append(("tune[images][]", image_data))
         for key, value in aggregated_characteristics.items():
             data.append((f"tune[characteristics][{key}]", value))
         result = await aiohttp_retry.post_with_retry(f"{constants.ASTRIA_API_URL}/p/{pack_id}/tunes",
                             session=session, headers=constants.ASTRIA_API_Authentication, data=data)
         if not result:
-            await wa.send_error_message()
-            return
+            # Raised so the submission job retries; the user hears of it only once it gives up
+            raise RuntimeError(f"Astria did not accept the tune of pack {pack_id}")
         logging.info(f"Got result {result}") 
         if "id" in result:
             tuneID = result["id"]
             eta = result["eta"]
             logging.info(f"PICTURESLOADED with tune_id {tuneID}")
-            await db.insert_data(f"UPDATE users SET tuneID = ($1), state = ($2) WHERE phone = ($3)",
-                            (str(tuneID), states.States.TUNEREADY.value, from_number))
-            await db.insert_data("DELETE FROM pictures WHERE phone_number = $1", (from_number,))
+            # The outbox (and pydantic with it) is imported on use, keeping it off the message path
+            from shared import outbox
+            from shared.event_broker import TuneCreatedEvent
+            async with db.transaction():
+                await user_store.update_user(db, from_number, {"tuneID": str(tuneID), "state": states.States.TUNEREADY.value})
+                await db.insert_data("DELETE FROM pictures WHERE phone_number = $1", (from_number,))
+                await tune_poller.record_pending_tune(db, tuneID, from_number, eta)
+                await db.insert_data("DELETE FROM staged_tunes WHERE phone_number = $1", (from_number,))
+                await outbox.enqueue_event(db, TuneCreatedEvent(
+                    data={"tune_id": str(tuneID), "phone_number": from_number, "pack_id": str(pack_id), "eta": eta},
+                    timestamp=datetime.now(timezone.utc).isoformat(),
+                    source_service="payment-service",
+                    ordering_key=from_number
+                ))
             timeLeft = datetime.fromisoformat(eta) - datetime.now(timezone.utc)
             await wa.send_processingimages_msg(timeLeft)
         else:
             timeLeft = timedelta(minutes=2)
             await wa.send_processingimages_msg(timeLeft)
 
-async def handle_images_from_astria(req: func.HttpRequest):
-    phoneNumber = req.params.get('phone_number')
-    logging.info(f"Received pack images for {phoneNumber}")
-    
-    try:
-        data = req.get_json()
-    except ValueError as e:
-        logging.error(f"Failed to parse JSON data: {e}")
-        return func.HttpResponse("Invalid JSON data", status_code=400)
+async def claim_prompt(db: dbClient.AsyncDatabaseManager, prompt_id: str, phone_number: str) -> bool:
+    """
+    Claim a prompt's delivery for DELIVERY_LEASE. A claim whose holder died without
+    delivering or releasing it can be taken over once the lease has run out.
+    :return: True if the prompt's images are not delivered yet and now ours to deliver
+    """
+    claimed = await db.insert_data(
+        "INSERT INTO delivered_prompts (prompt_id, phone_number, claimed_until) VALUES ($1, $2, now() + $3::interval) "
+        "ON CONFLICT (prompt_id) DO UPDATE SET claimed_until = EXCLUDED.claimed_until "
+        "WHERE delivered_prompts.delivered_at IS NULL AND delivered_prompts.claimed_until < now()",
+        (prompt_id, phone_number, DELIVERY_LEASE)
+    )
+    return bool(claimed)
 
-    if not phoneNumber:
-        logging.error("Missing phone number parameter")
-        return func.HttpResponse("Missing phone number", status_code=400)
+async def _send_postimagesent_msg(job: jobs.JobContext) -> dict:
+    # Runs on a later jobs tick, which also gives WhatsApp time to deliver the last image first
+    async with WhatsappWrapper.WhatsappWrapper(job.payload["phone_number"], job.payload["language"]) as wc:
+        await wc.send_postimagesent_msg()
+    return {"sent": True}
+
+POST_IMAGE_SENT_JOB = "post_image_sent"
+jobs.register(POST_IMAGE_SENT_JOB, [("send", _send_postimagesent_msg)], max_attempts=3)
+
+async def deliver_prompts(phoneNumber: str, prompts: list, delivered_by: str = "callback") -> int:
+    """
+    Send the images of finished Astria prompts to the user.
+    Shared by the pack-tune-received callback and the tune poller (app/tune_poller.py); each
+    prompt is claimed first, so a prompt reaching both is only delivered once, and is only
+    marked delivered once its images were sent.
+    :param delivered_by: Recorded on the prompts, "callback" or "poller".
+    :return: The number of images sent.
+    """
+    language = states.Languages.ENGLISH.value
+    claimed = []
+    async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+        row = await user_store.get_user(db, phoneNumber)
+        if row:
+            language = row.get("language", None)
+        for prompt in prompts:
+            prompt_id = prompt.get("id")
+            if prompt_id is None or await claim_prompt(db, str(prompt_id), phoneNumber):
+                claimed.append(prompt)
+    if not claimed:
+        logging.info(f"Images for {phoneNumber} were already delivered")
+        return 0
+    claimed_ids = [str(prompt["id"]) for prompt in claimed if prompt.get("id") is not None]
 
     try:
-        language = states.Languages.ENGLISH.value
-        async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
-            row = await db.execute_query_one(f"SELECT language FROM users WHERE phone = $1", (phoneNumber,))
-            if row:
-                language = row.get("language", None)
-                
-        async with WhatsappWrapper.WhatsappWrapper(phoneNumber, language) as wc:
+        async with WhatsappWrapper.WhatsappWrapper(phoneNumber, language) as wc, aiohttp.ClientSession() as session:
             await wc.send_preimagesent_msg()
-            
+
             # Add retry logic for image/video sending
             max_retries = 3
             retry_delay = 1  # seconds
-            
+
             async def send_media_with_retry(url, is_video=False):
                 for attempt in range(max_retries):
                     try:
-                        response = requests.head(url, allow_redirects=True, timeout=10)
-                        content_type = response.headers.get('Content-Type', '')
-                        
+                        async with session.head(url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                            content_type = response.headers.get('Content-Type', '')
+
                         if 'image' in content_type and not is_video:
                             await wc.send_image_to_client(phoneNumber, url)
                         elif 'video' in content_type and is_video:
@@ -163,21 +295,56 @@ async def handle_images_from_astria(req: func.HttpRequest):
                             raise
                         await asyncio.sleep(retry_delay * (attempt + 1))
 
-            if isinstance(data, list):
-                for prompt in data:
-                    images = prompt.get("images", [])
-                    for image in images:
-                        await send_media_with_retry(image)
-            else:
-                prompt = data.get("prompt")
-                if prompt:
-                    images = prompt.get("images", [])
-                    for image in images:
-                        await send_media_with_retry(image)
-
-            await asyncio.sleep(1)
-            await wc.send_postimagesent_msg()
+            image_count = 0
+            for prompt in claimed:
+                images = prompt.get("images", [])
+                for image in images:
+                    await send_media_with_retry(image)
+                image_count += len(images)
 
+    except Exception:
+        # Released so that a callback retry or the next poll delivers them
+        async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+            await db.insert_data("DELETE FROM delivered_prompts WHERE prompt_id = ANY($1::text[]) AND delivered_at IS NULL",
+                                 (claimed_ids,))
+        raise
+
+    # The closing message is a job rather than a background task, which the Functions host would not wait for
+    async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+        async with db.transaction():
+            await db.insert_data("UPDATE delivered_prompts SET delivered_at = now(), delivered_by = $2, claimed_until = NULL "
+                                 "WHERE prompt_id = ANY($1::text[])", (claimed_ids, delivered_by))
+            await jobs.enqueue_job(db, POST_IMAGE_SENT_JOB, f"post_image_sent:{phoneNumber}:{uuid.uuid4()}",
+                                   {"phone_number": phoneNumber, "language": language})
+
+    from shared import outbox
+    from shared.event_broker import ImageProcessedEvent
+    async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+        await outbox.enqueue_event(db, ImageProcessedEvent(
+            data={"phone_number": phoneNumber, "image_count": image_count},
+            timestamp=datetime.now(timezone.utc).isoformat(),
+            source_service="image-service",
+            ordering_key=phoneNumber
+        ))
+    return image_count
+
+async def handle_images_from_astria(req: func.HttpRequest):
+    phoneNumber = req.params.get('phone_number')
+    logging.info(f"Received pack images for {phoneNumber}")
+    
+    try:
+        data = req.get_json()
+    except ValueError as e:
+        logging.error(f"Failed to parse JSON data: {e}")
+        return func.HttpResponse("Invalid JSON data", status_code=400)
+
+    if not phoneNumber:
+        logging.error("Missing phone number parameter")
+        return func.HttpResponse("Missing phone number", status_code=400)
+
+    prompts = data if isinstance(data, list) else [data.get("prompt")] if data.get("prompt") else []
+    try:
+        await deliver_prompts(phoneNumber, prompts)
     except Exception as e:
         logging.error(f"Error processing images: {str(e)}")
         return func.HttpResponse(f"Internal server error: {str(e)}", status_code=500)
@@ -207,15 +374,12 @@ async def inspect_image(image_data, from_number, media_id, db : dbClient.AsyncDa
         await db.insert_data(f"INSERT INTO pictures (phone_number, path) VALUES ($1,$2)",
                         [from_number, str(media_id)])
         reaction_emoji = "🤩"
-        await db.insert_data(f"UPDATE users SET entity_type = $1 WHERE phone = $2 and entity_type IS NULL",
-                        (entity_type, from_number))
-    await wa.send_reaction_emoji(message_id,reaction_emoji)
+        await user_store.update_user(db, from_number, {"entity_type": entity_type}, where={"entity_type": None})
+    wa.in_background(wa.send_reaction_emoji(message_id,reaction_emoji), "reaction")
 
-async def handle_images(data: FormData, num_media: int, from_number: str,
+async def handle_images(message: InboundMessage, from_number: str,
                         db: dbClient.AsyncDatabaseManager, session: aiohttp.ClientSession, wa: WhatsappWrapper.WhatsappWrapper):
-    logging.info(data)
-    for i in range(num_media):
-        media_id = int(data.get(f"MediaID{i}",0))
-        message_id = data.get(f"SmsMessageSid",0)
+    logging.info(message)
+    for media_id in message.media_ids:
         image_data = await wa.get_whatsapp_image(media_id)
-        await inspect_image(image_data, from_number, media_id, db, session, wa,message_id)
\ No newline at end of file
+        await inspect_image(image_data, from_number, media_id, db, session, wa, message.message_id)
@@ -1,22 +1,40 @@
+import asyncio
 import json 
 import logging
+from dataclasses import dataclass
 from Utils import dbClient, constants, states, WhatsappWrapper, WhatsappClient
 import aiohttp
 from db import dbConfig
 from datetime import datetime, timezone
-from app.image_processors import handle_images, tune_model_using_pack, get_tunes_for_user
-from Utils import message_ids, aiohttp_retry
-from app.state_handlers import StateHandlerFactory
+from app.image_processors import handle_images, tune_model_using_pack, get_tunes_for_user, queue_tune_staging
+from Utils import message_ids, aiohttp_retry, metrics, dedup, user_store, user_locks, pack_catalogue
+from Utils.webhook_decoder import InboundMessage, InteractiveReply
+from app.state_handlers import StateHandler, StateHandlerFactory
+
+# Times a message is handled before giving up on a user whose row keeps changing under it
+MAX_HANDLER_ATTEMPTS = 3
+
+# Outcomes of a message, see MessageResult
+PROCESSED = "processed"
+DUPLICATE = "duplicate"
+INVALID = "invalid"
+FAILED = "failed"
+
+
+@dataclass(frozen=True)
+class MessageResult:
+    message_id: str
+    outcome: str
+    error: str = None
 
 
 async def send_user_pack_options(wa: WhatsappWrapper.WhatsappWrapper, session: aiohttp.ClientSession, from_number: str,db:dbClient.AsyncDatabaseManager,type_of_pack:str):
-    packs = await aiohttp_retry.get_with_retry(f"{constants.ASTRIA_API_URL}/packs?listed=true",
-                        session=session, headers=constants.ASTRIA_API_Authentication)
+    packs = await pack_catalogue.get_packs(session, listed=True)
     if not packs:
         await wa.send_error_message()
         return
     logging.info(f"Got packs: {packs}")
-    row = await db.execute_query_one(f"SELECT entity_type FROM users WHERE phone = $1", (from_number,))
+    row = await user_store.get_user(db, from_number)
     if row:
         entity_type = row["entity_type"]
         relevant_packs = [pack for pack in packs if type_of_pack in pack["slug"]]
@@ -34,52 +52,35 @@ async def send_video_examples(wa: WhatsappWrapper.WhatsappWrapper, pack_id: str,
     await wa.send_video_example(url)
 
 
-async def _parse_reply_id(reply_message: dict) -> tuple:
-    """Parse reply message and return (id, data) tuple"""
-    reply_id = reply_message.get("id", -1)
-    if reply_id == -1:
+def _parse_reply_id(reply: InteractiveReply) -> tuple:
+    """Parse a reply button or list row id of the form <id>[_<data>] and return (id, data) tuple"""
+    if not reply.id:
         return None, None
     
-    reply_parts = str(reply_id).split("_")
+    reply_parts = reply.id.split("_")
     if len(reply_parts) > 1:
         return int(reply_parts[0]), int(reply_parts[1])
     else:
         return int(reply_parts[0]), None
 
 
-async def _parse_list_reply(list_reply: dict) -> tuple:
-    """Parse list reply and return (id, data) tuple"""
-    list_id = list_reply.get("id", -1)
-    if list_id == -1:
-        return None, None
-    
-    list_parts = str(list_id).split("_")
-    if len(list_parts) > 1:
-        return int(list_parts[0]), int(list_parts[1])
-    else:
-        return int(list_parts[0]), None
-
-
-async def _handle_reply_message(handler : StateHandlerFactory.StateHandler, reply_message: dict, user: dict) -> None:
+async def _handle_reply_message(handler : StateHandler, reply_message: InteractiveReply, user: dict) -> None:
     """Route reply message to appropriate handler method"""
-    reply_id, reply_data = await _parse_reply_id(reply_message)
+    reply_id, reply_data = _parse_reply_id(reply_message)
     if reply_id is None:
         return
     
     # Handle star rating specially
     if reply_id == message_ids.STAR_RATING and reply_data is not None:
+        should_ask_for_feedback = reply_data < 4
+        if should_ask_for_feedback:
+            # Before the rating is stored, so that a conflict retries without storing it twice
+            await user_store.transition(handler.db, user, {"state": states.States.WRITING_FEEDBACK.value})
         await handler.db.insert_data(
             f"INSERT INTO ratings (phone_number, rating, date) VALUES ($1, $2, $3)",
             (handler.from_number, reply_data, datetime.now(timezone.utc).date())
         )
-        should_ask_for_feedback = reply_data < 4
         await handler.wa.send_feedback_comment(should_ask_for_feedback)
-        if should_ask_for_feedback:
-            user["state"] = states.States.WRITING_FEEDBACK.value
-            await handler.db.insert_data(
-                f"UPDATE users SET state = $1 WHERE phone = $2",
-                (user["state"], handler.from_number)
-            )
         return
     
     # Handle pack selection
@@ -90,108 +91,142 @@ async def _handle_reply_message(handler : StateHandlerFactory.StateHandler, repl
                         message_ids.SHOW_PACK_IMAGES, message_ids.SET_TUNE]:
         # It's a pack selection (numeric id)
         logging.info(f"User selected pack {reply_id}")
-        async with handler.session.get(f"{constants.ASTRIA_API_URL}/packs",
-                                    headers=constants.ASTRIA_API_Authentication) as response:
-            if not response.ok:
-                return
-            packs = await response.json()
-            for pack in packs:
-                if pack["id"] == reply_id:
-                    if user["state"] in [states.States.PICTURESLOADED.value, states.States.TUNEREADY.value]:
-                        await handler.db.insert_data(
-                            f"UPDATE users SET chosen_pack = $1 WHERE phone = $2",
-                            (str(reply_id), handler.from_number)
-                        )
-                        await handler.wa.send_user_agreement_msg()
-                    return
+        if await pack_catalogue.find_pack(handler.session, reply_id) is not None:
+            if user["state"] in [states.States.PICTURESLOADED.value, states.States.TUNEREADY.value]:
+                await user_store.transition(handler.db, user, {"chosen_pack": str(reply_id)})
+                await handler.wa.send_user_agreement_msg()
+                if user["state"] == states.States.PICTURESLOADED.value:
+                    # A new tune will need the uploads, get them ready while the user pays
+                    await queue_tune_staging(handler.db, handler.from_number)
+            return
     
     # Delegate to state handler
     await handler.handle_reply_message(reply_id, reply_data)
 
 
-async def _handle_list_reply(handler, list_reply: dict, user: dict) -> None:
+async def _handle_list_reply(handler, list_reply: InteractiveReply, user: dict) -> None:
     """Route list reply to appropriate handler method"""
-    list_id, list_data = await _parse_list_reply(list_reply)
+    list_id, list_data = _parse_reply_id(list_reply)
     if list_id is None:
         return
     
     # Handle star rating specially (for list replies)
     if list_id == message_ids.STAR_RATING and list_data is not None:
+        should_ask_for_feedback = list_data < 4
+        if should_ask_for_feedback:
+            # Before the rating is stored, so that a conflict retries without storing it twice
+            await user_store.transition(handler.db, user, {"state": states.States.WRITING_FEEDBACK.value})
         await handler.db.insert_data(
             f"INSERT INTO ratings (phone_number, rating, date) VALUES ($1, $2, $3)",
             (handler.from_number, list_data, datetime.now(timezone.utc).date())
         )
-        should_ask_for_feedback = list_data < 4
         await handler.wa.send_feedback_comment(should_ask_for_feedback)
-        if should_ask_for_feedback:
-            user["state"] = states.States.WRITING_FEEDBACK.value
-            await handler.db.insert_data(
-                f"UPDATE users SET state = $1 WHERE phone = $2",
-                (user["state"], handler.from_number)
-            )
         return
     
     # Delegate to state handler
     await handler.handle_list_reply(list_id, list_data)
                                 
-async def process_message(messages):
+async def process_message(messages: list[InboundMessage]) -> list:
+    """
+    Handle a batch of messages: each user's in order, different users' concurrently.
+    A message that fails doesn't stop the others.
+    :return: A MessageResult per message, in the order given.
+    """
     logging.info('Processing message from queue') 
-    for message in messages:
-        num_media = int(message.get("NumMedia", 0))  # Number of media files
-        from_number = message.get("From")
-        reply_message = message.get("reply",0)
-        list_reply = message.get("list_reply",0)
-        invalid_media = message.get("InvalidMedia",False)
-        message_id = message.get(f"SmsMessageSid",0)
-        text_body = message.get("Body", "")
-        async with aiohttp.ClientSession() as session:
-            async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
-                if not invalid_media:
-                    user = None
-                    try:
-                        await db.insert_data(f"INSERT INTO msgs (id, date) VALUES ($1, $2)", (message["SmsMessageSid"], datetime.now(timezone.utc).date()))
-                        logging.info("Processing message with id " + message["SmsMessageSid"])
-                    except Exception as e:
-                        logging.info(f"Message duplicate stopped {e}")
-                        return
-                user = await db.execute_query_one(f"SELECT * FROM users WHERE phone = $1", (from_number,))
-                if user is None:
-                    logging.info(f"{from_number} User entered db")
+    results = [None] * len(messages)
+    lanes = {}
+    for i, message in enumerate(messages):
+        lanes.setdefault(message.from_number, []).append(i)
+
+    async def run_lane(indexes: list) -> None:
+        for i in indexes:
+            message = messages[i]
+            # A user's messages are handled one at a time, see Utils/user_locks.py
+            async with user_locks.USER_LOCKS.hold(message.from_number):
+                try:
+                    results[i] = MessageResult(message.message_id, await _process_one(message))
+                except Exception as e:
+                    logging.error(f"Failed to process message {message.message_id}: {e}")
+                    results[i] = MessageResult(message.message_id, FAILED, str(e))
+
+    await asyncio.gather(*(run_lane(indexes) for indexes in lanes.values()))
+    return results
+
+async def _process_one(message: InboundMessage) -> str:
+    """:return: The outcome of the message"""
+    from_number = message.from_number
+    invalid_media = message.invalid_media
+    message_id = message.message_id
+    # Redeliveries this worker already handled are dropped before touching Postgres
+    if not invalid_media and dedup.seen_recently(message_id):
+        logging.info(f"Message duplicate stopped {message_id}")
+        return DUPLICATE
+    async with aiohttp.ClientSession() as session:
+        async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+            if not invalid_media:
+                user = None
+                with metrics.STAGE_SECONDS.time(stage="dedup", state=""):
+                    is_new = await dedup.claim_message(db, message_id, message.timestamp)
+                if not is_new:
+                    logging.info(f"Message duplicate stopped {message_id}")
+                    return DUPLICATE
+                logging.info("Processing message with id " + message_id)
+            with metrics.STAGE_SECONDS.time(stage="load_user", state=""):
+                user = await user_store.get_user(db, from_number)
+            if user is None:
+                logging.info(f"{from_number} User entered db")
+                try:
+                    user = await user_store.create_user(db, from_number)
+                except Exception as ex:
+                    logging.error(f"Failed to create user {from_number}: {ex}")
+                    return FAILED
+                
+            async with WhatsappWrapper.WhatsappWrapper(from_number,user["language"]) as wa:
+                wa.start_typing_indicator(message_id)
+                if invalid_media:
+                    metrics.MESSAGES_TOTAL.inc(state=user["state"], kind="invalid")
+                    await wa.send_invalid_media_message()
+                    return INVALID
+                
+                if message.media_ids:
+                    kind = "image"
+                elif message.reply is not None:
+                    kind = "reply"
+                elif message.list_reply is not None:
+                    kind = "list_reply"
+                else:
+                    kind = "text"
+                metrics.MESSAGES_TOTAL.inc(state=user["state"], kind=kind)
+                
+                # A transition that lost to a concurrent update is handled again against the fresh row
+                for attempt in range(1, MAX_HANDLER_ATTEMPTS + 1):
                     try:
-                        user = dict()
-                        user["credits"] = "0"
-                        user["tuneID"] = None
-                        user["chosen_pack"] = None
-                        user["entity_type"] = None
-                        user["state"] = states.States.NEW.value
-                        user["phone"] = from_number
-                        user["language"] = states.Languages.ENGLISH.value
-                        await db.insert_data(f"INSERT INTO users (phone, state, credits, tuneID, chosen_pack,entity_type, language) VALUES ($1, $2, '0', NULL, NULL,NULL, $3)",
-                                    [from_number, user["state"], user["language"]])
-                        
-                    except Exception as ex:
-                        return
-                    
-                async with WhatsappWrapper.WhatsappWrapper(from_number,user["language"]) as wa:
-                    await wa.send_typing_indicator(message_id)
-                    if invalid_media:
-                        await wa.send_invalid_media_message()
-                        return
-                    
-                    # Use state machine to handle message
-                    handler = StateHandlerFactory.create_handler(
-                        user["state"], user, from_number, db, session, wa
-                    )
-                    
-                    if num_media > 0:
-                        logging.info(f"Processing media for user in state {user['state']}")
-                        await handler.handle_media(message, num_media)
-                    
-                    elif reply_message != 0:
-                        await _handle_reply_message(handler, reply_message, user)
-                    
-                    elif list_reply != 0:
-                        await _handle_list_reply(handler, list_reply, user)
-                    
-                    else:
-                        await handler.handle_text_message(text_body)
+                        with metrics.STAGE_SECONDS.time(stage="dispatch", state=user["state"]):
+                            await _dispatch(message, kind, user, db, session, wa)
+                        return PROCESSED
+                    except user_store.StaleUserError as e:
+                        logging.warning(f"{e}, attempt {attempt} of handling message {message_id}")
+                    user_store.CACHE.invalidate(from_number)
+                    user = await user_store.get_user(db, from_number)
+                    if user is None:
+                        return FAILED
+                    wa.setLanguage(user["language"])
+                logging.error(f"Gave up on message {message_id} after {MAX_HANDLER_ATTEMPTS} conflicting updates")
+                await wa.send_error_message()
+                return FAILED
+
+async def _dispatch(message: InboundMessage, kind: str, user: dict, db: dbClient.AsyncDatabaseManager,
+                    session: aiohttp.ClientSession, wa: WhatsappWrapper.WhatsappWrapper):
+    # Use state machine to handle message
+    handler = StateHandlerFactory.create_handler(
+        user["state"], user, message.from_number, db, session, wa
+    )
+    if kind == "image":
+        logging.info(f"Processing media for user in state {user['state']}")
+        await handler.handle_media(message)
+    elif kind == "reply":
+        await _handle_reply_message(handler, message.reply, user)
+    elif kind == "list_reply":
+        await _handle_list_reply(handler, message.list_reply, user)
+    else:
+        await handler.handle_text_message(message.body)
@@ -1,67 +1,135 @@
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import azure.functions as func
 from Utils import constants, WhatsappWrapper
 import aiohttp
 import logging
-from Utils import dbClient
+import uuid
+from Utils import dbClient, user_store
 from app import image_processors
 from db import dbConfig
-from Utils import aiohttp_retry
+from Utils import aiohttp_retry, pack_catalogue
+from shared import jobs
+
+async def claim_payment(db: dbClient.AsyncDatabaseManager, payment_id: str) -> bool:
+    """
+    Record a payment id, to be called inside a transaction.
+    payments is partitioned by date, so (id, date) uniqueness alone would let a notification
+    retried on another day through; every retained partition is checked for the id instead.
+    :return: True if the payment is new, False if it was already recorded.
+    """
+    # Serializes concurrent notifications of the same payment until commit
+    await db.execute_query_one(f"SELECT pg_advisory_xact_lock(hashtext($1))", (payment_id,))
+    today = datetime.now(timezone.utc).date()
+    inserted = await db.insert_data(
+        f"INSERT INTO payments (id, date) SELECT $1, $2 "
+        f"WHERE NOT EXISTS (SELECT 1 FROM payments WHERE id = $1 AND date >= $3)",
+        (payment_id, today, today - timedelta(days=int(constants.RETENTION_PAYMENTS_DAYS)))
+    )
+    return inserted > 0
+
 async def process_payment(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Record a payment and queue its tune submission, acknowledging the provider right away.
+    The slow part (pack lookup, image downloads and inspection, the tune POST) runs as a
+    TUNE_SUBMISSION_JOB, see shared/jobs.py.
+    """
     data = req.get_json()
     paymentID = data['EntityID']
     phone_number = data['Properties']['Property_M-5'][0]
     full_name = data['Properties']['Property_M-10'][0]
     tier = str(data['Properties']['Property_M-3'][0]['Name'])
     logging.info(f"Received payment notification: paymentID={paymentID}, phone_number={phone_number}, full_name={full_name}, tier={tier}")
+    # Deferred: pydantic and the event models would otherwise load with the root app at cold start
+    from shared import outbox
+    from shared.event_broker import PaymentReceivedEvent
     async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
-        if paymentID:
-            paymentID = str(paymentID)
-            try:
-                await db.insert_data(f"INSERT INTO payments (id, date) VALUES ($1, $2)", (paymentID, datetime.now(timezone.utc).date()))
-                logging.info("Processing payment with id " + paymentID)
-            except Exception as e:
-                logging.info(f"payment stopped due to {e}")
-                return func.HttpResponse("OK",status_code=200)
+        try:
+            async with db.transaction():
+                if paymentID:
+                    paymentID = str(paymentID)
+                    if not await claim_payment(db, paymentID):
+                        logging.info(f"payment {paymentID} already processed")
+                        return func.HttpResponse("OK",status_code=200)
+                    await outbox.enqueue_event(db, PaymentReceivedEvent(
+                        data={"payment_id": paymentID, "phone_number": phone_number, "tier": tier},
+                        timestamp=datetime.now(timezone.utc).isoformat(),
+                        source_service="payment-service",
+                        ordering_key=phone_number
+                    ))
+                if phone_number:
+                    job_id = await jobs.enqueue_job(db, TUNE_SUBMISSION_JOB, f"payment:{paymentID or uuid.uuid4()}", {
+                        "payment_id": paymentID, "phone_number": phone_number, "full_name": full_name, "tier": tier,
+                    })
+                    logging.info(f"Queued tune submission job {job_id} for payment {paymentID}")
+        except Exception as e:
+            # Nothing was recorded, the provider's retry starts over
+            logging.error(f"Failed to record payment {paymentID}: {e}")
+            return func.HttpResponse("Error recording payment", status_code=500)
 
-        if phone_number:
-            try:
-                result = await db.execute_query_one(f"SELECT chosen_pack,tuneid,entity_type,language FROM users WHERE phone = $1",
-                                                (phone_number,))
-                if result:
-                    pack_id = result.get("chosen_pack", None)
-                    entity_type = result.get("entity_type", None)
-                    async with aiohttp.ClientSession() as session:
-                        pack_data = await aiohttp_retry.get_with_retry(f"{constants.ASTRIA_API_URL}/p/{str(pack_id)}",
-                                            session=session, headers=constants.ASTRIA_API_Authentication)
-                        if not pack_data:
-                            return func.HttpResponse("Error fetching pack data", status_code=500)
-                        if tier.lower() not in pack_data['slug']:
-                            slug_without_tier = ''.join(pack_data['slug'].split('-')[:-1])
-                            pack_id = await find_suitable_pack(tier,slug_without_tier,entity_type)
-                            await db.execute_query(f"UPDATE users SET chosen_pack = $1 WHERE phone = $2",
-                                                (str(pack_id) if pack_id else None, phone_number))
-                        tune_id = result.get("tuneid", None)
-                        language = result.get("language", None)
-                        async with WhatsappWrapper.WhatsappWrapper(phone_number,language) as wa:
-                            await wa.send_paymentreceived_msg(full_name)
-                            user_images = await db.execute_query(f"SELECT path FROM pictures WHERE phone_number = $1",
-                                                                (phone_number,))
-                            if pack_id:
-                                await image_processors.tune_model_using_pack(wa, phone_number, user_images, db, session,
-                                                                    pack_id, tune_id, entity_type)
-                    
-            except Exception as e:
-                logging.error(f"Error inserting payment data: {e}")
-                return func.HttpResponse("Error inserting payment data", status_code=500)
-            
     return func.HttpResponse("OK",status_code=200)
 
+async def _resolve_pack(job: jobs.JobContext) -> dict:
+    """Swap the chosen pack for the one of the tier that was paid for"""
+    phone_number = job.payload["phone_number"]
+    tier = job.payload["tier"]
+    result = await user_store.get_user(job.db, phone_number)
+    if not result:
+        raise jobs.PermanentJobError(f"No user {phone_number}")
+    pack_id = result.get("chosen_pack", None)
+    entity_type = result.get("entity_type", None)
+    async with aiohttp.ClientSession() as session:
+        pack_data = await aiohttp_retry.get_with_retry(f"{constants.ASTRIA_API_URL}/p/{str(pack_id)}",
+                            session=session, headers=constants.ASTRIA_API_Authentication)
+    if not pack_data:
+        raise RuntimeError("Error fetching pack data")
+    if tier.lower() not in pack_data['slug']:
+        slug_without_tier = ''.join(pack_data['slug'].split('-')[:-1])
+        pack_id = await find_suitable_pack(tier,slug_without_tier,entity_type)
+        await user_store.update_user(job.db, phone_number, {"chosen_pack": str(pack_id) if pack_id else None})
+    return {"pack_id": pack_id, "entity_type": entity_type,
+            "tune_id": result.get("tuneid", None), "language": result.get("language", None)}
+
+async def _notify_payment(job: jobs.JobContext) -> dict:
+    async with WhatsappWrapper.WhatsappWrapper(job.payload["phone_number"], job.checkpoint["language"]) as wa:
+        await wa.send_paymentreceived_msg(job.payload["full_name"])
+    return {}
+
+async def _submit_tune(job: jobs.JobContext) -> dict:
+    phone_number = job.payload["phone_number"]
+    pack_id = job.checkpoint["pack_id"]
+    if not pack_id:
+        return {}
+    # A retry after Astria accepted the tune, but before this step was checkpointed, must not order a second one
+    submitted = await job.db.execute_query_one(
+        "SELECT tune_id FROM pending_tunes WHERE phone_number = $1 "
+        "AND created_at >= (SELECT created_at FROM jobs WHERE id = $2)",
+        (phone_number, job.job_id)
+    )
+    if submitted:
+        return {"submitted_tune_id": submitted["tune_id"]}
+    user_images = await job.db.execute_query(f"SELECT path FROM pictures WHERE phone_number = $1", (phone_number,))
+    async with WhatsappWrapper.WhatsappWrapper(phone_number, job.checkpoint["language"]) as wa, \
+            aiohttp.ClientSession() as session:
+        await image_processors.tune_model_using_pack(wa, phone_number, user_images, job.db, session,
+                                                     pack_id, job.checkpoint["tune_id"], job.checkpoint["entity_type"])
+    return {}
+
+async def _report_failure(job: jobs.JobContext, error: Exception) -> None:
+    """Tell the user once the submission has run out of retries"""
+    async with WhatsappWrapper.WhatsappWrapper(job.payload["phone_number"], job.checkpoint.get("language")) as wa:
+        await wa.send_error_message()
+
+TUNE_SUBMISSION_JOB = "tune_submission"
+jobs.register(TUNE_SUBMISSION_JOB, [
+    ("resolve_pack", _resolve_pack),
+    ("notify_payment", _notify_payment),
+    ("submit_tune", _submit_tune),
+], on_failure=_report_failure)
+
 async def find_suitable_pack(tier,current_slug,entity_type,wa:WhatsappWrapper.WhatsappWrapper=None):
     chosen_pack = None
     async with aiohttp.ClientSession() as session:
-        packs = await aiohttp_retry.get_with_retry(f"{constants.ASTRIA_API_URL}/packs",
-                            session=session, headers=constants.ASTRIA_API_Authentication)
+        packs = await pack_catalogue.get_packs(session)
         if not packs:
             await wa.send_error_message()
             return None
@@ -1,6 +1,7 @@
 import logging
 from abc import ABC, abstractmethod
-from Utils import dbClient, constants, states, WhatsappWrapper, message_ids, aiohttp_retry
+from Utils import dbClient, constants, states, WhatsappWrapper, message_ids, aiohttp_retry, user_store
+from Utils.webhook_decoder import InboundMessage
 from app.image_processors import handle_images, get_tunes_for_user
 from datetime import datetime, timezone
 import aiohttp
@@ -18,7 +19,7 @@ class StateHandler(ABC):
         self.wa = wa
     
     @abstractmethod
-    async def handle_media(self, message: dict, num_media: int) -> None:
+    async def handle_media(self, message: InboundMessage) -> None:
         """Handle incoming media/images"""
         pass
     
@@ -41,10 +42,10 @@ class StateHandler(ABC):
 class NewUserStateHandler(StateHandler):
     """Handles NEW state - waiting for initial images"""
     
-    async def handle_media(self, message: dict, num_media: int) -> None:
+    async def handle_media(self, message: InboundMessage) -> None:
         """Process uploaded images for new user"""
         logging.info("Got images from NEW user")
-        await handle_images(message, num_media, self.from_number, self.db, self.session, self.wa)
+        await handle_images(message, self.from_number, self.db, self.session, self.wa)
         
         user_images = await self.db.execute_query(
             f"SELECT path FROM pictures WHERE phone_number = $1",
@@ -53,9 +54,10 @@ class NewUserStateHandler(StateHandler):
         
         if len(user_images) >= int(constants.MAX_IMAGES_THRESHOLD):
             logging.info("Got all images - transitioning to PICTURESLOADED")
-            rowCount = await self.db.insert_data(
-                f"UPDATE users SET state = $1 WHERE phone = $2 AND state = $3",
-                (states.States.PICTURESLOADED.value, self.from_number, states.States.NEW.value)
+            # Not a `transition`: the images are stored already, whichever message crosses the threshold first moves on
+            rowCount = await user_store.update_user(
+                self.db, self.from_number,
+                {"state": states.States.PICTURESLOADED.value}, where={"state": states.States.NEW.value}
             )
             if rowCount > 0:
                 await self.wa.send_additional_images_request()
@@ -109,10 +111,9 @@ class NewUserStateHandler(StateHandler):
     # Helper methods
     async def _reset_user_state(self) -> None:
         """Reset user to initial state"""
-        await self.db.insert_data(
-            f"UPDATE users SET state = $1, tuneID = $2, entity_type = $3, chosen_pack = $4 WHERE phone = $5",
-            (states.States.NEW.value, None, None, None, self.from_number)
-        )
+        await user_store.transition(self.db, self.user, {
+            "state": states.States.NEW.value, "tuneID": None, "entity_type": None, "chosen_pack": None
+        })
         await self.db.insert_data("DELETE FROM pictures WHERE phone_number = $1", (self.from_number,))
         await self.wa.send_imageguidelines_msg()
     
@@ -144,15 +145,12 @@ class NewUserStateHandler(StateHandler):
     
     async def _change_language(self) -> None:
         """Toggle user language"""
-        self.user["language"] = (
+        language = (
             states.Languages.HEBREW.value 
             if self.user["language"] == states.Languages.ENGLISH.value 
             else states.Languages.ENGLISH.value
         )
-        await self.db.insert_data(
-            f"UPDATE users SET language = $1 WHERE phone = $2",
-            (self.user["language"], self.from_number)
-        )
+        await user_store.transition(self.db, self.user, {"language": language})
         self.wa.setLanguage(self.user["language"])
         await self.wa.send_init_msg()
     
@@ -165,9 +163,9 @@ class NewUserStateHandler(StateHandler):
 class PicturesLoadedStateHandler(StateHandler):
     """Handles PICTURESLOADED state - waiting for pack selection"""
     
-    async def handle_media(self, message: dict, num_media: int) -> None:
+    async def handle_media(self, message: InboundMessage) -> None:
         """Allow additional images in PICTURESLOADED state"""
-        await handle_images(message, num_media, self.from_number, self.db, self.session, self.wa)
+        await handle_images(message, self.from_number, self.db, self.session, self.wa)
     
     async def handle_reply_message(self, reply_id: int, reply_data: int = None) -> None:
         """Handle reply messages in PICTURESLOADED state"""
@@ -225,33 +223,28 @@ class PicturesLoadedStateHandler(StateHandler):
             await self.wa.send_error_message()
             return
         
-        await self.db.insert_data(
-            f"UPDATE users SET tuneID = $1, entity_type = $2, chosen_pack = $3 WHERE phone = $4",
-            (str(pack_id), pack["name"], None, self.from_number)
-        )
+        await user_store.transition(self.db, self.user, {
+            "tuneID": str(pack_id), "entity_type": pack["name"], "chosen_pack": None
+        })
         from app.message_processor import send_user_pack_options
         await send_user_pack_options(self.wa, self.session, self.from_number, self.db, "")
     
     async def _reset_user_state(self) -> None:
         """Reset user to NEW state"""
-        await self.db.insert_data(
-            f"UPDATE users SET state = $1, tuneID = $2, entity_type = $3, chosen_pack = $4 WHERE phone = $5",
-            (states.States.NEW.value, None, None, None, self.from_number)
-        )
+        await user_store.transition(self.db, self.user, {
+            "state": states.States.NEW.value, "tuneID": None, "entity_type": None, "chosen_pack": None
+        })
         await self.db.insert_data("DELETE FROM pictures WHERE phone_number = $1", (self.from_number,))
         await self.wa.send_imageguidelines_msg()
     
     async def _change_language(self) -> None:
         """Toggle user language"""
-        self.user["language"] = (
+        language = (
             states.Languages.HEBREW.value 
             if self.user["language"] == states.Languages.ENGLISH.value 
             else states.Languages.ENGLISH.value
         )
-        await self.db.insert_data(
-            f"UPDATE users SET language = $1 WHERE phone = $2",
-            (self.user["language"], self.from_number)
-        )
+        await user_store.transition(self.db, self.user, {"language": language})
         self.wa.setLanguage(self.user["language"])
         await self.wa.send_init_msg()
     
@@ -275,7 +268,7 @@ class PicturesLoadedStateHandler(StateHandler):
 class TuneReadyStateHandler(StateHandler):
     """Handles TUNEREADY state - returning customer"""
     
-    async def handle_media(self, message: dict, num_media: int) -> None:
+    async def handle_media(self, message: InboundMessage) -> None:
         """Don't accept new images when tune is ready"""
         logging.info("Ignoring media upload in TUNEREADY state")
         return
@@ -329,10 +322,9 @@ class TuneReadyStateHandler(StateHandler):
     
     async def _reset_user_state(self) -> None:
         """Reset user to NEW state"""
-        await self.db.insert_data(
-            f"UPDATE users SET state = $1, tuneID = $2, entity_type = $3, chosen_pack = $4 WHERE phone = $5",
-            (states.States.NEW.value, None, None, None, self.from_number)
-        )
+        await user_store.transition(self.db, self.user, {
+            "state": states.States.NEW.value, "tuneID": None, "entity_type": None, "chosen_pack": None
+        })
         await self.db.insert_data("DELETE FROM pictures WHERE phone_number = $1", (self.from_number,))
         await self.wa.send_imageguidelines_msg()
     
@@ -364,15 +356,12 @@ class TuneReadyStateHandler(StateHandler):
     
     async def _change_language(self) -> None:
         """Toggle language"""
-        self.user["language"] = (
+        language = (
             states.Languages.HEBREW.value 
             if self.user["language"] == states.Languages.ENGLISH.value 
             else states.Languages.ENGLISH.value
         )
-        await self.db.insert_data(
-            f"UPDATE users SET language = $1 WHERE phone = $2",
-            (self.user["language"], self.from_number)
-        )
+        await user_store.transition(self.db, self.user, {"language": language})
         self.wa.setLanguage(self.user["language"])
         await self.wa.send_init_msg()
     
@@ -385,7 +374,7 @@ class TuneReadyStateHandler(StateHandler):
 class WritingFeedbackStateHandler(StateHandler):
     """Handles WRITING_FEEDBACK state - user providing feedback"""
     
-    async def handle_media(self, message: dict, num_media: int) -> None:
+    async def handle_media(self, message: InboundMessage) -> None:
         """Don't process media in feedback state"""
         return
     
@@ -399,15 +388,13 @@ class WritingFeedbackStateHandler(StateHandler):
     
     async def handle_text_message(self, text: str) -> None:
         """Process feedback text"""
+        # Transition first, a conflict then retries before anything was stored or sent
+        await user_store.transition(self.db, self.user, {"state": states.States.TUNEREADY.value})
         await self.db.insert_data(
             f"UPDATE ratings SET feedback = $1 WHERE phone_number = $2 AND date = $3",
             (text, self.from_number, datetime.now(timezone.utc).date())
         )
         await self.wa.send_feedback_comment(False)
-        await self.db.insert_data(
-            f"UPDATE users SET state = $1 WHERE phone = $2",
-            (states.States.TUNEREADY.value, self.from_number)
-        )
         await self.wa.send_support_email()
 
 
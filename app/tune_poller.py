@@ -0,0 +1,145 @@
+"""
+Fallback for Astria prompt callbacks that never arrive.
+
+Every tune created by `tune_model_using_pack` is recorded in `pending_tunes` with
+the ETA Astria gave for it. A timer polls Astria for the prompts of the tunes
+that are due: sparsely while the ETA is far away, then densely once it has
+passed, backing off again if Astria is running late. Prompts that have their
+images are delivered through `deliver_prompts`, the same path the
+`pack-tune-received` callback takes, and each prompt is claimed in
+`delivered_prompts` first, so whichever of the two gets to a prompt first
+delivers it and the other skips it. A tune is complete once every prompt is
+marked delivered there, which only happens after its images were sent.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+import aiohttp
+from Utils import aiohttp_retry, constants, dbClient, metrics
+from db import dbConfig
+
+# Before the ETA the next poll is half the remaining time away, after it a
+# quarter of the delay so far, always within these bounds
+MIN_POLL_INTERVAL = timedelta(minutes=1)
+MAX_POLL_INTERVAL_BEFORE_ETA = timedelta(minutes=15)
+MAX_POLL_INTERVAL_AFTER_ETA = timedelta(minutes=10)
+# Tunes created without an ETA are expected this long after creation
+DEFAULT_ETA = timedelta(minutes=30)
+# A tune claimed by one poller is left alone by the others for this long
+POLL_LEASE = timedelta(minutes=5)
+POLL_BATCH_SIZE = 50
+
+TUNE_COMPLETIONS_TOTAL = metrics.REGISTRY.register(metrics.Counter(
+    "astria_tune_completions_total",
+    "Tunes whose prompts were all delivered, by who delivered the last of them (callback, poller or expired)",
+    ["delivered_by"]))
+TUNE_POLLS_TOTAL = metrics.REGISTRY.register(metrics.Counter(
+    "astria_tune_polls_total", "Completion checks of pending tunes by result", ["result"]))
+
+
+def next_poll_at(now: datetime, eta: datetime) -> datetime:
+    if now < eta:
+        delay = min(max((eta - now) / 2, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL_BEFORE_ETA)
+    else:
+        delay = min(max((now - eta) / 4, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL_AFTER_ETA)
+    return now + delay
+
+
+async def record_pending_tune(db: dbClient.AsyncDatabaseManager, tune_id: str, phone_number: str, eta: str) -> None:
+    """
+    Start watching a tune. Call it in the transaction that stores the tune on the user.
+    :param eta: The ETA returned by Astria, an ISO 8601 timestamp.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        eta_at = datetime.fromisoformat(eta) if eta else now + DEFAULT_ETA
+    except ValueError:
+        eta_at = now + DEFAULT_ETA
+    await db.insert_data(
+        "INSERT INTO pending_tunes (tune_id, phone_number, eta, next_poll_at) VALUES ($1, $2, $3, $4) "
+        "ON CONFLICT (tune_id) DO NOTHING",
+        (str(tune_id), phone_number, eta_at, next_poll_at(now, eta_at))
+    )
+
+
+async def _claim_due_tunes(db: dbClient.AsyncDatabaseManager, limit: int) -> list:
+    # Pushing next_poll_at past the lease claims the rows, so pollers on other replicas skip them
+    return await db.execute_query(
+        "UPDATE pending_tunes SET next_poll_at = now() + $2::interval, polls = polls + 1 "
+        "WHERE tune_id IN (SELECT tune_id FROM pending_tunes WHERE completed_at IS NULL AND next_poll_at <= now() "
+        "ORDER BY next_poll_at LIMIT $1 FOR UPDATE SKIP LOCKED) "
+        "RETURNING tune_id, phone_number, eta",
+        (limit, POLL_LEASE)
+    )
+
+
+async def _complete(db: dbClient.AsyncDatabaseManager, tune_id: str, delivered_by: str) -> None:
+    await db.insert_data("UPDATE pending_tunes SET completed_at = now(), outcome = $2 WHERE tune_id = $1",
+                         (tune_id, delivered_by))
+    TUNE_COMPLETIONS_TOTAL.inc(delivered_by=delivered_by)
+
+
+async def _delivery(db: dbClient.AsyncDatabaseManager, prompts: list) -> tuple:
+    """:return: (how many of the prompts are delivered, who delivered the last of them)"""
+    row = await db.execute_query_one(
+        "SELECT count(*) FILTER (WHERE delivered_at IS NOT NULL) AS delivered, "
+        "(array_agg(delivered_by ORDER BY delivered_at DESC NULLS LAST))[1] AS last_delivered_by "
+        "FROM delivered_prompts WHERE prompt_id = ANY($1::text[])",
+        ([str(prompt.get("id")) for prompt in prompts],)
+    )
+    return row["delivered"], row["last_delivered_by"] or "callback"
+
+
+async def _poll_tune(db: dbClient.AsyncDatabaseManager, session: aiohttp.ClientSession, tune: dict) -> str:
+    """:return: The result of the check, for TUNE_POLLS_TOTAL"""
+    # Deferred so that importing the poller doesn't pull in the image pipeline
+    from app.image_processors import deliver_prompts
+
+    now = datetime.now(timezone.utc)
+    if now - tune["eta"] > timedelta(hours=float(constants.TUNE_POLL_GIVE_UP_HOURS)):
+        logging.error(f"Tune {tune['tune_id']} of {tune['phone_number']} still has no images "
+                      f"{constants.TUNE_POLL_GIVE_UP_HOURS}h after its ETA, giving up")
+        await _complete(db, tune["tune_id"], "expired")
+        return "expired"
+
+    prompts = await aiohttp_retry.get_with_retry(f"{constants.ASTRIA_API_URL}/tunes/{tune['tune_id']}/prompts",
+                                                 session=session, headers=constants.ASTRIA_API_Authentication)
+    if prompts is None:
+        result = "error"
+    else:
+        ready = [prompt for prompt in prompts if prompt.get("images")]
+        sent = await deliver_prompts(tune["phone_number"], ready, delivered_by="poller") if ready else 0
+        if sent:
+            logging.warning(f"Delivered {sent} images of tune {tune['tune_id']} that no callback had delivered")
+        if prompts and len(ready) == len(prompts):
+            # A prompt claimed by a delivery still in flight, or by one that died, isn't delivered yet
+            delivered, delivered_by = await _delivery(db, prompts)
+            if delivered == len(prompts):
+                await _complete(db, tune["tune_id"], delivered_by)
+                return "complete"
+        result = "delivered" if sent else "pending"
+
+    await db.insert_data("UPDATE pending_tunes SET next_poll_at = $2 WHERE tune_id = $1",
+                         (tune["tune_id"], next_poll_at(now, tune["eta"])))
+    return result
+
+
+async def poll_pending_tunes(limit: int = POLL_BATCH_SIZE) -> int:
+    """
+    Check every pending tune that is due and deliver the prompts that are ready.
+    :return: The number of tunes checked.
+    """
+    async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+        tunes = await _claim_due_tunes(db, limit)
+        if not tunes:
+            return 0
+        async with aiohttp.ClientSession() as session:
+            for tune in tunes:
+                try:
+                    result = await _poll_tune(db, session, tune)
+                except Exception as e:
+                    # The lease expires and the tune is polled again
+                    logging.error(f"Failed to poll tune {tune['tune_id']}: {e}")
+                    result = "error"
+                TUNE_POLLS_TOTAL.inc(result=result)
+    logging.info(f"Polled {len(tunes)} pending tunes")
+    return len(tunes)
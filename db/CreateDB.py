@@ -21,23 +21,25 @@ try:
             tuneID TEXT,
             chosen_pack TEXT,
             entity_type TEXT,
-            language INTEGER NOT NULL
+            language INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0
         )
     """)
+    # Bumped by every update, state transitions compare-and-set on it (Utils/user_store.py)
+    cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0")
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS msgs (
-            id TEXT PRIMARY KEY NOT NULL,
-            date DATE NOT NULL
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS payments (
-            id TEXT PRIMARY KEY NOT NULL,
-            date DATE NOT NULL
-        )
-    """)
+    # The "msgs" and "payments" dedup tables are partitioned by week on date.
+    # Weekly partitions are created and dropped by db/partitions.py; rows outside
+    # them land in the default partition
+    for table in ("msgs", "payments"):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id TEXT NOT NULL,
+                date DATE NOT NULL,
+                PRIMARY KEY (id, date)
+            ) PARTITION BY RANGE (date)
+        """)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
 
     # Create the "pictures" table
     cursor.execute("""
@@ -56,6 +58,99 @@ try:
             feedback TEXT
         )
     """)
+    # Create the "outbox" table - domain events written in the same transaction
+    # as the state change they describe, published later by the outbox relay
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            event_type TEXT NOT NULL,
+            ordering_key TEXT NOT NULL,
+            source_service TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            published_at TIMESTAMPTZ,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # Relay lease and dead-letter marker, see shared/outbox.py
+    cursor.execute("ALTER TABLE outbox ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMPTZ")
+    cursor.execute("ALTER TABLE outbox ADD COLUMN IF NOT EXISTS parked_at TIMESTAMPTZ")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS outbox_unpublished_idx
+        ON outbox (id) WHERE published_at IS NULL
+    """)
+    # Tunes watched by app/tune_poller.py until all their prompts are delivered
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pending_tunes (
+            tune_id TEXT PRIMARY KEY,
+            phone_number TEXT NOT NULL,
+            eta TIMESTAMPTZ NOT NULL,
+            next_poll_at TIMESTAMPTZ NOT NULL,
+            polls INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            completed_at TIMESTAMPTZ,
+            outcome TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS pending_tunes_due_idx
+        ON pending_tunes (next_poll_at) WHERE completed_at IS NULL
+    """)
+    # Prompts claimed for delivery by the Astria callback or the tune poller (app/image_processors.py),
+    # marked delivered only once their images were sent
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS delivered_prompts (
+            prompt_id TEXT PRIMARY KEY,
+            phone_number TEXT NOT NULL,
+            delivered_at TIMESTAMPTZ,
+            delivered_by TEXT,
+            claimed_until TIMESTAMPTZ
+        )
+    """)
+    # Upgrades tables created before delivery claims had a lease
+    cursor.execute("ALTER TABLE delivered_prompts ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMPTZ")
+    cursor.execute("ALTER TABLE delivered_prompts ADD COLUMN IF NOT EXISTS delivered_by TEXT")
+    cursor.execute("ALTER TABLE delivered_prompts ALTER COLUMN delivered_at DROP NOT NULL")
+    cursor.execute("ALTER TABLE delivered_prompts ALTER COLUMN delivered_at DROP DEFAULT")
+    # Background jobs run step by step by shared/jobs.py, e.g. the tune submission after a payment
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL UNIQUE,
+            payload JSONB NOT NULL,
+            checkpoint JSONB NOT NULL DEFAULT '{}',
+            step TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS jobs_due_idx
+        ON jobs (run_after) WHERE status IN ('queued', 'running')
+    """)
+    # Tune payloads prepared at pack selection, one per user, see image_processors.queue_tune_staging
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS staged_tunes (
+            phone_number TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            images BYTEA[] NOT NULL,
+            characteristics JSONB NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    # Token buckets of the shared rate limiter (RATE_LIMIT_BACKEND=postgres), see Utils/rate_limit.py
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rate_buckets (
+            key TEXT PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
     # Commit changes
     conn.commit()
     print("Tables created successfully!")
@@ -1,9 +1,171 @@
+"""
+Retention engine for the tables that grow with traffic.
+
+Each table has a `RetentionPolicy` selecting its expired rows. They are deleted
+in bounded batches, each in its own short transaction, with a pause between
+batches and an overall time budget per run, so the weekly job never holds long
+locks or writes a burst of WAL. Whatever is left over is picked up by the next run.
+"""
+import asyncio
 import datetime
-from Utils import dbClient
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+from Utils import constants, states
 from db import dbConfig
 from Utils.dbClient import AsyncDatabaseManager
 
-async def delete_outdated_records():
+
+def _days_ago(days: str) -> Callable[[], tuple]:
+    def params() -> tuple:
+        return (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=int(days)),)
+    return params
+
+
+def _hours_ago(hours: str) -> Callable[[], tuple]:
+    def params() -> tuple:
+        return (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=float(hours)),)
+    return params
+
+
+def _date_days_ago(days: str) -> Callable[[], tuple]:
+    def params() -> tuple:
+        return ((datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=int(days))).date(),)
+    return params
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    table: str
+    # WHERE clause selecting expired rows, $1..$n are the values returned by `params`
+    predicate: str
+    params: Callable[[], tuple] = tuple
+    # Unique indexed column to page through in order, or ctid for tables without a key
+    key: str = "ctid"
+
+
+@dataclass
+class TableReport:
+    table: str
+    rows_deleted: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+    # False when the time budget ran out before every expired row was deleted
+    complete: bool = True
+    vacuumed: bool = False
+
+
+@dataclass
+class RetentionReport:
+    tables: list = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def rows_deleted(self) -> int:
+        return sum(table.rows_deleted for table in self.tables)
+
+    def summary(self) -> str:
+        parts = [f"{t.table}: {t.rows_deleted} rows in {t.batches} batches, {t.seconds:.1f}s"
+                 + ("" if t.complete else " (budget exhausted)") for t in self.tables]
+        return f"Deleted {self.rows_deleted} rows in {self.seconds:.1f}s - " + "; ".join(parts)
+
+
+def default_policies() -> list:
+    return [
+        # Weekly partitions of msgs and payments are dropped whole by db/partitions.py,
+        # only their default partitions are pruned row by row
+        RetentionPolicy("msgs_default", "date < $1", _date_days_ago(constants.RETENTION_MSGS_DAYS), key="id"),
+        RetentionPolicy("payments_default", "date < $1", _date_days_ago(constants.RETENTION_PAYMENTS_DAYS), key="id"),
+        RetentionPolicy("ratings", "date < $1", _date_days_ago(constants.RETENTION_RATINGS_DAYS)),
+        # Uploads of users whose tune is already trained are never read again
+        RetentionPolicy("pictures", "phone_number IN (SELECT phone FROM users WHERE state = ANY($1::int[]))",
+                        lambda: ([states.States.TUNEREADY.value, states.States.WRITING_FEEDBACK.value],)),
+        # Parked events are kept as long as published ones, for inspection
+        RetentionPolicy("outbox", "(published_at < $1 OR parked_at < $1)", _days_ago(constants.RETENTION_OUTBOX_DAYS),
+                        key="id"),
+        RetentionPolicy("pending_tunes", "completed_at < $1", _days_ago(constants.RETENTION_TUNES_DAYS), key="tune_id"),
+        RetentionPolicy("jobs", "status IN ('succeeded', 'failed') AND updated_at < $1",
+                        _days_ago(constants.RETENTION_JOBS_DAYS), key="id"),
+        # Normally evicted by the staging job itself, this catches the rest
+        RetentionPolicy("staged_tunes", "created_at < $1", _hours_ago(constants.STAGED_TUNE_TTL_HOURS),
+                        key="phone_number"),
+        # Claims abandoned without delivering, e.g. of a tune the poller gave up on, go the same way
+        RetentionPolicy("delivered_prompts", "(delivered_at < $1 OR claimed_until < $1)",
+                        _days_ago(constants.RETENTION_TUNES_DAYS), key="prompt_id"),
+        # A bucket untouched for an hour is full again, dropping it changes nothing
+        RetentionPolicy("rate_buckets", "updated_at < $1", _hours_ago("1"), key="key"),
+    ]
+
+
+async def _delete_batch(db: AsyncDatabaseManager, policy: RetentionPolicy, params: tuple,
+                        batch_size: int, last_key) -> tuple:
+    """:return: (rows deleted, last key deleted)"""
+    limit = f"${len(params) + 1}"
+    if policy.key == "ctid":
+        # No key to page through, each batch rescans from the start of the expired rows
+        deleted = await db.insert_data(
+            f"DELETE FROM {policy.table} WHERE ctid = ANY(ARRAY("
+            f"SELECT ctid FROM {policy.table} WHERE {policy.predicate} LIMIT {limit}))",
+            (*params, batch_size)
+        )
+        return deleted, None
+    # Keyset pagination: every batch starts where the previous one ended
+    after = "" if last_key is None else f" AND {policy.key} > ${len(params) + 2}"
+    rows = await db.execute_query(
+        f"DELETE FROM {policy.table} WHERE {policy.key} IN ("
+        f"SELECT {policy.key} FROM {policy.table} WHERE {policy.predicate}{after} ORDER BY {policy.key} LIMIT {limit}) "
+        f"RETURNING {policy.key}",
+        (*params, batch_size) if last_key is None else (*params, batch_size, last_key)
+    )
+    return len(rows), max((row[policy.key] for row in rows), default=last_key)
+
+
+async def apply_retention(policies: list = None, batch_size: int = None, pause: float = None,
+                          time_budget: float = None, vacuum: bool = None) -> RetentionReport:
+    """
+    Delete expired rows of every policy's table in bounded batches.
+    :param batch_size: Rows deleted per batch.
+    :param pause: Seconds slept between batches.
+    :param time_budget: Seconds the whole run may take, checked between batches.
+    :param vacuum: Run VACUUM (ANALYZE) on tables rows were deleted from.
+    :return: A RetentionReport.
+    """
+    policies = default_policies() if policies is None else policies
+    batch_size = batch_size or int(constants.RETENTION_BATCH_SIZE)
+    pause = float(constants.RETENTION_BATCH_PAUSE_SECONDS) if pause is None else pause
+    time_budget = float(constants.RETENTION_TIME_BUDGET_SECONDS) if time_budget is None else time_budget
+    vacuum = constants.RETENTION_VACUUM if vacuum is None else vacuum
+
+    report = RetentionReport()
+    started = time.monotonic()
+    deadline = started + time_budget
     async with AsyncDatabaseManager(dbConfig.db_config) as db:
-        await db.insert_data(f"DELETE FROM msgs WHERE date < ($1)",
-                                                    [(datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=14)).date()])
\ No newline at end of file
+        for policy in policies:
+            table_report = TableReport(policy.table)
+            report.tables.append(table_report)
+            table_started = time.monotonic()
+            params = policy.params()
+            last_key = None
+            while True:
+                if time.monotonic() >= deadline:
+                    table_report.complete = False
+                    break
+                deleted, last_key = await _delete_batch(db, policy, params, batch_size, last_key)
+                table_report.rows_deleted += deleted
+                table_report.batches += 1
+                if deleted < batch_size:
+                    break
+                await asyncio.sleep(pause)
+            if vacuum and table_report.rows_deleted > 0 and time.monotonic() < deadline:
+                await db.execute_command(f"VACUUM (ANALYZE) {policy.table}")
+                table_report.vacuumed = True
+            table_report.seconds = time.monotonic() - table_started
+    report.seconds = time.monotonic() - started
+    logging.info(report.summary())
+    return report
+
+
+async def delete_outdated_records() -> RetentionReport:
+    """Apply the default retention policies"""
+    return await apply_retention()
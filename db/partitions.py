@@ -0,0 +1,170 @@
+"""
+Weekly range partitions of the msgs and payments dedup tables.
+
+Both tables are only ever read by primary key and pruned by date, so they are
+partitioned by week on `date`. Partitions are created ahead of time, and expired
+weeks are dropped whole instead of being deleted row by row. Rows falling outside
+every weekly partition land in `<table>_default`, which the retention engine prunes.
+
+Existing unpartitioned tables are converted with:
+    python -m db.partitions migrate
+"""
+import asyncio
+import datetime
+import logging
+import sys
+from Utils import constants
+from db import dbConfig
+from Utils.dbClient import AsyncDatabaseManager
+
+WEEKS_AHEAD = 4
+PARTITION_NAME_FORMAT = "%Y%m%d"
+
+
+def partitioned_tables() -> dict:
+    """:return: {table: retention in days}"""
+    return {
+        "msgs": int(constants.RETENTION_MSGS_DAYS),
+        "payments": int(constants.RETENTION_PAYMENTS_DAYS),
+    }
+
+
+def week_start(day: datetime.date) -> datetime.date:
+    """Monday of the week `day` falls in"""
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def partition_name(table: str, start: datetime.date) -> str:
+    return f"{table}_p{start.strftime(PARTITION_NAME_FORMAT)}"
+
+
+def _partition_start(table: str, name: str):
+    prefix = f"{table}_p"
+    if not name.startswith(prefix):
+        return None
+    try:
+        return datetime.datetime.strptime(name[len(prefix):], PARTITION_NAME_FORMAT).date()
+    except ValueError:
+        return None
+
+
+async def _create_partition(db: AsyncDatabaseManager, table: str, start: datetime.date) -> None:
+    end = start + datetime.timedelta(weeks=1)
+    await db.execute_command(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, start)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+
+
+async def list_partitions(db: AsyncDatabaseManager, table: str) -> dict:
+    """:return: {weekly partition name: first day of its week}"""
+    rows = await db.execute_query(
+        "SELECT c.relname AS name FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = $1",
+        (table,)
+    )
+    partitions = {}
+    for row in rows:
+        start = _partition_start(table, row["name"])
+        if start is not None:
+            partitions[row["name"]] = start
+    return partitions
+
+
+async def ensure_partitions(db: AsyncDatabaseManager, table: str, weeks_ahead: int = WEEKS_AHEAD,
+                            since: datetime.date = None, strict: bool = False) -> list:
+    """
+    Create the weekly partitions from `since` (default: this week) up to `weeks_ahead` weeks ahead.
+    :param strict: Raise if a partition can't be created instead of logging it and going on with the
+        next. Needed inside a transaction, which the failed statement aborts.
+    :return: Names of the partitions created.
+    """
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    start = week_start(since or today)
+    last = week_start(today) + datetime.timedelta(weeks=weeks_ahead)
+    existing = await list_partitions(db, table)
+    created = []
+    while start <= last:
+        name = partition_name(table, start)
+        if name not in existing:
+            try:
+                await _create_partition(db, table, start)
+                created.append(name)
+            except Exception as e:
+                if strict:
+                    raise
+                # e.g. the default partition already holds rows of that week
+                logging.error(f"Could not create partition {name}: {e}")
+        start += datetime.timedelta(weeks=1)
+    return created
+
+
+async def drop_expired_partitions(db: AsyncDatabaseManager, table: str, retention_days: int) -> list:
+    """
+    Drop the weekly partitions whose every row is older than the retention period.
+    :return: Names of the partitions dropped.
+    """
+    cutoff = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=retention_days)
+    dropped = []
+    for name, start in sorted((await list_partitions(db, table)).items(), key=lambda item: item[1]):
+        if start + datetime.timedelta(weeks=1) > cutoff:
+            continue
+        await db.execute_command(f"DROP TABLE IF EXISTS {name}")
+        dropped.append(name)
+    return dropped
+
+
+async def maintain_partitions() -> dict:
+    """
+    Pre-create upcoming partitions and drop expired ones for every partitioned table.
+    :return: {table: {"created": [...], "dropped": [...]}}
+    """
+    report = {}
+    async with AsyncDatabaseManager(dbConfig.db_config) as db:
+        for table, retention_days in partitioned_tables().items():
+            report[table] = {
+                "created": await ensure_partitions(db, table),
+                "dropped": await drop_expired_partitions(db, table, retention_days),
+            }
+    logging.info(f"Partition maintenance: {report}")
+    return report
+
+
+async def migrate_to_partitioned(table: str, retention_days: int) -> bool:
+    """
+    Convert an unpartitioned msgs/payments table, keeping the rows still within retention.
+    :return: False if the table was already partitioned.
+    """
+    async with AsyncDatabaseManager(dbConfig.db_config) as db:
+        row = await db.execute_query_one("SELECT relkind FROM pg_class WHERE relname = $1", (table,))
+        if row is None or row["relkind"] == "p":
+            return False
+        cutoff = datetime.datetime.now(datetime.timezone.utc).date() - datetime.timedelta(days=retention_days)
+        legacy = f"{table}_unpartitioned"
+        async with db.transaction():
+            await db.execute_command(f"ALTER TABLE {table} RENAME TO {legacy}")
+            await db.execute_command(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey")
+            await db.execute_command(
+                f"CREATE TABLE {table} (id TEXT NOT NULL, date DATE NOT NULL, PRIMARY KEY (id, date)) "
+                f"PARTITION BY RANGE (date)"
+            )
+            await db.execute_command(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+            await ensure_partitions(db, table, since=cutoff, strict=True)
+            await db.insert_data(f"INSERT INTO {table} (id, date) SELECT id, date FROM {legacy} WHERE date >= $1",
+                                 (cutoff,))
+            await db.execute_command(f"DROP TABLE {legacy}")
+    logging.info(f"Converted {table} to weekly partitions")
+    return True
+
+
+async def _main(command: str) -> None:
+    if command == "migrate":
+        for table, retention_days in partitioned_tables().items():
+            migrated = await migrate_to_partitioned(table, retention_days)
+            print(f"{table}: {'migrated' if migrated else 'already partitioned'}")
+    await maintain_partitions()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "maintain"))
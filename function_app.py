@@ -1,15 +1,24 @@
 import json
-from Utils import WhatsappClient
+from Utils import webhook_decoder, delivery_metrics, metrics, health, capture, dbClient, rate_limit, admission
 import azure.functions as func
 import logging
 from app.message_processor import process_message   
 from app.image_processors import handle_images_from_astria
 from app.payment_processors import process_payment
-from app.astria_images_video_processors import update_pack_images
+from app.tune_poller import poll_pending_tunes
+from shared import jobs
+from db import dbConfig
 from db.db_maintenance import delete_outdated_records
+from db.partitions import maintain_partitions
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
+
+def _busy() -> func.HttpResponse:
+    """Answer to a webhook refused by admission control, the sender redelivers it later"""
+    return func.HttpResponse("Busy", status_code=admission.BUSY_STATUS, headers={"Retry-After": admission.retry_after()})
+
+
 @app.function_name(name="handle_db_maintenance")
 @app.schedule(
     schedule="0 0 4 * * 3",
@@ -18,21 +27,85 @@ app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 )
 async def handle_db_maintenance(mytimer: func.TimerRequest) -> None:
     logging.info('started performing maintenance')
+    await maintain_partitions()
     await delete_outdated_records()
     logging.info('finished performing maintenance')
 
+@app.function_name(name="handle_pending_tunes")
+@app.schedule(
+    schedule="0 */1 * * * *",
+    arg_name="mytimer",
+    run_on_startup=False
+)
+async def handle_pending_tunes(mytimer: func.TimerRequest) -> None:
+    """
+        Delivers the images of tunes whose Astria callback never arrived
+    """
+    await poll_pending_tunes()
+
+@app.function_name(name="handle_background_jobs")
+@app.schedule(
+    schedule="*/10 * * * * *",
+    arg_name="mytimer",
+    run_on_startup=True
+)
+async def handle_background_jobs(mytimer: func.TimerRequest) -> None:
+    """
+        Runs queued background jobs, e.g. the tune submission of a payment
+    """
+    await jobs.run_due_jobs()
+
+_outbox_relay = None
+
+@app.function_name(name="relay_outbox")
+@app.schedule(
+    schedule="*/15 * * * * *",
+    arg_name="mytimer",
+    run_on_startup=True
+)
+async def relay_outbox(mytimer: func.TimerRequest) -> None:
+    """
+        Publishes the domain events written to the outbox, at-least-once and ordered per user
+    """
+    global _outbox_relay
+    # Deferred: the broker and its event models aren't needed to serve a webhook
+    from shared.outbox import OutboxRelay
+    try:
+        # One relay, and so one broker connection, for the life of the worker
+        if _outbox_relay is None:
+            _outbox_relay = OutboxRelay()
+        await _outbox_relay.relay_pending()
+    except Exception as e:
+        logging.error(f"Outbox relay failed: {e}")
+
+@app.route(route="jobs/{job_id:int}", methods=["GET"])
+async def job_status(req: func.HttpRequest) -> func.HttpResponse:
+    """
+        Progress of a background job: status, current step and last error
+    """
+    async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+        job = await jobs.get_job(db, int(req.route_params["job_id"]))
+    if job is None:
+        return func.HttpResponse("Job not found", status_code=404)
+    return func.HttpResponse(json.dumps(job), status_code=200, mimetype="application/json")
+
 @app.route(route="pack-tune-received")
 async def receive_pack_images(req: func.HttpRequest) -> func.HttpResponse:
     """
         Webhook to receive images from Astria after prompt generation
     """
-    return await handle_images_from_astria(req)
+    capture.record(capture.ROUTE_PACK_IMAGES, req.get_body(), req.params)
+    async with admission.admitted(capture.ROUTE_PACK_IMAGES, observed=False) as admitted:
+        if not admitted:
+            return _busy()
+        return await handle_images_from_astria(req)
 
 @app.route(route="payment-received")
 async def recieve_payment(req: func.HttpRequest) -> func.HttpResponse:
     """
         Webhook to receive images from Astria after prompt generation
     """
+    capture.record(capture.ROUTE_PAYMENT, req.get_body())
     return await process_payment(req)
 
 
@@ -42,6 +115,8 @@ async def update_images(req: func.HttpRequest) -> func.HttpResponse:
         Webhook to update images in azure storage from Astria
     """
     logging.info('Updating images in Azure Storage')
+    # Deferred: pulls in moviepy, PIL, numpy and the blob SDK, which no other route needs
+    from app.astria_images_video_processors import update_pack_images
     await update_pack_images()
     return func.HttpResponse(
         "Images updated successfully",
@@ -54,7 +129,6 @@ async def receive_sms(req: func.HttpRequest) -> func.HttpResponse:
     """
     Webhook to receive SMS/MMS from Meta
     """
-    logging.info('Got Message From Whatsapp')   
     if req.method == "GET":
         # Handle webhook verification
         hub_verify_token = req.params.get("hub.verify_token")
@@ -64,13 +138,56 @@ async def receive_sms(req: func.HttpRequest) -> func.HttpResponse:
         return func.HttpResponse("Verification failed", status_code=403)
 
     elif req.method == "POST":
-        logging.info(f"Received Whatsapp webhook message")
-        data = req.get_json()
-        messages = WhatsappClient.process_incoming_messages(data)
-        if len(messages) == 0:
+        raw = req.get_body()
+        capture.record(capture.ROUTE_WHATSAPP, raw)
+        # Status callbacks (sent, delivered, read) are most of the webhook volume and
+        # carry nothing to process, acknowledge them before the message pipeline and its logging
+        if webhook_decoder.is_status_only(raw):
+            delivery_metrics.observe_statuses(raw)
             return func.HttpResponse(status_code=200)
-        await process_message(messages)
+        logging.info(f"Received Whatsapp webhook message")
+        # Refused before the rate limiter sees the messages, their redelivery isn't taken for a repeat
+        async with admission.admitted(capture.ROUTE_WHATSAPP) as admitted:
+            if not admitted:
+                return _busy()
+            messages = await rate_limit.admit(webhook_decoder.decode_webhook(raw))
+            if len(messages) == 0:
+                return func.HttpResponse(status_code=200)
+            await process_message(messages)
     # Respond back
     return func.HttpResponse(
             status_code=200
-        )
\ No newline at end of file
+        )
+
+
+@app.route(route="metrics", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def metrics_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Prometheus scrape endpoint for this worker's latency histograms and counters
+    """
+    return func.HttpResponse(
+        metrics.REGISTRY.render(),
+        status_code=200,
+        headers={"Content-Type": metrics.PROMETHEUS_CONTENT_TYPE}
+    )
+
+
+readiness = health.ReadinessProbe(warm_caches=True)
+
+
+@app.route(route="health", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def health_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Liveness probe - the worker is up and able to serve requests
+    """
+    return func.HttpResponse(health.liveness_body(), status_code=200, mimetype="application/json")
+
+
+@app.route(route="ready", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def ready_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Readiness probe - DB pool warm, upstreams reachable and caches warm.
+    Results are cached, so probing never opens connections per call
+    """
+    status_code, body = await health.readiness_body(readiness)
+    return func.HttpResponse(body, status_code=status_code, mimetype="application/json")
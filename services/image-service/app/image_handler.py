@@ -4,7 +4,13 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../'))
 
 from app.image_processors import handle_images_from_astria
+from app.tune_poller import poll_pending_tunes
 from app.astria_images_video_processors import update_pack_images
+from datetime import datetime, timezone
+from db import dbConfig
+from shared import outbox
+from shared.event_broker import PackImagesUpdatedEvent
+from Utils.dbClient import AsyncDatabaseManager
 
 
 class ImageHandler:
@@ -20,15 +26,15 @@ class ImageHandler:
         # Use existing image processor
         response = await handle_images_from_astria(req)
         
-        # Publish event for other services
-        # (e.g., message service can notify user)
-        # event = ImageProcessedEvent(
-        #     data={...}
-        # )
-        # await self.event_broker.publish(event)
+        # ImageProcessedEvent is written to the outbox by the image processor
+        # and published by the outbox relay in the maintenance service
         
         return response
     
+    async def poll_pending_tunes(self) -> int:
+        """Deliver images of tunes whose Astria callback was lost"""
+        return await poll_pending_tunes()
+    
     async def update_pack_images(self) -> None:
         """Update pack images in Azure Storage"""
         logging.info("Updating pack images")
@@ -36,6 +42,9 @@ class ImageHandler:
         # Use existing image update processor
         await update_pack_images()
         
-        # Publish event
-        # event = PackImagesUpdatedEvent(...)
-        # await self.event_broker.publish(event)
+        async with AsyncDatabaseManager(dbConfig.db_config) as db:
+            await outbox.enqueue_event(db, PackImagesUpdatedEvent(
+                data={},
+                timestamp=datetime.now(timezone.utc).isoformat(),
+                source_service="image-service"
+            ))
@@ -7,11 +7,18 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../'))
 import azure.functions as func
 from app.image_handler import ImageHandler
 from shared.event_broker import get_event_broker
+from Utils import metrics, health, capture, admission
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 event_broker = get_event_broker()
 image_handler = ImageHandler(event_broker)
 
+
+def _busy() -> func.HttpResponse:
+    """Answer to a webhook refused by admission control, the sender redelivers it later"""
+    return func.HttpResponse("Busy", status_code=admission.BUSY_STATUS, headers={"Retry-After": admission.retry_after()})
+
+
 @app.route(route="pack-tune-received")
 async def receive_pack_images(req: func.HttpRequest) -> func.HttpResponse:
     """
@@ -20,13 +27,35 @@ async def receive_pack_images(req: func.HttpRequest) -> func.HttpResponse:
     """
     try:
         logging.info('Received pack/tune images from Astria')
-        await image_handler.handle_astria_images(req)
+        capture.record(capture.ROUTE_PACK_IMAGES, req.get_body(), req.params)
+        # Images refused here are delivered by the tune poller if Astria doesn't redeliver them
+        async with admission.admitted(capture.ROUTE_PACK_IMAGES, observed=False) as admitted:
+            if not admitted:
+                return _busy()
+            await image_handler.handle_astria_images(req)
         return func.HttpResponse("Images processed successfully", status_code=200)
     except Exception as e:
         logging.error(f"Failed to process Astria images: {e}")
         return func.HttpResponse(f"Error: {str(e)}", status_code=500)
 
 
+@app.function_name(name="poll_pending_tunes")
+@app.schedule(
+    schedule="0 */1 * * * *",  # Every minute
+    arg_name="mytimer",
+    run_on_startup=False
+)
+async def poll_pending_tunes(mytimer: func.TimerRequest) -> None:
+    """
+    Fallback for lost Astria callbacks: polls tunes past due and delivers
+    the images of their finished prompts
+    """
+    try:
+        await image_handler.poll_pending_tunes()
+    except Exception as e:
+        logging.error(f"Tune poller failed: {e}")
+
+
 @app.route(route="update-images")
 async def update_images(req: func.HttpRequest) -> func.HttpResponse:
     """
@@ -41,3 +70,36 @@ async def update_images(req: func.HttpRequest) -> func.HttpResponse:
     except Exception as e:
         logging.error(f"Failed to update images: {e}")
         return func.HttpResponse(f"Error: {str(e)}", status_code=500)
+
+
+@app.route(route="metrics", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def metrics_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Prometheus scrape endpoint for this worker's latency histograms and counters
+    """
+    return func.HttpResponse(
+        metrics.REGISTRY.render(),
+        status_code=200,
+        headers={"Content-Type": metrics.PROMETHEUS_CONTENT_TYPE}
+    )
+
+
+readiness = health.ReadinessProbe(event_broker, warm_caches=True)
+
+
+@app.route(route="health", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def health_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Liveness probe - the worker is up and able to serve requests
+    """
+    return func.HttpResponse(health.liveness_body(), status_code=200, mimetype="application/json")
+
+
+@app.route(route="ready", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def ready_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Readiness probe - DB pool warm, upstreams reachable, broker connected and caches warm.
+    Results are cached, so probing never opens connections per call
+    """
+    status_code, body = await health.readiness_body(readiness)
+    return func.HttpResponse(body, status_code=status_code, mimetype="application/json")
@@ -3,7 +3,9 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../'))
 
-from db.db_maintenance import delete_outdated_records
+from db.db_maintenance import apply_retention
+from db.partitions import maintain_partitions
+from shared.outbox import OutboxRelay
 
 
 class MaintenanceHandler:
@@ -16,7 +18,13 @@ class MaintenanceHandler:
         """Clean up outdated records from database"""
         logging.info("Starting database cleanup")
         
-        # Use existing maintenance processor
-        await delete_outdated_records()
+        # Expired weeks of msgs and payments are dropped whole, the rest is deleted in batches
+        await maintain_partitions()
+        report = await apply_retention()
         
-        logging.info("Database cleanup completed")
+        logging.info(f"Database cleanup completed: {report.summary()}")
+
+    async def relay_outbox(self) -> int:
+        """Publish domain events waiting in the outbox"""
+        relay = OutboxRelay(self.event_broker)
+        return await relay.relay_pending()
@@ -6,6 +6,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../'))
 import azure.functions as func
 from app.maintenance_handler import MaintenanceHandler
 from shared.event_broker import get_event_broker
+from Utils import metrics, health
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 event_broker = get_event_broker()
@@ -29,3 +30,53 @@ async def handle_db_maintenance(mytimer: func.TimerRequest) -> None:
     except Exception as e:
         logging.error(f"Database maintenance failed: {e}")
         raise
+
+
+@app.function_name(name="relay_outbox")
+@app.schedule(
+    schedule="*/15 * * * * *",  # Every 15 seconds
+    arg_name="mytimer",
+    run_on_startup=True
+)
+async def relay_outbox(mytimer: func.TimerRequest) -> None:
+    """
+    Publishes domain events written to the outbox by the other services
+    Delivery is at-least-once and ordered per user
+    """
+    try:
+        await maintenance_handler.relay_outbox()
+    except Exception as e:
+        logging.error(f"Outbox relay failed: {e}")
+
+
+@app.route(route="metrics", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def metrics_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Prometheus scrape endpoint for this worker's latency histograms and counters
+    """
+    return func.HttpResponse(
+        metrics.REGISTRY.render(),
+        status_code=200,
+        headers={"Content-Type": metrics.PROMETHEUS_CONTENT_TYPE}
+    )
+
+
+readiness = health.ReadinessProbe(event_broker, upstreams=())
+
+
+@app.route(route="health", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def health_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Liveness probe - the worker is up and able to serve requests
+    """
+    return func.HttpResponse(health.liveness_body(), status_code=200, mimetype="application/json")
+
+
+@app.route(route="ready", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def ready_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Readiness probe - DB pool warm, upstreams reachable and broker connected.
+    Results are cached, so probing never opens connections per call
+    """
+    status_code, body = await health.readiness_body(readiness)
+    return func.HttpResponse(body, status_code=status_code, mimetype="application/json")
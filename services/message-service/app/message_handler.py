@@ -3,7 +3,11 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../'))
 
-from app.message_processor import process_message
+from datetime import datetime, timezone
+from app.message_processor import FAILED, DUPLICATE, process_message
+from db import dbConfig
+from shared.event_broker import Event, UserMessageReceivedEvent
+from Utils import dbClient, dedup, webhook_decoder
 
 
 class MessageHandler:
@@ -11,15 +15,54 @@ class MessageHandler:
     
     def __init__(self, event_broker):
         self.event_broker = event_broker
+
+    @staticmethod
+    def _received_event(message, outcome: str = None) -> UserMessageReceivedEvent:
+        data = webhook_decoder.message_to_dict(message)
+        if outcome is not None:
+            data["outcome"] = outcome
+        return UserMessageReceivedEvent(
+            data=data,
+            timestamp=datetime.now(timezone.utc).isoformat(),
+            source_service="message-service",
+            ordering_key=message.from_number
+        )
     
-    async def process_messages(self, messages: list) -> None:
-        """Process incoming WhatsApp messages"""
-        for message in messages:
-            logging.info(f"Processing message: {message.get('SmsMessageSid')}")
-            
-            try:
-                # Use existing message processor with event broker
-                await process_message(messages, event_broker=self.event_broker)
-            except Exception as e:
-                logging.error(f"Failed to process message: {e}")
-                raise
+    async def process_messages(self, messages: list) -> list:
+        """
+        Process incoming WhatsApp messages as one batch, then announce them in one broker call
+        :return: A MessageResult per message, in the order given
+        """
+        logging.info(f"Processing {len(messages)} messages")
+        # Failures are logged by the pipeline and don't stop the rest of the batch
+        results = await process_message(messages)
+        # Duplicates were announced when they were first processed
+        events = [self._received_event(message, result.outcome)
+                  for message, result in zip(messages, results) if result.outcome != DUPLICATE]
+        try:
+            await self.event_broker.publish_batch(events)
+        except Exception as e:
+            # The messages are handled and claimed; failing the webhook would only get them redelivered as duplicates
+            logging.error(f"Failed to announce {len(events)} processed messages: {e}")
+        return results
+
+    async def route_messages(self, messages: list) -> None:
+        """Hand messages to Service Bus, in a session per sender so each user's are handled in order"""
+        await self.event_broker.publish_batch([self._received_event(message) for message in messages])
+
+    async def handle_routed_message(self, body: bytes) -> None:
+        """Process a message published by route_messages"""
+        event = Event.model_validate_json(body)
+        if "outcome" in event.data:
+            # Announced by process_messages, which already handled it
+            return
+        message = webhook_decoder.message_from_dict(event.data)
+        logging.info(f"Processing routed message: {message.message_id}")
+        [result] = await process_message([message])
+        if result.outcome == FAILED:
+            # The message was claimed before it failed; without releasing the claim
+            # the redelivery would be dropped as a duplicate
+            async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+                await dedup.release_message(db, message.message_id, message.timestamp)
+            # Abandoned, so Service Bus redelivers it
+            raise RuntimeError(f"Failed to process routed message {message.message_id}: {result.error}")
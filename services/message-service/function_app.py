@@ -4,21 +4,33 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../'))
 
-from Utils import WhatsappClient
+from Utils import webhook_decoder, delivery_metrics, metrics, health, capture, constants, rate_limit, admission
 import azure.functions as func
 from app.message_handler import MessageHandler
-from shared.event_broker import get_event_broker, Event
+from shared.event_broker import get_event_broker, Event, ServiceBusEventBroker
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 event_broker = get_event_broker()
 
+# With sessions, the webhook only hands messages to Service Bus, in sessions keyed by
+# the sender's number; process_user_messages then gets each user's messages one at a
+# time on whichever replica holds that session
+ROUTE_BY_SESSION = constants.MESSAGE_ROUTING == "sessions"
+if ROUTE_BY_SESSION and not isinstance(event_broker, ServiceBusEventBroker):
+    logging.warning("MESSAGE_ROUTING=sessions needs the Service Bus broker, handling messages inline")
+    ROUTE_BY_SESSION = False
+
+
+def _busy() -> func.HttpResponse:
+    """Answer to a webhook refused by admission control, the sender redelivers it later"""
+    return func.HttpResponse("Busy", status_code=admission.BUSY_STATUS, headers={"Retry-After": admission.retry_after()})
+
 @app.route(route="SmsReceived", methods=["GET", "POST"])
 async def receive_sms(req: func.HttpRequest) -> func.HttpResponse:
     """
     Webhook to receive SMS/MMS from Meta/WhatsApp
     Triggers message processing state machine
     """
-    logging.info('Got Message From Whatsapp')
     VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN", "takar_mak")
     
     if req.method == "GET":
@@ -31,18 +43,84 @@ async def receive_sms(req: func.HttpRequest) -> func.HttpResponse:
 
     elif req.method == "POST":
         try:
-            logging.info(f"Received Whatsapp webhook message")
-            data = req.get_json()
-            messages = WhatsappClient.process_incoming_messages(data)
-            
-            if len(messages) == 0:
+            raw = req.get_body()
+            capture.record(capture.ROUTE_WHATSAPP, raw)
+            # Status callbacks (sent, delivered, read) are most of the webhook volume and
+            # carry nothing to process, acknowledge them before the message pipeline and its logging
+            if webhook_decoder.is_status_only(raw):
+                delivery_metrics.observe_statuses(raw)
                 return func.HttpResponse(status_code=200)
-            
-            # Process messages through state machine
-            handler = MessageHandler(event_broker)
-            await handler.process_messages(messages)
+            logging.info(f"Received Whatsapp webhook message")
+            # Refused before the rate limiter sees the messages, their redelivery isn't taken for a repeat
+            async with admission.admitted(capture.ROUTE_WHATSAPP) as admitted:
+                if not admitted:
+                    return _busy()
+                # Senders over their rate are shed here, before any database work, and still acknowledged
+                messages = await rate_limit.admit(webhook_decoder.decode_webhook(raw))
+                
+                if len(messages) == 0:
+                    return func.HttpResponse(status_code=200)
+                
+                handler = MessageHandler(event_broker)
+                if ROUTE_BY_SESSION:
+                    await handler.route_messages(messages)
+                else:
+                    # Process messages through state machine
+                    await handler.process_messages(messages)
             
             return func.HttpResponse(status_code=200)
         except Exception as e:
             logging.error(f"Error processing WhatsApp message: {e}")
             return func.HttpResponse("Internal error", status_code=500)
+
+
+if ROUTE_BY_SESSION:
+    @app.function_name(name="process_user_messages")
+    @app.service_bus_topic_trigger(
+        arg_name="msg",
+        topic_name="events-user_message_received",
+        subscription_name=constants.MESSAGE_SUBSCRIPTION,
+        connection="SERVICEBUS_CONNECTION_STRING",
+        is_sessions_enabled=True
+    )
+    async def process_user_messages(msg: func.ServiceBusMessage) -> None:
+        """
+        Handles one routed WhatsApp message. Service Bus hands a session, i.e. one
+        user's messages, to a single consumer at a time and in order. A message that
+        fails has its dedup claim released and is abandoned by raising, so it is
+        retried before the user's later ones
+        """
+        await MessageHandler(event_broker).handle_routed_message(msg.get_body())
+
+
+@app.route(route="metrics", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def metrics_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Prometheus scrape endpoint for this worker's latency histograms and counters
+    """
+    return func.HttpResponse(
+        metrics.REGISTRY.render(),
+        status_code=200,
+        headers={"Content-Type": metrics.PROMETHEUS_CONTENT_TYPE}
+    )
+
+
+readiness = health.ReadinessProbe(event_broker, warm_caches=True)
+
+
+@app.route(route="health", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def health_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Liveness probe - the worker is up and able to serve requests
+    """
+    return func.HttpResponse(health.liveness_body(), status_code=200, mimetype="application/json")
+
+
+@app.route(route="ready", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def ready_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Readiness probe - DB pool warm, upstreams reachable, broker connected and caches warm.
+    Results are cached, so probing never opens connections per call
+    """
+    status_code, body = await health.readiness_body(readiness)
+    return func.HttpResponse(body, status_code=status_code, mimetype="application/json")
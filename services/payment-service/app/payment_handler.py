@@ -4,6 +4,9 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../'))
 
 from app.payment_processors import process_payment
+from db import dbConfig
+from shared import jobs
+from Utils.dbClient import AsyncDatabaseManager
 
 
 class PaymentHandler:
@@ -19,11 +22,18 @@ class PaymentHandler:
         # Use existing payment processor
         response = await process_payment(req)
         
-        # Publish PaymentReceivedEvent for other services
-        # (e.g., message service can notify user about successful payment)
-        # event = PaymentReceivedEvent(
-        #     data={...}
-        # )
-        # await self.event_broker.publish(event)
+        # PaymentReceivedEvent is written to the outbox in the same transaction
+        # as the payment and its tune submission job; TuneCreatedEvent follows
+        # when the job submits the tune. Both are published by the outbox relay
+        # in the maintenance service
         
         return response
+    
+    async def run_jobs(self) -> int:
+        """Run the tune submission jobs that are due"""
+        return await jobs.run_due_jobs()
+    
+    async def get_job(self, job_id: int) -> dict:
+        """Status of a background job, or None"""
+        async with AsyncDatabaseManager(dbConfig.db_config) as db:
+            return await jobs.get_job(db, job_id)
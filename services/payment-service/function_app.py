@@ -1,3 +1,4 @@
+import json
 import logging
 import sys
 import os
@@ -6,6 +7,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../'))
 import azure.functions as func
 from app.payment_handler import PaymentHandler
 from shared.event_broker import get_event_broker
+from Utils import metrics, health, capture
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 event_broker = get_event_broker()
@@ -19,8 +21,71 @@ async def receive_payment(req: func.HttpRequest) -> func.HttpResponse:
     """
     try:
         logging.info('Received payment webhook')
-        await payment_handler.process_payment(req)
-        return func.HttpResponse("Payment processed successfully", status_code=200)
+        capture.record(capture.ROUTE_PAYMENT, req.get_body())
+        response = await payment_handler.process_payment(req)
+        if response.status_code >= 400:
+            return response
+        return func.HttpResponse("Payment recorded successfully", status_code=200)
     except Exception as e:
         logging.error(f"Failed to process payment: {e}")
         return func.HttpResponse(f"Error: {str(e)}", status_code=500)
+
+
+@app.function_name(name="run_background_jobs")
+@app.schedule(
+    schedule="*/10 * * * * *",  # Every 10 seconds
+    arg_name="mytimer",
+    run_on_startup=True
+)
+async def run_background_jobs(mytimer: func.TimerRequest) -> None:
+    """
+    Runs queued tune submission jobs, resuming each at its last checkpoint
+    """
+    try:
+        await payment_handler.run_jobs()
+    except Exception as e:
+        logging.error(f"Background jobs failed: {e}")
+
+
+@app.route(route="jobs/{job_id:int}", methods=["GET"])
+async def job_status(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Progress of a background job: status, current step and last error
+    """
+    job = await payment_handler.get_job(int(req.route_params["job_id"]))
+    if job is None:
+        return func.HttpResponse("Job not found", status_code=404)
+    return func.HttpResponse(json.dumps(job), status_code=200, mimetype="application/json")
+
+
+@app.route(route="metrics", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def metrics_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Prometheus scrape endpoint for this worker's latency histograms and counters
+    """
+    return func.HttpResponse(
+        metrics.REGISTRY.render(),
+        status_code=200,
+        headers={"Content-Type": metrics.PROMETHEUS_CONTENT_TYPE}
+    )
+
+
+readiness = health.ReadinessProbe(event_broker, warm_caches=True)
+
+
+@app.route(route="health", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def health_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Liveness probe - the worker is up and able to serve requests
+    """
+    return func.HttpResponse(health.liveness_body(), status_code=200, mimetype="application/json")
+
+
+@app.route(route="ready", methods=["GET"], auth_level=func.AuthLevel.ANONYMOUS)
+async def ready_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Readiness probe - DB pool warm, upstreams reachable, broker connected and caches warm.
+    Results are cached, so probing never opens connections per call
+    """
+    status_code, body = await health.readiness_body(readiness)
+    return func.HttpResponse(body, status_code=status_code, mimetype="application/json")
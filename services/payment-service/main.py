@@ -0,0 +1,14 @@
+"""
+ASGI entry point of the payment service, serving the functions of function_app.py
+without the Azure Functions host (see shared/asgi.py):
+
+    uvicorn main:app --host 0.0.0.0 --port 80 --loop uvloop --http httptools
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../../'))
+
+import function_app
+from shared import asgi
+
+app = asgi.create_app(function_app.app, "payment-service", on_shutdown=[function_app.readiness.close])
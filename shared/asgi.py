@@ -0,0 +1,315 @@
+"""
+ASGI entry point for the services, alongside the Azure Functions host.
+
+`create_app` turns a service's `func.FunctionApp` into a FastAPI application, so
+the functions declared in its function_app.py are served as they are, without
+the Functions worker and its gRPC hop in front of every request:
+
+- HTTP triggers become routes under /api, with the same paths and methods.
+  Requests and responses are converted to and from func.HttpRequest and
+  func.HttpResponse, so the functions can't tell the difference.
+- Timer triggers run on their NCRONTAB schedules, in UTC, on one worker of
+  one replica at a time, as under the Functions host: every worker schedules
+  them, and whichever takes the timer's Postgres advisory lock first runs the
+  occurrence while the others skip it. Not every timer is safe to run twice at
+  once (the pack image refresh and retention aren't), so this is what keeps
+  them single, not the leases of the work they do.
+- Session-enabled Service Bus topic triggers get receivers of their own that
+  take whichever session is free, up to ASGI_SESSION_CONCURRENCY at once.
+
+The lifespan warms the DB pool before the pod takes traffic, and on shutdown
+stops the timers and receivers, drains background side effects and closes the
+pool. Routes that aren't anonymous under Azure need ASGI_FUNCTION_KEY, as ?code=
+or the x-functions-key header; an app with such routes doesn't start without it.
+
+Run a service with uvicorn on uvloop, e.g. from services/message-service:
+
+    uvicorn main:app --host 0.0.0.0 --port 80 --loop uvloop --http httptools
+"""
+import asyncio
+import functools
+import hmac
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+import azure.functions as func
+from fastapi import FastAPI, Request, Response
+from Utils import background, constants, dbClient
+from db import dbConfig
+
+ROUTE_PREFIX = "/api"
+DEFAULT_METHODS = ["GET", "POST"]
+# Replicas fire the same timer occurrence within this much of each other
+TIMER_CLOCK_SKEW = timedelta(seconds=5)
+
+
+class Schedule:
+    """An NCRONTAB expression: second minute hour day month day-of-week"""
+
+    _RANGES = ((0, 59), (0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 6:
+            raise ValueError(f"Expected 6 NCRONTAB fields, got {expression!r}")
+        self.expression = expression
+        # As in cron, when both days are restricted a day matching either of them fires
+        self.any_day = fields[3].startswith("*")
+        self.any_weekday = fields[5].startswith("*")
+        (self.seconds, self.minutes, self.hours,
+         self.days, self.months, self.weekdays) = (self._parse(field, *bounds)
+                                                   for field, bounds in zip(fields, self._RANGES))
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> frozenset:
+        values = set()
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                start, stop = low, high
+            elif "-" in part:
+                start, stop = (int(bound) for bound in part.split("-"))
+            else:
+                start = int(part)
+                stop = high if step else start
+            values.update(range(start, stop + 1, int(step or 1)))
+        return frozenset(values)
+
+    def _day_matches(self, t: datetime) -> bool:
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, now: datetime) -> datetime:
+        """The first time strictly after `now` the schedule fires"""
+        t = now.replace(microsecond=0) + timedelta(seconds=1)
+        # A schedule that can fire at all fires within a few years
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0, second=0)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0, second=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0, second=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t = t.replace(second=0) + timedelta(minutes=1)
+            elif t.second not in self.seconds:
+                t += timedelta(seconds=1)
+            else:
+                return t
+        raise ValueError(f"Schedule {self.expression!r} never fires")
+
+
+class TimerInfo:
+    """What a timer function gets instead of func.TimerRequest"""
+
+    def __init__(self, past_due: bool = False):
+        self.past_due = past_due
+
+
+class ServiceBusBody:
+    """What a Service Bus function gets instead of func.ServiceBusMessage"""
+
+    def __init__(self, body: bytes, session_id: str = None):
+        self._body = body
+        self.session_id = session_id
+
+    def get_body(self) -> bytes:
+        return self._body
+
+
+def _authorized(request: Request) -> bool:
+    if not constants.ASGI_FUNCTION_KEY:
+        return False
+    key = request.query_params.get("code") or request.headers.get("x-functions-key") or ""
+    return hmac.compare_digest(key.encode(), constants.ASGI_FUNCTION_KEY.encode())
+
+
+def _is_anonymous(auth_level) -> bool:
+    return str(getattr(auth_level, "value", auth_level)).lower() == "anonymous"
+
+
+def _http_endpoint(function, anonymous: bool):
+    user_function = function.get_user_function()
+
+    async def endpoint(request: Request) -> Response:
+        if not anonymous and not _authorized(request):
+            return Response("Unauthorized", status_code=401)
+        req = func.HttpRequest(
+            method=request.method,
+            url=str(request.url),
+            headers=dict(request.headers),
+            params=dict(request.query_params),
+            route_params={name: str(value) for name, value in request.path_params.items()},
+            body=await request.body(),
+        )
+        response = await user_function(req)
+        return Response(response.get_body(), status_code=response.status_code,
+                        headers=dict(response.headers), media_type=response.mimetype)
+
+    endpoint.__name__ = function.get_function_name()
+    endpoint.protected = not anonymous
+    return endpoint
+
+
+class _TimerLocks:
+    """
+    Session advisory locks of the timers, on a connection of this worker's own: a lock
+    is held for as long as its timer runs, which must not tie up a pool connection.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._guard = None
+
+    async def _fetch(self, query: str, name: str):
+        if self._guard is None:
+            self._guard = asyncio.Lock()
+        async with self._guard:
+            if self._conn is None or self._conn.is_closed():
+                self._conn = await dbClient.connect(dbConfig.db_config)
+            return await self._conn.fetchval(query, f"asgi-timer:{name}")
+
+    async def try_lock(self, name: str) -> bool:
+        return await self._fetch("SELECT pg_try_advisory_lock(hashtext($1))", name)
+
+    async def unlock(self, name: str) -> None:
+        await self._fetch("SELECT pg_advisory_unlock(hashtext($1))", name)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await conn.close()
+
+
+async def _run_timer(name: str, user_function, schedule: Schedule, run_on_startup: bool,
+                     locks: _TimerLocks) -> None:
+    async def fire(due: datetime, past_due: bool) -> None:
+        try:
+            if not await locks.try_lock(name):
+                # Another worker or replica runs this occurrence
+                return
+            try:
+                await user_function(TimerInfo(past_due))
+            finally:
+                # Held until every replica has reached the occurrence, or a quick run would
+                # unlock it before a replica whose clock is behind tries the lock
+                await asyncio.sleep(max(0.0, (due + TIMER_CLOCK_SKEW - datetime.now(timezone.utc)).total_seconds()))
+                await locks.unlock(name)
+        except Exception as e:
+            # The function logs its own failures, this only keeps the timer alive
+            logging.error(f"Timer {name} failed: {e}")
+
+    if run_on_startup:
+        await fire(datetime.now(timezone.utc), False)
+    while True:
+        now = datetime.now(timezone.utc)
+        due = schedule.next_after(now)
+        # Occurrences missed while the previous run overran are skipped, as the Functions host does
+        await asyncio.sleep((due - now).total_seconds())
+        await fire(due, False)
+
+
+async def _run_session_receiver(name: str, user_function, trigger) -> None:
+    try:
+        # Imported here, only services with a Service Bus trigger need the SDK's asyncio client
+        from azure.servicebus import NEXT_AVAILABLE_SESSION
+        from azure.servicebus.aio import ServiceBusClient
+        from azure.servicebus.exceptions import OperationTimeoutError
+    except ImportError as e:
+        logging.error(f"Session receiver of {name} can't start, azure-servicebus is not installed: {e}")
+        return
+
+    while True:
+        try:
+            connection_string = os.environ.get(trigger.connection)
+            async with ServiceBusClient.from_connection_string(connection_string) as client:
+                while True:
+                    receiver = client.get_subscription_receiver(
+                        trigger.topic_name, trigger.subscription_name,
+                        session_id=NEXT_AVAILABLE_SESSION, max_wait_time=5)
+                    try:
+                        async with receiver:
+                            async for message in receiver:
+                                try:
+                                    await user_function(ServiceBusBody(b"".join(message.body),
+                                                                       receiver.session.session_id))
+                                except Exception as e:
+                                    # Abandoned, it is redelivered before the session's later messages
+                                    logging.error(f"{name} failed on a message, abandoning it: {e}")
+                                    await receiver.abandon_message(message)
+                                    continue
+                                await receiver.complete_message(message)
+                    except OperationTimeoutError:
+                        # No session had messages
+                        continue
+        except Exception as e:
+            logging.error(f"Session receiver of {name} failed, reconnecting: {e}")
+            await asyncio.sleep(5)
+
+
+def _log_exit(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"{task.get_name()} stopped: {task.exception()!r}")
+
+
+def create_app(function_app: func.FunctionApp, title: str, on_shutdown=()) -> FastAPI:
+    """
+    Serve the functions of `function_app` as an ASGI application.
+    :param on_shutdown: Async callables run at shutdown before the pool is closed, e.g. readiness.close.
+    """
+    routes = []
+    starters = []
+    timer_locks = _TimerLocks()
+    for function in function_app.get_functions():
+        trigger = function.get_trigger()
+        name = function.get_function_name()
+        user_function = function.get_user_function()
+        kind = type(trigger).__name__
+        if kind == "HttpTrigger":
+            methods = [str(getattr(method, "value", method)) for method in (trigger.methods or DEFAULT_METHODS)]
+            anonymous = _is_anonymous(trigger.auth_level or getattr(function_app, "auth_level", None))
+            routes.append((f"{ROUTE_PREFIX}/{trigger.route or name}", _http_endpoint(function, anonymous), methods))
+        elif kind == "TimerTrigger":
+            schedule = Schedule(trigger.schedule)
+            starters.append((name, functools.partial(_run_timer, name, user_function, schedule,
+                                                     bool(trigger.run_on_startup), timer_locks)))
+        elif kind == "ServiceBusTopicTrigger" and trigger.is_sessions_enabled:
+            for i in range(int(constants.ASGI_SESSION_CONCURRENCY)):
+                starters.append((f"{name}-{i}", functools.partial(_run_session_receiver, name, user_function, trigger)))
+        else:
+            logging.warning(f"{name} has a {kind}, which the ASGI entry point does not serve")
+    if not constants.ASGI_FUNCTION_KEY and any(endpoint.protected for _, endpoint, _ in routes):
+        raise RuntimeError(f"{title} has routes that need a function key, set ASGI_FUNCTION_KEY")
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        try:
+            await dbClient.get_pool(dbConfig.db_config)
+        except Exception as e:
+            # The readiness probe keeps the pod out of rotation until the database answers
+            logging.error(f"Could not open the database pool at startup: {e}")
+        tasks = [asyncio.create_task(start(), name=name) for name, start in starters]
+        for task in tasks:
+            task.add_done_callback(_log_exit)
+        logging.info(f"{title} serving {len(routes)} routes, {len(tasks)} timers and receivers")
+        try:
+            yield
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await background.drain()
+            await timer_locks.close()
+            for close in on_shutdown:
+                await close()
+            await dbClient.close_pool()
+
+    app = FastAPI(title=title, lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+    for path, endpoint, methods in routes:
+        app.add_api_route(path, endpoint, methods=methods)
+    return app
@@ -4,10 +4,8 @@ Event broker for inter-service communication using Azure Service Bus
 import json
 import logging
 from abc import ABC, abstractmethod
-from azure.messaging.servicebus import ServiceBusClient, ServiceBusMessage
-from azure.identity import DefaultAzureCredential
 from pydantic import BaseModel
-from typing import Callable, Coroutine, Any
+from typing import Callable, Coroutine, Any, Optional
 import os
 
 
@@ -17,6 +15,8 @@ class Event(BaseModel):
     data: dict
     timestamp: str
     source_service: str
+    # Events sharing an ordering key are delivered in the order they were written
+    ordering_key: Optional[str] = None
 
 
 class EventPublisher(ABC):
@@ -26,6 +26,15 @@ class EventPublisher(ABC):
     async def publish(self, event: Event) -> None:
         pass
 
+    async def publish_batch(self, events: list) -> None:
+        """Publish several events; brokers that can send them in one call override this"""
+        for event in events:
+            await self.publish(event)
+
+    async def check_connection(self) -> bool:
+        """Report whether the broker can accept events; used by readiness probes"""
+        return True
+
 
 class EventSubscriber(ABC):
     """Abstract event subscriber"""
@@ -37,8 +46,15 @@ class EventSubscriber(ABC):
 
 class ServiceBusEventBroker(EventPublisher, EventSubscriber):
     """Azure Service Bus implementation for event brokering"""
+
+    # Opened by check_connection
+    HEALTH_TOPIC = "events-user_message_received"
     
     def __init__(self, connection_string: str = None):
+        # Imported here so that processes which only write to the outbox
+        # don't need the Service Bus SDK installed
+        from azure.servicebus.aio import ServiceBusClient
+
         if connection_string is None:
             connection_string = os.getenv("SERVICEBUS_CONNECTION_STRING")
         
@@ -49,26 +65,72 @@ class ServiceBusEventBroker(EventPublisher, EventSubscriber):
         self.client = ServiceBusClient.from_connection_string(connection_string)
         self.handlers = {}
     
+    @staticmethod
+    def _to_message(event: Event):
+        from azure.servicebus import ServiceBusMessage
+
+        return ServiceBusMessage(
+            body=event.model_dump_json(),
+            subject=event.event_type,
+            content_type="application/json",
+            session_id=event.ordering_key
+        )
+
     async def publish(self, event: Event) -> None:
         """Publish event to topic"""
         try:
             topic_name = f"events-{event.event_type}"
             sender = self.client.get_topic_sender(topic_name)
             
-            message = ServiceBusMessage(
-                body=event.model_dump_json(),
-                subject=event.event_type,
-                content_type="application/json"
-            )
+            message = self._to_message(event)
             
-            with sender:
-                sender.send_messages(message)
+            async with sender:
+                await sender.send_messages(message)
             
             logging.info(f"Published event: {event.event_type}")
         except Exception as e:
             logging.error(f"Failed to publish event: {e}")
             raise
+
+    async def publish_batch(self, events: list) -> None:
+        """Publish events with one send per topic and ordering key, split only where a batch is full"""
+        from azure.servicebus.exceptions import MessageSizeExceededError
+
+        if not events:
+            return
+        # Partitioned topics take a batch only if its messages share a session, and a
+        # webhook's messages nearly always come from one sender anyway
+        groups = {}
+        for event in events:
+            groups.setdefault((f"events-{event.event_type}", event.ordering_key), []).append(event)
+        try:
+            for (topic_name, _), group in groups.items():
+                sender = self.client.get_topic_sender(topic_name)
+                async with sender:
+                    batch = await sender.create_message_batch()
+                    for event in group:
+                        message = self._to_message(event)
+                        try:
+                            batch.add_message(message)
+                        except MessageSizeExceededError:
+                            await sender.send_messages(batch)
+                            batch = await sender.create_message_batch()
+                            batch.add_message(message)
+                    await sender.send_messages(batch)
+            logging.info(f"Published {len(events)} events in {len(groups)} batches")
+        except Exception as e:
+            logging.error(f"Failed to publish events: {e}")
+            raise
     
+    async def check_connection(self) -> bool:
+        """
+        Open a sender link to the topic every service publishes to. The client connects lazily,
+        so this is the first point at which a wrong namespace or key shows. Raises on failure;
+        the readiness probe bounds how long it may take.
+        """
+        async with self.client.get_topic_sender(self.HEALTH_TOPIC):
+            return True
+
     async def subscribe(self, event_type: str, handler: Callable[[Event], Coroutine]) -> None:
         """Subscribe to events of a specific type"""
         topic_name = f"events-{event_type}"
@@ -86,16 +148,16 @@ class ServiceBusEventBroker(EventPublisher, EventSubscriber):
         try:
             receiver = self.client.get_subscription_receiver(topic_name, subscription_name)
             
-            with receiver:
-                for msg in receiver:
+            async with receiver:
+                async for msg in receiver:
                     try:
                         event_data = json.loads(str(msg))
                         event = Event(**event_data)
                         await handler(event)
-                        msg.complete()
+                        await receiver.complete_message(msg)
                     except Exception as e:
                         logging.error(f"Failed to process message: {e}")
-                        msg.dead_letter()
+                        await receiver.dead_letter_message(msg)
         except Exception as e:
             logging.error(f"Listener failed for {event_type}: {e}")
             raise
@@ -138,20 +200,20 @@ def get_event_broker() -> EventPublisher:
 
 # Common event types
 class UserMessageReceivedEvent(Event):
-    event_type = "user_message_received"
+    event_type: str = "user_message_received"
 
 
 class ImageProcessedEvent(Event):
-    event_type = "image_processed"
+    event_type: str = "image_processed"
 
 
 class PaymentReceivedEvent(Event):
-    event_type = "payment_received"
+    event_type: str = "payment_received"
 
 
 class TuneCreatedEvent(Event):
-    event_type = "tune_created"
+    event_type: str = "tune_created"
 
 
 class PackImagesUpdatedEvent(Event):
-    event_type = "pack_images_updated"
+    event_type: str = "pack_images_updated"
@@ -0,0 +1,127 @@
+"""
+Pre-fork server mode for the ASGI services (shared/asgi.py).
+
+    gunicorn main:app -c /app/shared/gunicorn_conf.py
+
+The master imports the service once, precompiles the message catalogue and
+loads the Astria pack catalogue, then freezes the garbage collector so that
+what it built stays in untouched pages. The workers forked from it share those
+pages copy-on-write instead of each cold-loading its own.
+
+- Workers: WEB_CONCURRENCY, or one per CPU of the container's cgroup limit,
+  rounded up, or one per core when there is no limit, but no more than
+  DB_POOL_MAX_SIZE can give connections to.
+- DB pool: DB_POOL_MIN_SIZE and DB_POOL_MAX_SIZE are the pod's totals, each
+  worker opens its share of them, less the connections it holds outside its
+  pool (the user cache listener and the timers' advisory locks). The server
+  refuses to start when a worker's share can't hold those and a pool.
+- Metrics: each worker shares its samples through METRICS_MULTIPROC_DIR, so a
+  /metrics scrape reports the whole pod whichever worker answers it; gauges
+  get a worker label. See Utils/metrics.py.
+- Recycling: a worker is replaced after WORKER_MAX_REQUESTS requests, give or
+  take 10% so the workers don't all restart together, which bounds how far a
+  slow leak or fragmentation can grow.
+
+Nothing that holds a connection or a thread may be created in the master: the
+DB pool, the user cache listener and the HTTP sessions are all opened lazily,
+inside the workers. Rate limits, admission limits and the per-user message locks
+are per worker; across workers a user's row is protected by its version check,
+see Utils/user_locks.py.
+"""
+import gc
+import math
+import os
+import shutil
+
+
+def _cpu_limit() -> float:
+    # cgroup v2, then v1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return float(os.cpu_count() or 1)
+
+
+# Held by each worker outside its pool: the user cache LISTEN connection
+# (Utils/user_store.py) and the timers' advisory lock connection (shared/asgi.py)
+DEDICATED_CONNECTIONS = 2
+
+
+def worker_count(cpus: float, db_pool_max_size: int) -> int:
+    """One worker per CPU, as long as each gets its dedicated connections and a pool of one"""
+    return max(1, min(math.ceil(cpus), db_pool_max_size // (DEDICATED_CONNECTIONS + 1)))
+
+
+def pool_max_size(db_pool_max_size: int, workers: int) -> int:
+    """
+    A worker's pool size, its share of the pod's connections less its dedicated ones.
+    :raise ValueError: If the share leaves no connection for the pool.
+    """
+    pool = db_pool_max_size // workers - DEDICATED_CONNECTIONS
+    if pool < 1:
+        raise ValueError(f"DB_POOL_MAX_SIZE={db_pool_max_size} is too small for {workers} workers, each needs "
+                         f"{DEDICATED_CONNECTIONS + 1} connections")
+    return pool
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '80')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+db_pool_max_size = int(os.environ.get("DB_POOL_MAX_SIZE") or 10)
+workers = int(os.environ.get("WEB_CONCURRENCY") or worker_count(_cpu_limit(), db_pool_max_size))
+# Checked here, so that a budget too small stops the server before it forks
+pool_max_size(db_pool_max_size, workers)
+preload_app = True
+max_requests = int(os.environ.get("WORKER_MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+# Leaves time for the lifespan to drain background side effects before the worker is killed
+graceful_timeout = int(os.environ.get("BACKGROUND_DRAIN_SECONDS", "10")) + 20
+timeout = 120
+keepalive = 75
+metrics_dir = os.environ.get("METRICS_MULTIPROC_DIR") or "/tmp/astria-metrics"
+
+
+def on_starting(server):
+    # Samples left by an earlier run of the master would be added to this one's
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def when_ready(server):
+    # The service, and the modules below with it, are imported already (preload_app)
+    from Utils import message_catalogue, pack_catalogue
+    message_catalogue.precompile()
+    pack_catalogue.preload()
+    # Objects the workers only read must not be touched by their collector either,
+    # or every collection would copy the pages they live on
+    gc.freeze()
+    server.log.info(f"Preloaded the catalogues, forking {server.cfg.workers} workers")
+
+
+def post_fork(server, worker):
+    from Utils import constants, metrics
+    constants.DB_POOL_MAX_SIZE = str(pool_max_size(int(constants.DB_POOL_MAX_SIZE or 10), server.cfg.workers))
+    constants.DB_POOL_MIN_SIZE = str(min(int(constants.DB_POOL_MIN_SIZE or 1), int(constants.DB_POOL_MAX_SIZE)))
+    metrics.enable_multiprocess(metrics_dir)
+
+
+def worker_exit(server, worker):
+    from Utils import metrics
+    metrics.flush()
+
+
+def child_exit(server, worker):
+    from Utils import metrics
+    metrics.mark_process_dead(metrics_dir, worker.pid)
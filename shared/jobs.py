@@ -0,0 +1,193 @@
+"""
+Durable multi-step background jobs.
+
+A job is a row of the `jobs` table: a kind, its input payload and a checkpoint.
+Each kind is a list of steps (see `register`). `run_due_jobs` claims due jobs
+and runs their remaining steps in order. After every step its result is merged
+into the checkpoint and the job moves on to the next step, so a job that fails
+or whose worker dies resumes at the step it stopped at rather than from the
+start. A failed step is retried with exponential backoff up to the kind's
+`max_attempts`; a step raising `PermanentJobError` fails the job at once. A kind's
+`on_failure` hook runs once the job has failed for good, e.g. to tell the user.
+
+Jobs are enqueued with `enqueue_job` inside the transaction of the change that
+calls for them, and are unique per key, so a retried webhook never queues the
+same work twice.
+"""
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+from Utils import dbClient, metrics
+from db import dbConfig
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# A job claimed by one runner is left alone by the others for this long
+JOB_LEASE = timedelta(minutes=10)
+RETRY_BASE_DELAY = timedelta(seconds=15)
+RETRY_MAX_DELAY = timedelta(minutes=15)
+
+JOBS_TOTAL = metrics.REGISTRY.register(metrics.Counter(
+    "astria_jobs_total", "Finished background jobs by kind and status", ["kind", "status"]))
+JOB_STEP_SECONDS = metrics.REGISTRY.register(metrics.Histogram(
+    "astria_job_step_seconds", "Duration of background job steps", ["kind", "step", "outcome"]))
+
+
+class PermanentJobError(Exception):
+    """Raised by a step that retrying can't fix"""
+
+
+@dataclass
+class JobContext:
+    """What a step gets: the job's input and everything earlier steps checkpointed"""
+    job_id: int
+    payload: dict
+    checkpoint: dict
+    db: dbClient.AsyncDatabaseManager
+
+
+Step = Callable[[JobContext], Awaitable[dict]]
+FailureHook = Callable[[JobContext, Exception], Awaitable[None]]
+
+
+@dataclass
+class JobKind:
+    name: str
+    # (name, step) pairs; a step returns the values to add to the checkpoint
+    steps: list = field(default_factory=list)
+    max_attempts: int = 5
+    # Awaited when the job fails permanently, after its last retry
+    on_failure: FailureHook = None
+
+    def step_names(self) -> list:
+        return [name for name, _ in self.steps]
+
+
+KINDS = {}
+
+
+def register(name: str, steps: list, max_attempts: int = 5, on_failure: FailureHook = None) -> JobKind:
+    kind = JobKind(name, steps, max_attempts, on_failure)
+    KINDS[name] = kind
+    return kind
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+async def enqueue_job(db: dbClient.AsyncDatabaseManager, kind: str, key: str, payload: dict) -> int:
+    """
+    Queue a job, unless one with the same key exists.
+    Call this inside `db.transaction()` together with the change the job follows from.
+    :return: The id of the job with that key.
+    """
+    row = await db.execute_query_one(
+        "INSERT INTO jobs (kind, key, payload, step) VALUES ($1, $2, $3::jsonb, $4) "
+        "ON CONFLICT (key) DO NOTHING RETURNING id",
+        (kind, key, json.dumps(payload), KINDS[kind].steps[0][0])
+    )
+    if row is None:
+        row = await db.execute_query_one("SELECT id FROM jobs WHERE key = $1", (key,))
+    return row["id"]
+
+
+async def get_job(db: dbClient.AsyncDatabaseManager, job_id: int) -> dict:
+    """:return: The job's progress, without its payload and checkpoint, or None"""
+    row = await db.execute_query_one(
+        "SELECT id, kind, key, status, step, attempts, last_error, created_at, updated_at FROM jobs WHERE id = $1",
+        (job_id,)
+    )
+    if row is None:
+        return None
+    kind = KINDS.get(row["kind"])
+    steps = kind.step_names() if kind else []
+    row["steps"] = steps
+    row["completed_steps"] = len(steps) if row["status"] == SUCCEEDED else (
+        steps.index(row["step"]) if row["step"] in steps else 0)
+    row["created_at"] = row["created_at"].isoformat()
+    row["updated_at"] = row["updated_at"].isoformat()
+    return row
+
+
+async def _claim_due_job(db: dbClient.AsyncDatabaseManager) -> dict:
+    # Pushing run_after past the lease claims the row; a runner that dies mid-job leaves it to be picked up again.
+    # Jobs are claimed one at a time, so none waits out its lease behind the others of the batch.
+    return await db.execute_query_one(
+        "UPDATE jobs SET status = $1, run_after = now() + $2::interval, updated_at = now() "
+        "WHERE id = (SELECT id FROM jobs WHERE status IN ($3, $1) AND run_after <= now() "
+        "ORDER BY run_after LIMIT 1 FOR UPDATE SKIP LOCKED) "
+        "RETURNING id, kind, payload, checkpoint, step, attempts",
+        (RUNNING, JOB_LEASE, QUEUED)
+    )
+
+
+async def _run_job(db: dbClient.AsyncDatabaseManager, job: dict) -> str:
+    kind = KINDS.get(job["kind"])
+    if kind is None:
+        # Left for a worker that knows the kind
+        logging.error(f"Job {job['id']} has unknown kind {job['kind']}")
+        return RUNNING
+    names = kind.step_names()
+    context = JobContext(job["id"], json.loads(job["payload"]), json.loads(job["checkpoint"]), db)
+    attempts = job["attempts"]
+
+    for name, step in kind.steps[names.index(job["step"]):]:
+        started = time.perf_counter()
+        try:
+            result = await step(context)
+            JOB_STEP_SECONDS.observe(time.perf_counter() - started, kind=kind.name, step=name, outcome="ok")
+        except Exception as e:
+            JOB_STEP_SECONDS.observe(time.perf_counter() - started, kind=kind.name, step=name, outcome="error")
+            attempts += 1
+            permanent = isinstance(e, PermanentJobError) or attempts >= kind.max_attempts
+            status = FAILED if permanent else QUEUED
+            logging.error(f"Job {job['id']} ({kind.name}) failed at step {name}, attempt {attempts}: {e}")
+            await db.insert_data(
+                "UPDATE jobs SET status = $2, attempts = $3, last_error = $4, run_after = $5, updated_at = now() "
+                "WHERE id = $1",
+                (job["id"], status, attempts, str(e)[:1000], datetime.now(timezone.utc) + retry_delay(attempts))
+            )
+            if permanent and kind.on_failure:
+                try:
+                    await kind.on_failure(context, e)
+                except Exception as hook_error:
+                    logging.error(f"Failure hook of job {job['id']} ({kind.name}) failed: {hook_error}")
+            return status
+        context.checkpoint.update(result or {})
+        following = names.index(name) + 1
+        next_step = names[following] if following < len(names) else None
+        # The checkpoint is what lets a retry skip the steps that already ran; the lease restarts with each step
+        await db.insert_data(
+            "UPDATE jobs SET checkpoint = $2::jsonb, step = COALESCE($3, step), status = $4, attempts = 0, "
+            "last_error = NULL, run_after = now() + $5::interval, updated_at = now() WHERE id = $1",
+            (job["id"], json.dumps(context.checkpoint), next_step, RUNNING if next_step else SUCCEEDED, JOB_LEASE)
+        )
+        attempts = 0
+    return SUCCEEDED
+
+
+async def run_due_jobs(limit: int = 20) -> int:
+    """
+    Run up to `limit` due jobs, one after the other, claiming each only when its turn comes.
+    :return: The number of jobs run.
+    """
+    ran = 0
+    async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+        while ran < limit:
+            job = await _claim_due_job(db)
+            if job is None:
+                break
+            status = await _run_job(db, job)
+            if status in (SUCCEEDED, FAILED):
+                JOBS_TOTAL.inc(kind=job["kind"], status=status)
+            ran += 1
+    if ran:
+        logging.info(f"Ran {ran} background jobs")
+    return ran
@@ -0,0 +1,122 @@
+"""
+Transactional outbox for domain events.
+
+Handlers never publish to the broker directly. Instead they write the event to
+the `outbox` table inside the same transaction as the state change it describes
+(see `enqueue_event`), and `OutboxRelay` publishes pending rows afterwards.
+A crash between the DB write and the publish therefore can't lose or invent an
+event; at worst an event is published more than once (at-least-once delivery).
+
+A relay claims a batch of rows with a short lease, publishes them without
+holding any lock or transaction, then marks them. An event that failed
+OUTBOX_MAX_ATTEMPTS times is parked: it is set aside for inspection, and
+later events with its ordering key go ahead without it.
+"""
+import logging
+from Utils import constants, dbClient
+from db import dbConfig
+from shared.event_broker import Event, EventPublisher
+
+# Any constant works as long as every relay uses the same one
+RELAY_LOCK_ID = 7_401_026
+# Rows claimed by a relay that died are claimable again after this long
+CLAIM_SECONDS = 120
+
+# Pending rows not claimed by a live relay, oldest first. A row is held back while an
+# earlier row of its ordering key is claimed, so concurrent relays keep per-key order
+CLAIM = (
+    "UPDATE outbox SET claimed_until = now() + make_interval(secs => $2) "
+    "WHERE id IN ("
+    "  SELECT o.id FROM outbox o "
+    "  WHERE o.published_at IS NULL AND o.parked_at IS NULL "
+    "  AND (o.claimed_until IS NULL OR o.claimed_until < now()) "
+    "  AND NOT EXISTS (SELECT 1 FROM outbox e WHERE e.ordering_key = o.ordering_key AND e.id < o.id "
+    "                  AND e.published_at IS NULL AND e.parked_at IS NULL AND e.claimed_until >= now()) "
+    "  ORDER BY o.id LIMIT $1) "
+    "RETURNING id, ordering_key, payload, attempts"
+)
+
+
+async def enqueue_event(db: dbClient.AsyncDatabaseManager, event: Event) -> None:
+    """
+    Write an event to the outbox.
+    Call this inside `db.transaction()` together with the state change the
+    event describes so both are committed atomically.
+    """
+    await db.insert_data(
+        "INSERT INTO outbox (event_type, ordering_key, source_service, payload) VALUES ($1, $2, $3, $4::jsonb)",
+        (event.event_type, event.ordering_key or event.event_type, event.source_service, event.model_dump_json())
+    )
+
+
+class OutboxRelay:
+    """Publishes pending outbox rows through the event broker"""
+
+    def __init__(self, event_broker: EventPublisher = None, batch_size: int = 100, max_attempts: int = None):
+        if event_broker is None:
+            from shared.event_broker import get_event_broker
+            event_broker = get_event_broker()
+        self.event_broker = event_broker
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts or int(constants.OUTBOX_MAX_ATTEMPTS)
+
+    async def _claim(self) -> list:
+        async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+            async with db.transaction():
+                # Serializes claims only, so two relays can't both see a key's head row as free
+                await db.execute_query("SELECT pg_advisory_xact_lock($1)", (RELAY_LOCK_ID,))
+                rows = await db.execute_query(CLAIM, (self.batch_size, float(CLAIM_SECONDS)))
+        return sorted(rows, key=lambda row: row["id"])
+
+    async def relay_batch(self) -> tuple:
+        """
+        Publish up to `batch_size` pending events, oldest first.
+        Rows are only marked as published after the broker accepted them. When a
+        publish fails, later events with the same ordering key are held back
+        until the next run so consumers never see them out of order.
+        :return: (published, failed) counts.
+        """
+        rows = await self._claim()
+        published = []
+        failed = []
+        parked = []
+        blocked_keys = set()
+        for row in rows:
+            if row["ordering_key"] in blocked_keys:
+                continue
+            try:
+                await self.event_broker.publish(Event.model_validate_json(row["payload"]))
+                published.append(row["id"])
+            except Exception as e:
+                logging.error(f"Failed to relay outbox event {row['id']}: {e}")
+                if row["attempts"] + 1 >= self.max_attempts:
+                    logging.error(f"Parking outbox event {row['id']} after {row['attempts'] + 1} attempts")
+                    parked.append(row["id"])
+                else:
+                    blocked_keys.add(row["ordering_key"])
+                failed.append(row["id"])
+
+        async with dbClient.AsyncDatabaseManager(dbConfig.db_config) as db:
+            if published:
+                await db.insert_data("UPDATE outbox SET published_at = now(), claimed_until = NULL "
+                                     "WHERE id = ANY($1::bigint[])", (published,))
+            if failed:
+                await db.insert_data("UPDATE outbox SET attempts = attempts + 1, claimed_until = NULL, "
+                                     "parked_at = CASE WHEN id = ANY($2::bigint[]) THEN now() END "
+                                     "WHERE id = ANY($1::bigint[])", (failed, parked))
+            # Rows skipped behind a failure go back to the pool at once rather than when their lease ends
+            skipped = [row["id"] for row in rows if row["id"] not in published and row["id"] not in failed]
+            if skipped:
+                await db.insert_data("UPDATE outbox SET claimed_until = NULL WHERE id = ANY($1::bigint[])", (skipped,))
+        return len(published), len(failed)
+
+    async def relay_pending(self, max_batches: int = 10) -> int:
+        """Relay batches until the outbox is drained, a publish fails or `max_batches` is reached"""
+        total = 0
+        for _ in range(max_batches):
+            published, failed = await self.relay_batch()
+            total += published
+            if failed or published < self.batch_size:
+                break
+        logging.info(f"Relayed {total} outbox events")
+        return total
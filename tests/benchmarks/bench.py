@@ -0,0 +1,128 @@
+"""
+Timing and memory measurement against stored baselines.
+
+Each benchmark is timed over several samples, each sample calling the function
+enough times to last at least MIN_SAMPLE_SECONDS, with the garbage collector off.
+The fastest sample is compared with baselines.json: noise from other processes
+only ever makes a sample slower, so it is far more stable than the median. The
+peak memory allocated by a single call, measured under tracemalloc, is compared too.
+
+    RUN_BENCHMARKS=1 python -m pytest tests/benchmarks -q
+    RUN_BENCHMARKS=1 BENCHMARK_UPDATE_BASELINES=1 python -m pytest tests/benchmarks -q
+
+Raw timings depend on the machine, so each baseline also stores the time of a
+fixed pure-Python calibration workload measured in the same run. A benchmark is
+compared relative to the calibration of the run at hand: on a host twice as
+slow, twice the baseline time is no regression. BENCHMARK_TOLERANCE is the
+allowed slowdown beyond that (default 0.5, i.e. 50% slower).
+"""
+import functools
+import gc
+import json
+import os
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+MIN_SAMPLE_SECONDS = 0.02
+SAMPLES = 15
+WARMUP_CALLS = 2
+TOLERANCE = float(os.environ.get("BENCHMARK_TOLERANCE", "0.5"))
+# Allocations this small are noise, whatever the baseline
+MEMORY_SLACK_KIB = 64.0
+
+
+@dataclass
+class Measurement:
+    name: str
+    median_us: float
+    min_us: float
+    peak_kib: float
+
+    def as_baseline(self) -> dict:
+        return {"min_us": round(self.min_us, 2), "median_us": round(self.median_us, 2),
+                "peak_kib": round(self.peak_kib, 1), "calibration_us": round(calibration_us(), 2)}
+
+
+def measure(name: str, fn, samples: int = SAMPLES) -> Measurement:
+    for _ in range(WARMUP_CALLS):
+        fn()
+
+    # Calls per sample, so that timer resolution is negligible
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - started >= MIN_SAMPLE_SECONDS:
+            break
+        number *= 2
+
+    timings = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(samples):
+            started = time.perf_counter()
+            for _ in range(number):
+                fn()
+            timings.append((time.perf_counter() - started) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Measurement(name, statistics.median(timings) * 1e6, min(timings) * 1e6, peak / 1024)
+
+
+def _calibration_workload() -> None:
+    # Dict, string and JSON work, the kind the hot paths do, with no I/O or C extensions
+    rows = {f"key{i}": {"id": i, "name": f"name{i % 37}", "tags": [i % 3, i % 5]} for i in range(300)}
+    decoded = json.loads(json.dumps(rows))
+    sorted(decoded.values(), key=lambda row: (row["name"], row["id"]))
+
+
+@functools.lru_cache(maxsize=None)
+def calibration_us() -> float:
+    """Fastest time of the calibration workload on this host, measured once per run"""
+    return measure("calibration", _calibration_workload).min_us
+
+
+def load_baselines() -> dict:
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH) as f:
+        return json.load(f)
+
+
+def save_baseline(measurement: Measurement) -> None:
+    baselines = load_baselines()
+    baselines[measurement.name] = measurement.as_baseline()
+    with open(BASELINES_PATH, "w") as f:
+        json.dump(dict(sorted(baselines.items())), f, indent=2)
+        f.write("\n")
+
+
+def regressions(measurement: Measurement, baseline: dict) -> list:
+    """:return: A description of every metric that regressed past the tolerance"""
+    found = []
+    # How much slower this host is running than the one that recorded the baseline
+    speed = calibration_us() / baseline["calibration_us"]
+    allowed_us = baseline["min_us"] * speed * (1 + TOLERANCE)
+    if measurement.min_us > allowed_us:
+        found.append(f"{measurement.name}: {measurement.min_us:.1f} us per call, "
+                     f"baseline {baseline['min_us']:.1f} us at {speed:.2f}x its host's speed "
+                     f"(allowed {allowed_us:.1f} us)")
+    allowed_kib = baseline["peak_kib"] * (1 + TOLERANCE) + MEMORY_SLACK_KIB
+    if measurement.peak_kib > allowed_kib:
+        found.append(f"{measurement.name}: {measurement.peak_kib:.1f} KiB peak, "
+                     f"baseline {baseline['peak_kib']:.1f} KiB (allowed {allowed_kib:.1f} KiB)")
+    return found
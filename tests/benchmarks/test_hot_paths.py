@@ -0,0 +1,144 @@
+"""
+Micro-benchmarks of the CPU-bound hot paths, see bench.py for how they are run.
+"""
+import copy
+import json
+import os
+import random
+import tempfile
+import pytest
+from bench import load_baselines, measure, regressions, save_baseline
+
+pytestmark = pytest.mark.skipif(not os.environ.get("RUN_BENCHMARKS"),
+                                reason="benchmarks only run with RUN_BENCHMARKS=1")
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+WEBHOOK_BATCH_SIZE = 500
+IMAGES_PER_TUNE = 20
+VIDEO_FRAMES = 8
+
+
+def check(name: str, fn, **kwargs) -> None:
+    measurement = measure(name, fn, **kwargs)
+    if os.environ.get("BENCHMARK_UPDATE_BASELINES"):
+        save_baseline(measurement)
+        return
+    baseline = load_baselines().get(name)
+    # Every benchmark has a baseline; one missing, or recorded before calibration, is a failure to fix
+    assert baseline is not None and "calibration_us" in baseline, (
+        f"no calibrated baseline for {name}, record one with BENCHMARK_UPDATE_BASELINES=1")
+    found = regressions(measurement, baseline)
+    assert not found, "\n".join(found)
+
+
+@pytest.fixture(scope="module")
+def webhook_batch() -> bytes:
+    """The recorded webhook with its messages repeated, as Meta batches them under load"""
+    with open(os.path.join(FIXTURES, "webhook_sample.json")) as f:
+        sample = json.load(f)
+    value = sample["entry"][0]["changes"][0]["value"]
+    recorded = value["messages"]
+    messages = []
+    for i in range(WEBHOOK_BATCH_SIZE):
+        message = copy.deepcopy(recorded[i % len(recorded)])
+        message["id"] = f"{message['id']}{i:05d}"
+        messages.append(message)
+    value["messages"] = messages
+    return json.dumps(sample).encode()
+
+
+@pytest.fixture(scope="module")
+def inspect_responses() -> list:
+    clean = {"name": "man", "age": "30", "ethnicity": "caucasian", "eye_color": "brown",
+             "hair_color": "brown", "hair_length": "short", "funny_face": False, "blurry": False,
+             "wearing_sunglasses": False, "includes_multiple_people": False, "wearing_hat": False}
+    return [clean, {**clean, "name": ""}, {**clean, "blurry": True}, {**clean, "wearing_sunglasses": True},
+            {**clean, "includes_multiple_people": True}, {**clean, "wearing_hat": True}]
+
+
+@pytest.fixture(scope="module")
+def characteristics_per_image() -> list:
+    rng = random.Random(7)
+    values = {
+        "name": ["man"], "age": ["25", "30", "35"], "ethnicity": ["caucasian", "hispanic"],
+        "eye_color": ["brown", "green", "blue"], "hair_color": ["brown", "black"],
+        "hair_length": ["short", "medium"], "facial_hair": ["beard", "stubble", ""], "glasses": ["", "glasses"],
+    }
+    return [{key: rng.choice(options) for key, options in values.items() if rng.random() > 0.1}
+            for _ in range(IMAGES_PER_TUNE)]
+
+
+@pytest.fixture(scope="module")
+def astria_image():
+    """A noisy portrait image the size of an Astria result"""
+    np = pytest.importorskip("numpy")
+    Image = pytest.importorskip("PIL.Image")
+    pixels = np.random.default_rng(7).integers(0, 256, size=(1365, 1024, 3), dtype=np.uint8)
+    return Image.fromarray(pixels, "RGB")
+
+
+def test_decode_webhook(webhook_batch):
+    from Utils import webhook_decoder
+    check(f"decode_webhook[{WEBHOOK_BATCH_SIZE} messages]",
+          lambda: webhook_decoder.decode_webhook(webhook_batch, phone_number_id="benchmark-number"))
+
+
+def test_find_error_in_image_inspect(inspect_responses):
+    from Utils import utils
+    from Utils.states import Languages
+
+    def run():
+        for language in (Languages.ENGLISH.value, Languages.HEBREW.value):
+            for response in inspect_responses:
+                utils.find_error_in_image_inspect(response, language)
+    check("find_error_in_image_inspect", run)
+
+
+def test_vote_characteristics(characteristics_per_image):
+    pytest.importorskip("aiohttp")
+    pytest.importorskip("azure.functions")
+    from app.image_processors import vote_characteristics
+    check(f"vote_characteristics[{IMAGES_PER_TUNE} images]", lambda: vote_characteristics(characteristics_per_image))
+
+
+def test_resize_image_with_padding(astria_image):
+    pytest.importorskip("aiohttp")
+    from app.astria_images_video_processors import resize_image_with_padding
+    check("resize_image_with_padding", lambda: resize_image_with_padding(astria_image, (710, 1536)), samples=5)
+
+
+def test_is_image_black():
+    np = pytest.importorskip("numpy")
+    from Utils import utils
+    frame = np.random.default_rng(7).integers(0, 256, size=(1536, 710, 3), dtype=np.uint8)
+    check("is_image_black", lambda: utils.is_image_black(frame))
+
+
+def test_create_video_from_images():
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("moviepy")
+    pytest.importorskip("aiohttp")
+    from app.astria_images_video_processors import create_video_from_images
+    rng = np.random.default_rng(7)
+    frames = [rng.integers(0, 256, size=(768, 356, 3), dtype=np.uint8) for _ in range(VIDEO_FRAMES)]
+    with tempfile.TemporaryDirectory() as tmp:
+        output_path = os.path.join(tmp, "benchmark.mp4")
+        # Compare seconds per video rather than frames per second, same frame count every run
+        check(f"create_video_from_images[{VIDEO_FRAMES} frames]",
+              lambda: create_video_from_images(frames, output_path), samples=3)
+
+
+def test_whatsapp_payload_construction():
+    pytest.importorskip("aiohttp")
+    from Utils import WhatsappClient as wc, message_catalogue
+    from Utils.states import Languages
+
+    def run():
+        for language in (Languages.ENGLISH.value, Languages.HEBREW.value):
+            message_catalogue.render("init", language, "972500000000")
+            message_catalogue.render("pack_tiers", language, "972500000000")
+        for pack_id in range(3):
+            wc.dumps(wc.build_interactive_reply_image(
+                "972500000000", "https://example.com/cover.jpg", "Corporate headshots\n20 images for 10$",
+                pack_id, "Choose", additional_button_id=f"14_{pack_id}", additional_button_text="Examples"))
+    check("whatsapp_payload_construction", run)
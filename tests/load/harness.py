@@ -0,0 +1,221 @@
+"""
+Hermetic load test for the webhook handlers.
+
+Starts local WhatsApp Graph and Astria stand-ins (see stubs.py), points the bot at
+them and drives synthetic traffic for N concurrent users straight through the
+`receive_sms`, `payment-received` and `pack-tune-received` handlers of
+function_app.py. For every scenario it reports throughput, latency percentiles
+and the number of calls each upstream endpoint received.
+
+A payment is acknowledged before its tune is submitted, so the payment
+scenario's latencies are those of the acknowledgement. The tune submission jobs
+it queued are then run to completion through shared/jobs.py, and how long
+that took is reported on a line of its own.
+
+Postgres is not stubbed: point DB_HOST/DB_USER/DB_PASSWORD (and DB_SSL=disable
+for a local container) at a disposable database created with db/CreateDB.py.
+
+    python -m tests.load.harness --users 50
+    python -m tests.load.harness --users 200 --scenarios statuses conversation --astria-latency-ms 300
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from tests.load.stubs import AstriaStub, StubBehaviour, WhatsappStub
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+NUMBER_ID = "load-test-number"
+IMAGES_PER_USER = 3
+SCENARIOS = ("conversation", "payment", "pack_delivery", "statuses")
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+    seconds: float = 0.0
+    upstream_calls: dict = field(default_factory=dict)
+    # Background jobs run after the requests, and how long running them took
+    jobs_run: int = 0
+    jobs_seconds: float = 0.0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        # Nearest-rank percentile
+        return ordered[max(math.ceil(p / 100 * len(ordered)), 1) - 1]
+
+    def render(self) -> str:
+        requests = len(self.latencies)
+        lines = [
+            f"== {self.name}: {requests} requests, {self.errors} errors in {self.seconds:.2f}s "
+            f"({requests / self.seconds if self.seconds else 0:.1f} req/s)",
+            "   latency ms: " + "  ".join(f"p{p}={self.percentile(p) * 1000:.1f}" for p in (50, 90, 99))
+            + f"  max={max(self.latencies, default=0) * 1000:.1f}",
+        ]
+        if self.jobs_run:
+            lines.append(f"   {self.jobs_run} background jobs run in {self.jobs_seconds:.2f}s after the requests")
+        for route, count in sorted(self.upstream_calls.items()):
+            lines.append(f"   {count:6d}  {route}")
+        return "\n".join(lines)
+
+
+def _webhook(messages: list = None, statuses: list = None) -> bytes:
+    value = {"messaging_product": "whatsapp", "metadata": {"phone_number_id": NUMBER_ID}}
+    if messages is not None:
+        value["messages"] = messages
+    if statuses is not None:
+        value["statuses"] = statuses
+    return json.dumps({"object": "whatsapp_business_account",
+                       "entry": [{"id": "load", "changes": [{"field": "messages", "value": value}]}]}).encode()
+
+
+class Traffic:
+    """Synthetic requests; ids include the run id so that reruns never collide in the database"""
+
+    def __init__(self, func, astria_url: str):
+        self.func = func
+        self.astria_url = astria_url
+        self.run_id = str(int(time.time()))
+
+    def phone(self, user: int) -> str:
+        return f"99{self.run_id[-6:]}{user:05d}"
+
+    def _message(self, user: int, seq: int, **content) -> dict:
+        return {"from": self.phone(user), "id": f"wamid.load.{self.run_id}.{user}.{seq}",
+                "timestamp": str(int(time.time())), **content}
+
+    def _post(self, route: str, body: bytes, params: dict = None):
+        return self.func.HttpRequest(method="POST", url=f"http://localhost/api/{route}", body=body,
+                                     params=params or {}, headers={"Content-Type": "application/json"})
+
+    def conversation(self, user: int) -> list:
+        """A new user says hi, opens the guidelines, uploads images and picks a pack"""
+        steps = [
+            self._message(user, 0, type="text", text={"body": "hi"}),
+            self._message(user, 1, type="interactive",
+                          interactive={"type": "list_reply", "list_reply": {"id": "1", "title": "Begin"}}),
+        ]
+        steps += [self._message(user, 2 + i, type="image", image={"id": f"{user}{i:03d}", "mime_type": "image/jpeg"})
+                  for i in range(IMAGES_PER_USER)]
+        steps.append(self._message(user, 9, type="interactive",
+                                   interactive={"type": "button_reply", "button_reply": {"id": "101", "title": "Choose"}}))
+        return [("SmsReceived", self._post("SmsReceived", _webhook(messages=[step]))) for step in steps]
+
+    def payment(self, user: int) -> list:
+        body = json.dumps({"EntityID": f"load-{self.run_id}-{user}", "Properties": {
+            "Property_M-5": [self.phone(user)],
+            "Property_M-10": ["Load Test"],
+            "Property_M-3": [{"Name": "Lite"}],
+        }}).encode()
+        return [("payment-received", self._post("payment-received", body))]
+
+    def pack_delivery(self, user: int) -> list:
+        images = [f"{self.astria_url}/assets/{user}-{i}.jpg" for i in range(4)]
+        # Prompt ids are claimed once delivered, so they include the run id like every other id
+        body = json.dumps({"prompt": {"id": f"load-{self.run_id}-{user}", "images": images}}).encode()
+        return [("pack-tune-received", self._post("pack-tune-received", body, {"phone_number": self.phone(user)}))]
+
+    def statuses(self, user: int) -> list:
+        now = int(time.time())
+        return [("SmsReceived", self._post("SmsReceived", _webhook(statuses=[
+            {"id": f"wamid.stub.{user}", "status": status, "timestamp": str(now), "recipient_id": self.phone(user)}
+        ]))) for status in ("sent", "delivered", "read")]
+
+
+def _user_function(route):
+    # The v2 programming model wraps handlers in a FunctionBuilder
+    return route.build().get_user_function() if hasattr(route, "build") else route
+
+
+async def _run_scenario(name: str, handlers: dict, traffic: Traffic, users: int, stubs: list) -> ScenarioResult:
+    result = ScenarioResult(name)
+    before = [stub.snapshot() for stub in stubs]
+
+    async def run_user(user: int) -> None:
+        # A user's requests are sent one after the other, like a real conversation
+        for route, request in getattr(traffic, name)(user):
+            started = time.perf_counter()
+            try:
+                response = await handlers[route](request)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            result.latencies.append(time.perf_counter() - started)
+            result.errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(user) for user in range(users)))
+    result.seconds = time.perf_counter() - started
+    if name == "payment":
+        # What the acknowledgements queued; jobs failing into a retry delay are left behind
+        from shared import jobs
+        started = time.perf_counter()
+        while ran := await jobs.run_due_jobs():
+            result.jobs_run += ran
+        result.jobs_seconds = time.perf_counter() - started
+    for stub, snapshot, prefix in zip(stubs, before, ("whatsapp", "astria")):
+        for route, count in (stub.snapshot() - snapshot).items():
+            result.upstream_calls[f"{prefix} {route}"] = count
+    return result
+
+
+async def main(argv: list = None) -> list:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="concurrent synthetic users")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--whatsapp-latency-ms", type=float, default=50)
+    parser.add_argument("--astria-latency-ms", type=float, default=150)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls failed with a 500")
+    args = parser.parse_args(argv)
+
+    whatsapp = WhatsappStub(StubBehaviour(args.whatsapp_latency_ms / 1000, args.jitter_ms / 1000, args.error_rate))
+    astria = AstriaStub(StubBehaviour(args.astria_latency_ms / 1000, args.jitter_ms / 1000, args.error_rate))
+    await whatsapp.start()
+    await astria.start()
+    # Utils.constants reads the environment on import, so the app is imported after this
+    os.environ.update({
+        "WHATSAPP_API_URL": whatsapp.base_url,
+        "WHATSAPP_NUMBER_ID": NUMBER_ID,
+        "WHATSAPP_API_KEY": "load-test",
+        "ASTRIA_API_URL": astria.base_url,
+        "ASTRIA_API_KEY": "load-test",
+        "MAX_IMAGES_THRESHOLD": str(IMAGES_PER_USER),
+        "WEBHOOK_URL": "http://localhost/api/pack-tune-received?code=load",
+        "LITE_TIER_PRICE": "10",
+    })
+    sys.path.insert(0, REPO_ROOT)
+    import azure.functions as func
+    import function_app
+
+    handlers = {
+        "SmsReceived": _user_function(function_app.receive_sms),
+        "payment-received": _user_function(function_app.recieve_payment),
+        "pack-tune-received": _user_function(function_app.receive_pack_images),
+    }
+    traffic = Traffic(func, astria.base_url)
+    results = []
+    try:
+        for name in args.scenarios:
+            result = await _run_scenario(name, handlers, traffic, args.users, [whatsapp, astria])
+            print(result.render(), flush=True)
+            results.append(result)
+    finally:
+        from Utils import background, dbClient
+        await background.drain()
+        await dbClient.close_pool()
+        await whatsapp.stop()
+        await astria.stop()
+    return results
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,160 @@
+"""
+Replays a webhook capture (see Utils/capture.py) against a running deployment.
+
+Requests are sent at their recorded pace scaled by --speed, or as fast as the
+deployment answers with --speed max. Each user's requests are sent one after
+the other in capture order, a request never starts before the previous one from
+the same user has been answered, so the state machine sees the same sequence as
+in production while different users overlap as they did at the time.
+
+Point the deployment at the stubs rather than the real WhatsApp and Astria APIs,
+and at a disposable database:
+
+    python -m tests.load.stubs --whatsapp-port 8081 --astria-port 8082
+    python -m tests.load.replay captures/ --target http://localhost:7071/api --speed 10 \\
+        --media-url http://127.0.0.1:8082/assets
+
+Message and payment ids get a per-run suffix so that a capture can be replayed
+more than once without every message being dropped as a duplicate.
+"""
+import argparse
+import asyncio
+import glob
+import heapq
+import json
+import os
+import time
+from collections import defaultdict
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from tests.load.harness import ScenarioResult
+
+SPEEDS = ("1", "10", "max")
+
+
+def parse_speed(value: str) -> float:
+    value = value.lower()
+    if value == "max":
+        return float("inf")
+    speed = float(value.rstrip("x"))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive")
+    return speed
+
+
+def _capture_files(paths: list) -> list:
+    files = []
+    for path in paths:
+        files += sorted(glob.glob(os.path.join(path, "*.jsonl"))) if os.path.isdir(path) else [path]
+    return files
+
+
+def _read(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_capture(paths: list) -> list:
+    """Every record of the capture files, merged by arrival time"""
+    # Each file is in arrival order already, files from several replicas interleave
+    return list(heapq.merge(*(_read(path) for path in _capture_files(paths)), key=lambda record: record["t"]))
+
+
+def _rewrite(record: dict, run_id: str, media_url: str) -> dict:
+    body = record["body"]
+    route = record["route"]
+    if route == "SmsReceived" and run_id:
+        for entry in body.get("entry", ()):
+            for change in entry.get("changes", ()):
+                for message in (change.get("value") or {}).get("messages", ()):
+                    message["id"] = f"{message.get('id')}.{run_id}"
+    elif route == "payment-received" and run_id:
+        body["EntityID"] = f"{body.get('EntityID')}.{run_id}"
+    elif route == "pack-tune-received" and media_url:
+        for prompt in body if isinstance(body, list) else [body.get("prompt") or {}]:
+            if isinstance(prompt, dict) and "images" in prompt:
+                prompt["images"] = [f"{media_url}/{record['user']}-{i}.jpg" for i in range(len(prompt["images"]))]
+    return record
+
+
+def user_lanes(records: list) -> list:
+    """Records split per user, each lane in capture order"""
+    lanes = defaultdict(list)
+    for i, record in enumerate(records):
+        # Records without a user have nothing to keep in order
+        lanes[record.get("user") or f"anonymous-{i}"].append(record)
+    return list(lanes.values())
+
+
+async def replay(records: list, target: str, speed: float, code: str = None, connections: int = 100) -> dict:
+    results = {}
+    lag = ScenarioResult("schedule lag")
+    if not records:
+        return results
+    first_arrival = records[0]["t"]
+
+    async def send(session: ClientSession, record: dict) -> None:
+        result = results.setdefault(record["route"], ScenarioResult(record["route"]))
+        params = dict(record.get("params") or {})
+        if code:
+            params["code"] = code
+        started = time.perf_counter()
+        try:
+            async with session.post(f"{target}/{record['route']}", json=record["body"], params=params) as response:
+                await response.read()
+                failed = response.status >= 400
+        except Exception:
+            failed = True
+        result.latencies.append(time.perf_counter() - started)
+        result.errors += failed
+
+    async def run_lane(session: ClientSession, lane: list, replay_started: float) -> None:
+        for record in lane:
+            if speed != float("inf"):
+                due = replay_started + (record["t"] - first_arrival) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    # The deployment, or this user's previous request, is behind the recording
+                    lag.latencies.append(-delay)
+            await send(session, record)
+
+    timeout = ClientTimeout(total=120)
+    async with ClientSession(connector=TCPConnector(limit=connections), timeout=timeout) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(run_lane(session, lane, started) for lane in user_lanes(records)))
+        seconds = time.perf_counter() - started
+    for result in results.values():
+        result.seconds = seconds
+    if lag.latencies:
+        lag.seconds = seconds
+        results[lag.name] = lag
+    return results
+
+
+async def main(argv: list = None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="capture files, or directories of them")
+    parser.add_argument("--target", default="http://localhost:7071/api", help="base URL of the deployment")
+    parser.add_argument("--speed", type=parse_speed, default="1", help=f"one of {', '.join(SPEEDS)}, or any factor")
+    parser.add_argument("--code", default=os.environ.get("FUNCTION_KEY"), help="function key, if the routes need one")
+    parser.add_argument("--media-url", help="base URL answering for the images stripped from pack deliveries")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--keep-ids", action="store_true", help="send message and payment ids as captured")
+    args = parser.parse_args(argv)
+
+    run_id = None if args.keep_ids else f"r{int(time.time())}"
+    records = [_rewrite(record, run_id, args.media_url) for record in load_capture(args.captures)]
+    span = records[-1]["t"] - records[0]["t"] if records else 0
+    print(f"Replaying {len(records)} requests from {len(user_lanes(records))} users, "
+          f"captured over {span:.0f}s, at {'max' if args.speed == float('inf') else args.speed}x", flush=True)
+    results = await replay(records, args.target.rstrip("/"), args.speed, args.code, args.connections)
+    for result in results.values():
+        print(result.render(), flush=True)
+    return results
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
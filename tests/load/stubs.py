@@ -0,0 +1,172 @@
+"""
+Local stand-ins for the WhatsApp Graph API and the Astria API.
+
+Each stub is a small aiohttp server on 127.0.0.1 answering the endpoints the bot
+calls with canned payloads. Every response can be delayed and a share of them
+failed with a 500, and every call is counted per route.
+
+Run on their own, for a local deployment driven by replay.py:
+
+    python -m tests.load.stubs --whatsapp-port 8081 --astria-port 8082
+"""
+import argparse
+import asyncio
+import itertools
+import random
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from aiohttp import web
+
+# A 1x1 PNG, served for WhatsApp media downloads and Astria result images
+PNG_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+PACKS = [
+    {
+        "id": 101 + i,
+        "slug": f"corporate-headshots-{tier}",
+        "title": f"Corporate headshots ({tier})",
+        "name": "man",
+        "cover_url": "https://example.com/cover.jpg",
+        "costs": {
+            "man": {"cost": 1000 * (i + 1), "num_images": 20 * (i + 1)},
+            "woman": {"cost": 1000 * (i + 1), "num_images": 20 * (i + 1)},
+        },
+    }
+    for i, tier in enumerate(("lite", "standard", "premium"))
+]
+
+
+@dataclass
+class StubBehaviour:
+    # Seconds added to every response, plus up to `jitter` seconds at random
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Share of requests answered with a 500
+    error_rate: float = 0.0
+
+
+class StubServer:
+    def __init__(self, behaviour: StubBehaviour = None):
+        self.behaviour = behaviour or StubBehaviour()
+        self.calls = Counter()
+        self.base_url = None
+        self.app = web.Application(middlewares=[self._emulate])
+        self._runner = None
+        self._ids = itertools.count(1)
+
+    @web.middleware
+    async def _emulate(self, request: web.Request, handler):
+        route = request.match_info.route.resource
+        self.calls[f"{request.method} {route.canonical if route else request.path}"] += 1
+        delay = self.behaviour.latency + random.random() * self.behaviour.jitter
+        if delay:
+            await asyncio.sleep(delay)
+        if random.random() < self.behaviour.error_rate:
+            return web.json_response({"error": "injected failure"}, status=500)
+        return await handler(request)
+
+    async def start(self, port: int = 0) -> str:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def snapshot(self) -> Counter:
+        return Counter(self.calls)
+
+
+class WhatsappStub(StubServer):
+    """Graph API: /{number id}/messages, media lookups and media downloads"""
+
+    def __init__(self, behaviour: StubBehaviour = None):
+        super().__init__(behaviour)
+        self.app.router.add_post("/{number_id}/messages", self.send_message)
+        self.app.router.add_get("/media/{media_id}", self.download_media)
+        self.app.router.add_get("/{media_id}", self.media_url)
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        await request.read()
+        return web.json_response({
+            "messaging_product": "whatsapp",
+            "messages": [{"id": f"wamid.stub.{next(self._ids)}"}],
+        })
+
+    async def media_url(self, request: web.Request) -> web.Response:
+        return web.json_response({"url": f"{self.base_url}/media/{request.match_info['media_id']}"})
+
+    async def download_media(self, request: web.Request) -> web.Response:
+        return web.Response(body=PNG_BYTES, content_type="image/png")
+
+
+class AstriaStub(StubServer):
+    """Astria: packs, tunes, image inspection and generated images"""
+
+    def __init__(self, behaviour: StubBehaviour = None):
+        super().__init__(behaviour)
+        self.app.router.add_get("/packs", self.packs)
+        self.app.router.add_get("/p/{pack_id}", self.pack)
+        self.app.router.add_post("/p/{pack_id}/tunes", self.create_tune)
+        self.app.router.add_get("/tunes", self.tunes)
+        self.app.router.add_post("/images/inspect", self.inspect)
+        self.app.router.add_get("/assets/{name}", self.asset)
+
+    async def packs(self, request: web.Request) -> web.Response:
+        return web.json_response(PACKS)
+
+    async def pack(self, request: web.Request) -> web.Response:
+        pack_id = int(request.match_info["pack_id"])
+        for pack in PACKS:
+            if pack["id"] == pack_id:
+                return web.json_response(pack)
+        return web.json_response({"error": "not found"}, status=404)
+
+    async def create_tune(self, request: web.Request) -> web.Response:
+        await request.read()
+        eta = datetime.now(timezone.utc) + timedelta(minutes=20)
+        return web.json_response({"id": next(self._ids), "eta": eta.isoformat()})
+
+    async def tunes(self, request: web.Request) -> web.Response:
+        return web.json_response([])
+
+    async def inspect(self, request: web.Request) -> web.Response:
+        await request.read()
+        return web.json_response({"name": "man", "blurry": False, "funny_face": False,
+                                  "wearing_sunglasses": False, "includes_multiple_people": False,
+                                  "wearing_hat": False, "hair_color": "brown"})
+
+    async def asset(self, request: web.Request) -> web.Response:
+        # HEAD is answered by this handler too, the bot only reads its Content-Type
+        return web.Response(body=PNG_BYTES, content_type="image/jpeg")
+
+
+async def serve(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Serve the WhatsApp and Astria stubs until interrupted")
+    parser.add_argument("--whatsapp-port", type=int, default=8081)
+    parser.add_argument("--astria-port", type=int, default=8082)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args(argv)
+    behaviour = StubBehaviour(args.latency_ms / 1000)
+    whatsapp, astria = WhatsappStub(behaviour), AstriaStub(behaviour)
+    print(f"WHATSAPP_API_URL={await whatsapp.start(args.whatsapp_port)}")
+    print(f"ASTRIA_API_URL={await astria.start(args.astria_port)}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await whatsapp.stop()
+        await astria.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -0,0 +1,116 @@
+"""
+AIMD behaviour of the adaptive webhook limit, see Utils/admission.py.
+"""
+import asyncio
+import pytest
+from Utils import admission
+
+
+def _limit(**overrides) -> admission.AdaptiveLimit:
+    settings = dict(initial=10, min_limit=2, max_limit=12, latency_target=1.0, upstream_target=0.5, backoff=0.5)
+    settings.update(overrides)
+    return admission.AdaptiveLimit(**settings)
+
+
+def _fill(limit: admission.AdaptiveLimit, count: int) -> None:
+    for _ in range(count):
+        assert limit.try_acquire()
+
+
+def test_rejects_past_the_limit():
+    limit = _limit(initial=3)
+    _fill(limit, 3)
+    assert not limit.try_acquire()
+    limit.release(0.1, ok=True)
+    assert limit.try_acquire()
+
+
+def test_grows_by_one_per_limit_worth_of_fast_requests_while_busy():
+    limit = _limit()
+    for _ in range(10):
+        _fill(limit, 6)
+        for _ in range(6):
+            limit.release(0.1, ok=True)
+    # 60 fast releases, but only those while at least half the limit was in flight count
+    assert 10 < limit.limit <= 12
+
+
+def test_does_not_grow_while_idle():
+    limit = _limit()
+    for _ in range(50):
+        _fill(limit, 1)
+        limit.release(0.1, ok=True)
+    assert limit.limit == 10
+
+
+def test_never_grows_past_the_maximum():
+    limit = _limit(initial=11.9)
+    for _ in range(200):
+        _fill(limit, 11)
+        for _ in range(11):
+            limit.release(0.1, ok=True)
+    assert limit.limit == 12
+
+
+@pytest.mark.parametrize("seconds, ok", [(5.0, True), (0.1, False)])
+def test_slow_or_failed_request_shrinks_multiplicatively(seconds, ok):
+    limit = _limit()
+    _fill(limit, 1)
+    limit.release(seconds, ok=ok)
+    assert limit.limit == 5
+
+
+def test_shrinks_once_per_latency_target():
+    limit = _limit(latency_target=60.0)
+    _fill(limit, 3)
+    for _ in range(3):
+        limit.release(120.0, ok=False)
+    assert limit.limit == 5
+
+
+def test_never_shrinks_below_the_minimum():
+    limit = _limit(latency_target=0.0)
+    for _ in range(10):
+        _fill(limit, 1)
+        limit.release(5.0, ok=False)
+    assert limit.limit == 2
+
+
+def test_unobserved_release_leaves_the_limit_alone():
+    limit = _limit()
+    _fill(limit, 1)
+    limit.release(120.0, ok=False, observed=False)
+    assert limit.limit == 10
+    assert limit.in_flight == 0
+
+
+def test_upstream_calls_count_only_inside_an_observed_webhook(monkeypatch):
+    limit = _limit()
+    monkeypatch.setattr(admission, "LIMIT", limit)
+    monkeypatch.setattr(admission.constants, "ADMISSION_ENABLED", True)
+
+    async def webhook(observed: bool) -> None:
+        async with admission.admitted("test", observed=observed) as admitted:
+            assert admitted
+            limit.observe_upstream("astria", 30.0, "ok")
+
+    # A background job's slow call
+    limit.observe_upstream("astria", 30.0, "ok")
+    assert limit.limit == 10
+    asyncio.run(webhook(observed=False))
+    assert limit.limit == 10
+    asyncio.run(webhook(observed=True))
+    assert limit.limit == 5
+
+
+def test_fast_upstream_calls_are_no_signal(monkeypatch):
+    limit = _limit()
+    monkeypatch.setattr(admission, "LIMIT", limit)
+    monkeypatch.setattr(admission.constants, "ADMISSION_ENABLED", True)
+
+    async def webhook() -> None:
+        async with admission.admitted("test"):
+            limit.observe_upstream("whatsapp", 0.1, "ok")
+
+    asyncio.run(webhook())
+    assert limit.limit == 10
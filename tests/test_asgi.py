@@ -0,0 +1,113 @@
+"""
+NCRONTAB schedules and function-key checks of the ASGI entry point, see shared/asgi.py.
+"""
+from datetime import datetime, timezone
+import pytest
+
+pytest.importorskip("fastapi")
+azure_functions = pytest.importorskip("azure.functions")
+from starlette.requests import Request
+from shared import asgi
+
+
+def _at(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("expression, now, expected", [
+    ("*/15 * * * * *", _at(2026, 1, 1, 0, 0, 0), _at(2026, 1, 1, 0, 0, 15)),
+    ("*/15 * * * * *", _at(2026, 1, 1, 0, 0, 59, 500), _at(2026, 1, 1, 0, 1, 0)),
+    ("0 */1 * * * *", _at(2026, 1, 1, 0, 0, 0), _at(2026, 1, 1, 0, 1, 0)),
+    ("0 30 9-17 * * *", _at(2026, 1, 1, 17, 30, 0), _at(2026, 1, 2, 9, 30, 0)),
+    ("0 0 0,12 * * *", _at(2026, 1, 1, 6, 0, 0), _at(2026, 1, 1, 12, 0, 0)),
+    ("0 0 0 31 * *", _at(2026, 4, 1, 0, 0, 0), _at(2026, 5, 31, 0, 0, 0)),
+    ("0 0 0 1 2 *", _at(2026, 3, 1, 0, 0, 0), _at(2027, 2, 1, 0, 0, 0)),
+    ("0 0 0 29 2 *", _at(2026, 1, 1, 0, 0, 0), _at(2028, 2, 29, 0, 0, 0)),
+    # Every Wednesday at 4:00, 2026-01-07 is a Wednesday
+    ("0 0 4 * * 3", _at(2026, 1, 1, 0, 0, 0), _at(2026, 1, 7, 4, 0, 0)),
+    ("0 0 4 * * 3", _at(2026, 1, 7, 4, 0, 0), _at(2026, 1, 14, 4, 0, 0)),
+    # Sundays are 0
+    ("0 0 0 * * 0", _at(2026, 1, 1, 0, 0, 0), _at(2026, 1, 4, 0, 0, 0)),
+    ("0 0 0 * * 1-5/2", _at(2026, 1, 3, 0, 0, 0), _at(2026, 1, 5, 0, 0, 0)),
+])
+def test_next_after(expression, now, expected):
+    assert asgi.Schedule(expression).next_after(now) == expected
+
+
+def test_restricted_days_of_month_and_week_fire_on_either():
+    # The 13th, or any Friday: 2026-01-02 and 2026-01-09 are Fridays
+    schedule = asgi.Schedule("0 0 0 13 * 5")
+    assert schedule.next_after(_at(2026, 1, 1)) == _at(2026, 1, 2)
+    assert schedule.next_after(_at(2026, 1, 9)) == _at(2026, 1, 13)
+    assert schedule.next_after(_at(2026, 1, 13)) == _at(2026, 1, 16)
+
+
+def test_day_of_week_alone_is_not_widened_by_the_day_of_month():
+    schedule = asgi.Schedule("0 0 0 */1 * 5")
+    assert schedule.next_after(_at(2026, 1, 1)) == _at(2026, 1, 2)
+    assert schedule.next_after(_at(2026, 1, 2)) == _at(2026, 1, 9)
+
+
+@pytest.mark.parametrize("expression", ["* * * * *", "0 0 0 * * * *"])
+def test_rejects_wrong_field_count(expression):
+    with pytest.raises(ValueError):
+        asgi.Schedule(expression)
+
+
+def test_rejects_a_schedule_that_never_fires():
+    with pytest.raises(ValueError):
+        asgi.Schedule("0 0 0 31 2 *").next_after(_at(2026, 1, 1))
+
+
+def _request(query: str = "", headers: dict = None) -> Request:
+    return Request({
+        "type": "http", "method": "POST", "path": "/api/x", "query_string": query.encode(),
+        "headers": [(name.encode(), value.encode()) for name, value in (headers or {}).items()],
+    })
+
+
+def test_authorized_fails_closed_without_a_key(monkeypatch):
+    monkeypatch.setattr(asgi.constants, "ASGI_FUNCTION_KEY", None)
+    assert not asgi._authorized(_request("code="))
+    assert not asgi._authorized(_request())
+
+
+def test_authorized_checks_the_key(monkeypatch):
+    monkeypatch.setattr(asgi.constants, "ASGI_FUNCTION_KEY", "secret")
+    assert asgi._authorized(_request("code=secret"))
+    assert asgi._authorized(_request(headers={"x-functions-key": "secret"}))
+    assert not asgi._authorized(_request("code=wrong"))
+    assert not asgi._authorized(_request())
+
+
+def _function_app() -> "azure_functions.FunctionApp":
+    app = azure_functions.FunctionApp(http_auth_level=azure_functions.AuthLevel.FUNCTION)
+
+    @app.route(route="health", methods=["GET"], auth_level=azure_functions.AuthLevel.ANONYMOUS)
+    async def health(req):
+        return azure_functions.HttpResponse("OK")
+
+    return app
+
+
+def test_app_with_only_anonymous_routes_starts_without_a_key(monkeypatch):
+    monkeypatch.setattr(asgi.constants, "ASGI_FUNCTION_KEY", None)
+    asgi.create_app(_function_app(), "test")
+
+
+def _protected_function_app() -> "azure_functions.FunctionApp":
+    app = _function_app()
+
+    @app.route(route="payment-received")
+    async def payment(req):
+        return azure_functions.HttpResponse("OK")
+
+    return app
+
+
+def test_app_with_protected_routes_refuses_to_start_without_a_key(monkeypatch):
+    monkeypatch.setattr(asgi.constants, "ASGI_FUNCTION_KEY", None)
+    with pytest.raises(RuntimeError):
+        asgi.create_app(_protected_function_app(), "test")
+    monkeypatch.setattr(asgi.constants, "ASGI_FUNCTION_KEY", "secret")
+    asgi.create_app(_protected_function_app(), "test")
@@ -0,0 +1,55 @@
+"""
+Kinds outbound messages are tracked under, see Utils/delivery_metrics.py.
+"""
+import asyncio
+from datetime import timedelta
+import pytest
+
+pytest.importorskip("aiohttp")
+from Utils import delivery_metrics
+from Utils.WhatsappWrapper import WhatsappWrapper
+
+
+class FakeClient:
+    """Answers every send like the Graph API, with a fresh message id"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_raw(self, payload: bytes, kind: str):
+        self.sent += 1
+        body = {"messages": [{"id": f"wamid.{self.sent}"}]}
+        delivery_metrics.record_sent(body, kind)
+        return body
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    monkeypatch.setattr(delivery_metrics.constants, "DELIVERY_METRICS_ENABLED", True)
+    tracker = delivery_metrics.OutboundTracker()
+    monkeypatch.setattr(delivery_metrics, "TRACKER", tracker)
+    return tracker
+
+
+def _kinds(tracker) -> list:
+    return [kind for kind, _ in tracker._sent.values()]
+
+
+def _wrapper() -> WhatsappWrapper:
+    wa = WhatsappWrapper("15550001")
+    wa.client = FakeClient()
+    return wa
+
+
+def test_text_messages_are_tracked_under_their_catalogue_kind(tracker):
+    wa = _wrapper()
+    asyncio.run(wa.send_processingimages_msg(timedelta(hours=2)))
+    asyncio.run(wa.send_paymentreceived_msg("Dana"))
+    assert _kinds(tracker) == ["processing_images", "payment_received"]
+
+
+def test_static_and_dynamic_messages_share_the_catalogue_names(tracker):
+    wa = _wrapper()
+    asyncio.run(wa.send_error_message())
+    asyncio.run(wa.send_tunes_to_client([]))
+    assert set(_kinds(tracker)) == {"error", "tunes"}
@@ -0,0 +1,41 @@
+"""
+Worker count and DB pool sizing of the pre-fork mode, see shared/gunicorn_conf.py.
+"""
+import pytest
+from shared import gunicorn_conf
+
+
+@pytest.mark.parametrize("cpus, db_pool_max_size, expected", [
+    (2, 10, 2),
+    (1.5, 10, 2),
+    (4, 10, 3),
+    (8, 30, 8),
+    (4, 3, 1),
+    (4, 2, 1),
+])
+def test_worker_count(cpus, db_pool_max_size, expected):
+    assert gunicorn_conf.worker_count(cpus, db_pool_max_size) == expected
+
+
+@pytest.mark.parametrize("db_pool_max_size, workers, expected", [
+    (10, 1, 8),
+    (10, 2, 3),
+    (10, 3, 1),
+    (30, 8, 1),
+])
+def test_pool_max_size(db_pool_max_size, workers, expected):
+    assert gunicorn_conf.pool_max_size(db_pool_max_size, workers) == expected
+
+
+@pytest.mark.parametrize("db_pool_max_size, workers", [(10, 4), (2, 1)])
+def test_budget_too_small_for_the_workers_is_refused(db_pool_max_size, workers):
+    with pytest.raises(ValueError):
+        gunicorn_conf.pool_max_size(db_pool_max_size, workers)
+
+
+@pytest.mark.parametrize("cpus", [1, 2, 3, 4, 16])
+@pytest.mark.parametrize("db_pool_max_size", [3, 5, 10, 20, 50])
+def test_default_worker_count_stays_within_the_budget(cpus, db_pool_max_size):
+    workers = gunicorn_conf.worker_count(cpus, db_pool_max_size)
+    pool = gunicorn_conf.pool_max_size(db_pool_max_size, workers)
+    assert workers * (pool + gunicorn_conf.DEDICATED_CONNECTIONS) <= db_pool_max_size
@@ -0,0 +1,60 @@
+"""
+Import-time budget for the WhatsApp message path.
+
+Every Azure Functions scale-out pays the import cost of the message path before
+it can answer a webhook. This test imports it, and the root function app that
+serves it, in a fresh interpreter under `python -X importtime` and fails when
+heavy modules leak back into them or when their cumulative import time grows
+past the budget.
+
+The budget can be tuned per machine with MESSAGE_PATH_IMPORT_BUDGET_MS.
+"""
+import os
+import subprocess
+import sys
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MESSAGE_PATH_MODULE = "app.message_processor"
+# Imports every route's module, so a deferral undone anywhere shows here
+ROOT_APP_MODULE = "function_app"
+# Only needed by pack video generation, image utilities and event publishing, never to answer a webhook
+HEAVY_MODULES = ("cv2", "moviepy", "PIL", "numpy", "requests", "starlette", "azure.storage.blob", "pydantic")
+BUDGET_MS = float(os.environ.get("MESSAGE_PATH_IMPORT_BUDGET_MS", "600"))
+
+
+def _import_profile(module: str) -> dict:
+    """:return: {module name: cumulative import time in microseconds}"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        if "ModuleNotFoundError" in result.stderr:
+            pytest.skip(f"dependencies of {module} are not installed")
+        raise AssertionError(result.stderr)
+    profile = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        profile[name.strip()] = int(cumulative)
+    return profile
+
+
+@pytest.mark.parametrize("module", [MESSAGE_PATH_MODULE, ROOT_APP_MODULE])
+def test_message_path_skips_heavy_modules(module):
+    profile = _import_profile(module)
+    leaked = sorted(name for name in profile
+                    if any(name == heavy or name.startswith(heavy + ".") for heavy in HEAVY_MODULES))
+    assert not leaked, f"{module} imports heavy modules at import time: {leaked}"
+
+
+@pytest.mark.parametrize("module", [MESSAGE_PATH_MODULE, ROOT_APP_MODULE])
+def test_message_path_import_budget(module):
+    profile = _import_profile(module)
+    cumulative_ms = profile[module] / 1000
+    assert cumulative_ms <= BUDGET_MS, (
+        f"importing {module} took {cumulative_ms:.0f} ms, budget is {BUDGET_MS:.0f} ms"
+    )
@@ -0,0 +1,63 @@
+"""
+Metrics shared between pre-forked workers, see Utils/metrics.py.
+"""
+import json
+import os
+import pytest
+from Utils import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    monkeypatch.setattr(metrics, "_multiprocess_dir", str(tmp_path))
+    return registry
+
+
+def _worker(directory, pid: int, counter: float, histogram: list, gauge: float) -> None:
+    """Write the snapshot another worker would have flushed"""
+    with open(os.path.join(directory, f"{pid}.json"), "w") as f:
+        json.dump({
+            "requests_total": {"kind": "counter", "samples": [[["a"], counter]]},
+            "latency_seconds": {"kind": "histogram", "samples": [[[], histogram]]},
+            "in_flight": {"kind": "gauge", "samples": [[[], gauge]]},
+        }, f)
+
+
+def _register(registry):
+    counter = registry.register(metrics.Counter("requests_total", "Requests", ["route"]))
+    histogram = registry.register(metrics.Histogram("latency_seconds", "Latency", buckets=(1.0,)))
+    gauge = registry.register(metrics.Gauge("in_flight", "In flight"))
+    return counter, histogram, gauge
+
+
+def test_scrape_reports_every_worker(registry, tmp_path):
+    counter, histogram, gauge = _register(registry)
+    counter.inc(route="a")
+    histogram.observe(0.5)
+    gauge.set(3)
+    _worker(str(tmp_path), 1, counter=2, histogram=[1, 2.5, 2], gauge=4)
+
+    rendered = registry.render()
+    assert 'requests_total{route="a"} 3' in rendered
+    assert 'latency_seconds_bucket{le="1.0"} 2' in rendered
+    assert 'latency_seconds_count 3' in rendered
+    assert 'latency_seconds_sum 3.0' in rendered
+    assert f'in_flight{{worker="{os.getpid()}"}} 3' in rendered
+    assert 'in_flight{worker="1"} 4' in rendered
+
+
+def test_exited_workers_keep_their_counts_but_not_their_gauges(registry, tmp_path):
+    counter, _, _ = _register(registry)
+    _worker(str(tmp_path), 1, counter=2, histogram=[1, 2.5, 2], gauge=4)
+    metrics.mark_process_dead(str(tmp_path), 1)
+    _worker(str(tmp_path), 2, counter=5, histogram=[0, 3.0, 1], gauge=1)
+    metrics.mark_process_dead(str(tmp_path), 2)
+    counter.inc(route="a")
+
+    assert sorted(os.listdir(tmp_path)) == ["archive.json"]
+    rendered = registry.render()
+    assert 'requests_total{route="a"} 8' in rendered
+    assert 'latency_seconds_count 3' in rendered
+    assert 'worker="1"' not in rendered and 'worker="2"' not in rendered
@@ -0,0 +1,47 @@
+"""
+Creation of weekly partitions, see db/partitions.py.
+"""
+import asyncio
+import datetime
+import pytest
+from db import partitions
+
+
+class FakeDb:
+    """Has no partitions yet and refuses to create the one named in `fails`"""
+
+    def __init__(self, fails: str = None):
+        self.fails = fails
+        self.commands = []
+
+    async def execute_query(self, query, params=None):
+        return []
+
+    async def execute_command(self, command):
+        if self.fails and f" {self.fails} " in command:
+            raise RuntimeError("updated partition constraint for default partition would be violated")
+        self.commands.append(command)
+
+
+def _this_week() -> datetime.date:
+    return partitions.week_start(datetime.datetime.now(datetime.timezone.utc).date())
+
+
+def test_creates_this_week_and_the_weeks_ahead():
+    created = asyncio.run(partitions.ensure_partitions(FakeDb(), "msgs", weeks_ahead=2))
+    monday = _this_week()
+    assert created == [partitions.partition_name("msgs", monday + datetime.timedelta(weeks=w)) for w in range(3)]
+
+
+def test_failed_partition_is_logged_and_skipped_by_default():
+    failing = partitions.partition_name("msgs", _this_week())
+    created = asyncio.run(partitions.ensure_partitions(FakeDb(fails=failing), "msgs", weeks_ahead=1))
+    assert created == [partitions.partition_name("msgs", _this_week() + datetime.timedelta(weeks=1))]
+
+
+def test_strict_raises_on_the_first_failed_partition():
+    failing = partitions.partition_name("msgs", _this_week())
+    db = FakeDb(fails=failing)
+    with pytest.raises(RuntimeError):
+        asyncio.run(partitions.ensure_partitions(db, "msgs", weeks_ahead=1, strict=True))
+    assert db.commands == []
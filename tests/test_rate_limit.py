@@ -0,0 +1,127 @@
+"""
+Per-sender token buckets and coalescing of repeated texts, see Utils/rate_limit.py.
+"""
+import asyncio
+import time
+import pytest
+from Utils import rate_limit
+from Utils.dedup import RecentIds
+from Utils.webhook_decoder import InboundMessage, InteractiveReply
+
+POLICY = rate_limit.Policy(burst=3, per_second=0.5)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def limiter(monkeypatch, clock):
+    monkeypatch.setattr(rate_limit.constants, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limit, "BUCKETS", rate_limit.MemoryBuckets())
+    monkeypatch.setattr(rate_limit, "RECENT_TEXTS", RecentIds(ttl=30))
+    monkeypatch.setattr(rate_limit, "POLICIES", {
+        rate_limit.IMAGE: rate_limit.Policy(burst=2, per_second=1),
+        rate_limit.TEXT: rate_limit.Policy(burst=2, per_second=1),
+        rate_limit.INTERACTIVE: rate_limit.Policy(burst=2, per_second=1),
+    })
+
+
+def _text(message_id: str, body: str, sender: str = "15550001") -> InboundMessage:
+    return InboundMessage(message_id=message_id, from_number=sender, body=body)
+
+
+def _admitted(messages: list) -> list:
+    return [message.message_id for message in asyncio.run(rate_limit.admit(messages))]
+
+
+def test_bucket_allows_a_burst_then_refuses(clock):
+    buckets = rate_limit.MemoryBuckets()
+    assert [buckets.take("k", POLICY) for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_refills_at_its_rate_up_to_the_burst(clock):
+    buckets = rate_limit.MemoryBuckets()
+    for _ in range(3):
+        buckets.take("k", POLICY)
+    clock.now += 1
+    assert not buckets.take("k", POLICY)
+    clock.now += 1
+    assert buckets.take("k", POLICY)
+    clock.now += 3600
+    assert [buckets.take("k", POLICY) for _ in range(4)] == [True, True, True, False]
+
+
+def test_buckets_are_per_key(clock):
+    buckets = rate_limit.MemoryBuckets()
+    for _ in range(3):
+        buckets.take("a", POLICY)
+    assert not buckets.take("a", POLICY)
+    assert buckets.take("b", POLICY)
+
+
+def test_least_recently_used_buckets_are_evicted(clock):
+    buckets = rate_limit.MemoryBuckets(max_size=2)
+    for _ in range(3):
+        buckets.take("a", POLICY)
+    buckets.take("b", POLICY)
+    buckets.take("c", POLICY)
+    # "a" was evicted with its empty bucket and starts over full
+    assert buckets.take("a", POLICY)
+
+
+def test_message_kinds():
+    assert rate_limit.message_kind(InboundMessage("m", "1", media_ids=("img",))) == rate_limit.IMAGE
+    assert rate_limit.message_kind(InboundMessage("m", "1", reply=InteractiveReply("y", "Yes"))) == \
+        rate_limit.INTERACTIVE
+    assert rate_limit.message_kind(InboundMessage("m", "1", list_reply=InteractiveReply("p", "Pack"))) == \
+        rate_limit.INTERACTIVE
+    assert rate_limit.message_kind(_text("m", "hi")) == rate_limit.TEXT
+
+
+def test_sheds_senders_over_their_rate_only(limiter):
+    messages = [_text(f"a{i}", f"text {i}") for i in range(3)] + [_text("b0", "text 0", sender="15550002")]
+    assert _admitted(messages) == ["a0", "a1", "b0"]
+
+
+def test_kinds_have_separate_buckets(limiter):
+    texts = [_text(f"t{i}", f"text {i}") for i in range(2)]
+    images = [InboundMessage(f"i{i}", "15550001", media_ids=(f"img{i}",)) for i in range(2)]
+    assert _admitted(texts + images) == ["t0", "t1", "i0", "i1"]
+
+
+def test_identical_texts_are_coalesced_into_the_first(limiter, clock):
+    messages = [_text("m1", "Hello"), _text("m2", " hello "), _text("m3", "HELLO", sender="15550002")]
+    assert _admitted(messages) == ["m1", "m3"]
+    # Coalesced messages take no token
+    assert _admitted([_text("m4", "something else")]) == ["m4"]
+
+
+def test_text_may_repeat_once_the_coalescing_window_passed(limiter, clock):
+    assert _admitted([_text("m1", "yes")]) == ["m1"]
+    assert _admitted([_text("m2", "yes")]) == []
+    clock.now += 31
+    assert _admitted([_text("m3", "yes")]) == ["m3"]
+
+
+def test_empty_texts_and_invalid_media_are_not_coalesced(limiter):
+    messages = [InboundMessage("v1", "15550001", invalid_media=True),
+                InboundMessage("v2", "15550001", invalid_media=True)]
+    assert _admitted(messages) == ["v1", "v2"]
+
+
+def test_disabled_admits_everything(limiter, monkeypatch):
+    monkeypatch.setattr(rate_limit.constants, "RATE_LIMIT_ENABLED", False)
+    messages = [_text(f"m{i}", "same") for i in range(5)]
+    assert _admitted(messages) == [f"m{i}" for i in range(5)]
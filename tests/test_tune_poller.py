@@ -0,0 +1,35 @@
+"""
+Polling schedule of pending tunes, see app/tune_poller.py.
+"""
+from datetime import datetime, timedelta, timezone
+import pytest
+
+pytest.importorskip("aiohttp")
+from app import tune_poller
+
+NOW = datetime(2026, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("eta_in, delay", [
+    # Before the ETA: half the time left, between one and fifteen minutes
+    (timedelta(minutes=10), timedelta(minutes=5)),
+    (timedelta(minutes=90), timedelta(minutes=15)),
+    (timedelta(seconds=30), timedelta(minutes=1)),
+    # At and after the ETA: a quarter of the time overdue, between one and ten minutes
+    (timedelta(0), timedelta(minutes=1)),
+    (-timedelta(minutes=20), timedelta(minutes=5)),
+    (-timedelta(hours=3), timedelta(minutes=10)),
+])
+def test_next_poll_at(eta_in, delay):
+    assert tune_poller.next_poll_at(NOW, NOW + eta_in) == NOW + delay
+
+
+def test_polls_get_closer_as_the_eta_nears():
+    eta = NOW + timedelta(minutes=40)
+    polls = [NOW]
+    while polls[-1] < eta:
+        polls.append(tune_poller.next_poll_at(polls[-1], eta))
+    gaps = [later - earlier for earlier, later in zip(polls, polls[1:])]
+    assert gaps == sorted(gaps, reverse=True)
+    # The first poll at or past the ETA is within the minimum interval of it
+    assert polls[-1] - eta < tune_poller.MIN_POLL_INTERVAL
@@ -0,0 +1,94 @@
+"""
+Decoding of WhatsApp Cloud API webhooks, see Utils/webhook_decoder.py.
+"""
+import json
+from Utils import webhook_decoder
+
+OUR_NUMBER_ID = "1111"
+OTHER_NUMBER_ID = "2222"
+
+
+def _change(phone_number_id: str, messages=None, statuses=None) -> dict:
+    value = {"messaging_product": "whatsapp", "metadata": {"phone_number_id": phone_number_id}}
+    if messages is not None:
+        value["messages"] = messages
+    if statuses is not None:
+        value["statuses"] = statuses
+    return {"field": "messages", "value": value}
+
+
+def _webhook(*changes) -> bytes:
+    return json.dumps({"object": "whatsapp_business_account",
+                       "entry": [{"id": "1", "changes": list(changes)}]}).encode()
+
+
+def _text(message_id: str, sender: str = "15550001", body: str = "hi") -> dict:
+    return {"from": sender, "id": message_id, "timestamp": "1700000000", "type": "text", "text": {"body": body}}
+
+
+def _status(message_id: str, status: str = "delivered") -> dict:
+    return {"id": message_id, "status": status, "timestamp": "1700000001", "recipient_id": "15550001"}
+
+
+def test_decodes_messages_addressed_to_our_number():
+    messages = webhook_decoder.decode_webhook(_webhook(_change(OUR_NUMBER_ID, [_text("m1")])), OUR_NUMBER_ID)
+    assert messages == [webhook_decoder.InboundMessage(
+        message_id="m1", from_number="15550001", body="hi", timestamp=1700000000)]
+
+
+def test_skips_changes_for_another_phone_number_id_but_keeps_the_rest():
+    raw = _webhook(
+        _change(OTHER_NUMBER_ID, [_text("foreign")]),
+        _change(OUR_NUMBER_ID, [_text("ours")]),
+        _change(OTHER_NUMBER_ID, statuses=[_status("foreign-status")]),
+    )
+    assert [m.message_id for m in webhook_decoder.decode_webhook(raw, OUR_NUMBER_ID)] == ["ours"]
+    assert webhook_decoder.decode_statuses(raw, OUR_NUMBER_ID) == []
+
+
+def test_skips_changes_without_metadata():
+    raw = _webhook({"field": "messages", "value": {"messages": [_text("m1")]}})
+    assert webhook_decoder.decode_webhook(raw, OUR_NUMBER_ID) == []
+
+
+def test_status_only_payload_is_recognised_and_has_no_messages():
+    raw = _webhook(_change(OUR_NUMBER_ID, statuses=[_status("s1"), _status("s2", "read")]))
+    assert webhook_decoder.is_status_only(raw)
+    assert webhook_decoder.decode_webhook(raw, OUR_NUMBER_ID) == []
+    assert webhook_decoder.decode_statuses(raw, OUR_NUMBER_ID) == [
+        webhook_decoder.StatusUpdate("s1", "delivered", 1700000001),
+        webhook_decoder.StatusUpdate("s2", "read", 1700000001),
+    ]
+
+
+def test_payload_with_messages_and_statuses_is_not_status_only():
+    raw = _webhook(_change(OUR_NUMBER_ID, [_text("m1")], [_status("s1")]))
+    assert not webhook_decoder.is_status_only(raw)
+    assert [m.message_id for m in webhook_decoder.decode_webhook(raw, OUR_NUMBER_ID)] == ["m1"]
+
+
+def test_message_text_mentioning_statuses_is_not_status_only():
+    raw = _webhook(_change(OUR_NUMBER_ID, [_text("m1", body='"statuses"')]))
+    assert not webhook_decoder.is_status_only(raw)
+
+
+def test_skips_errored_messages_and_flags_unsupported_types():
+    errored = dict(_text("bad"), errors=[{"code": 131051}])
+    audio = {"from": "15550001", "id": "voice", "type": "audio", "audio": {"id": "a1"}}
+    image = {"from": "15550001", "id": "pic", "type": "image", "image": {"id": "img1"}}
+    raw = _webhook(_change(OUR_NUMBER_ID, [errored, audio, image]))
+    decoded = {m.message_id: m for m in webhook_decoder.decode_webhook(raw, OUR_NUMBER_ID)}
+    assert set(decoded) == {"voice", "pic"}
+    assert decoded["voice"].invalid_media
+    assert decoded["pic"].media_ids == ("img1",) and not decoded["pic"].invalid_media
+
+
+def test_interactive_replies_round_trip_through_dicts():
+    button = {"from": "15550001", "id": "b1", "type": "interactive",
+              "interactive": {"type": "button_reply", "button_reply": {"id": "yes", "title": "Yes"}}}
+    listed = {"from": "15550001", "id": "l1", "type": "interactive",
+              "interactive": {"type": "list_reply", "list_reply": {"id": "pack-1", "title": "Pack"}}}
+    raw = _webhook(_change(OUR_NUMBER_ID, [button, listed]))
+    for message in webhook_decoder.decode_webhook(raw, OUR_NUMBER_ID):
+        assert webhook_decoder.message_from_dict(
+            json.loads(json.dumps(webhook_decoder.message_to_dict(message)))) == message